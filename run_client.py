@@ -1,8 +1,18 @@
 import argparse
+from typing import List
 
 from watchdawg.client.tcp_client import TCPClient
-from watchdawg.source import WebCamera
-from watchdawg.client.preprocessor import Resizer
+from watchdawg.source import (
+    BaseSource,
+    SyntheticSource,
+    VideoFileSource,
+    WebCamera,
+)
+from watchdawg.client.preprocessor import (
+    BaseFramePreprocessor,
+    MotionGate,
+    Resizer,
+)
 from watchdawg.util.decorators import measure_peak_ram
 from watchdawg.config import Config
 
@@ -10,23 +20,56 @@ from watchdawg.config import Config
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser()
     parser.add_argument("--host_address", type=str, default=Config.SERVER_HOST)
+    parser.add_argument(
+        "--motion_gate",
+        action="store_true",
+        help="Only send frames with motion, plus periodic keyframes",
+    )
+    parser.add_argument(
+        "--source",
+        type=str,
+        default="webcam",
+        help='"webcam", "synthetic", or a video file path or stream URL',
+    )
     return parser.parse_args()
 
 
+def create_source(source: str) -> BaseSource:
+    if source == "webcam":
+        return WebCamera()
+    elif source == "synthetic":
+        return SyntheticSource(width=1280, height=720, fps=30.0)
+    return VideoFileSource(source)
+
+
 @measure_peak_ram
 def main():
     args = parse_args()
-    source = WebCamera()
-    preprocessor = Resizer(
-        new_width=Config.MODEL_INPUT_WIDTH,
-        new_height=Config.MODEL_INPUT_HEIGHT,
-        flip=True,
-    )
+    source = create_source(args.source)
+    preprocessors: List[BaseFramePreprocessor] = [
+        Resizer(
+            new_width=Config.MODEL_INPUT_WIDTH,
+            new_height=Config.MODEL_INPUT_HEIGHT,
+            flip=True,
+        )
+    ]
+    if args.motion_gate:
+        # First, so static frames aren't even resized
+        preprocessors.insert(
+            0,
+            MotionGate(
+                threshold=Config.MOTION_GATE_THRESHOLD,
+                pixel_threshold=Config.MOTION_GATE_PIXEL_THRESHOLD,
+                keyframe_interval=Config.MOTION_GATE_KEYFRAME_INTERVAL,
+                hold_time=Config.MOTION_GATE_HOLD_TIME,
+                roi=Config.MOTION_GATE_ROI,
+            ),
+        )
     try:
         tcp_client = TCPClient(
             "Mac",
             video_source=source,
-            frame_preprocessor=preprocessor,
+            frame_preprocessor=preprocessors,
             server_host=args.host_address,
         )
         tcp_client.start_client()
@@ -0,0 +1,29 @@
+import time
+
+import pytest
+
+from watchdawg.backend.batching import AdaptiveBatchPolicy
+
+
+@pytest.mark.parametrize(
+    "count_arrivals, expected", [(True, 100), (False, 40)]
+)
+def test_arrival_rate(monkeypatch, count_arrivals, expected):
+    """100 frames/s arrive and the model serves 40. Only counting arrivals
+    at the queue sees the 100
+    """
+    clock = [0.0]
+    arrived = [0]
+    monkeypatch.setattr(time, "perf_counter", lambda: clock[0])
+    policy = AdaptiveBatchPolicy(
+        max_batch_size=8,
+        max_time_window=0.1,
+        latency_target_p99=1.0,
+        decision_interval=1e9,
+        arrivals=(lambda: arrived[0]) if count_arrivals else None,
+    )
+    for _ in range(11):
+        policy.record_batch(4, 0.1)
+        clock[0] += 0.1
+        arrived[0] += 10
+    assert policy.report()["arrival_rate"] == pytest.approx(expected)
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from watchdawg.backend.detections_store import (
+    BLOCK_ROWS,
+    RECORD_DTYPE,
+    DetectionsStore,
+)
+from watchdawg.backend.messages import Detections
+
+
+def detections(class_ids, scores) -> Detections:
+    return Detections(
+        boxes=np.tile(
+            np.array([10, 20, 110, 220], dtype=np.float32),
+            (len(class_ids), 1),
+        ),
+        class_ids=np.array(class_ids, dtype=np.int32),
+        scores=np.array(scores, dtype=np.float32),
+    )
+
+
+def records(timestamps) -> np.ndarray:
+    result = np.zeros(len(timestamps), dtype=RECORD_DTYPE)
+    result["timestamp"] = timestamps
+    result["sequence"] = np.arange(len(timestamps))
+    result["class_id"] = np.arange(len(timestamps)) % 3
+    return result
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = DetectionsStore(
+        str(tmp_path), buffer_rows=1000, segment_rows=BLOCK_ROWS * 2
+    )
+    yield store
+    store.close()
+
+
+def test_append_and_query(store):
+    store.append(
+        "camera", 100.0, 1, detections([0, 2], [0.9, 0.4]), (200, 400)
+    )
+    store.append("camera", 101.0, 2, detections([0], [0.6]), (200, 400))
+
+    result = store.query("camera")
+    assert list(result["timestamp"]) == [100.0, 100.0, 101.0]
+    assert list(result["sequence"]) == [1, 1, 2]
+    np.testing.assert_allclose(result["box"][0], [0.05, 0.05, 0.55, 0.55])
+
+    assert len(store.query("camera", class_ids=[2])) == 1
+    assert len(store.query("camera", min_score=0.5)) == 2
+    assert len(store.query("camera", start=100.5)) == 1
+    assert len(store.query("camera", end=100.5)) == 2
+    assert len(store.query("other")) == 0
+
+
+def test_queries_across_segments_and_reopening(tmp_path, store):
+    timestamps = np.arange(BLOCK_ROWS * 5, dtype=np.float64)
+    # Clocks may jump back, zone maps must not assume sorted records
+    timestamps[BLOCK_ROWS * 3 :] -= BLOCK_ROWS * 2
+    store.append_records("camera", records(timestamps))
+
+    def expected(start, end):
+        return np.count_nonzero((timestamps >= start) & (timestamps < end))
+
+    for start, end in [(0, 10), (5000, 9000), (100, 15000)]:
+        assert len(store.query("camera", start, end)) == expected(start, end)
+    store.close()
+
+    reopened = DetectionsStore(str(tmp_path))
+    assert len(reopened.query("camera")) == len(timestamps)
+    assert len(reopened.query("camera", 5000, 9000)) == expected(5000, 9000)
+    reopened.close()
+
+
+def test_clients_do_not_collide(tmp_path, store):
+    names = ["cam 1", "cam/1", "cam_1", "..", "", "é" * 200]
+    for index, name in enumerate(names):
+        store.append_records(name, records(np.arange(index + 1.0)))
+    store.close()
+
+    reopened = DetectionsStore(str(tmp_path))
+    assert reopened.clients() == sorted(names)
+    for index, name in enumerate(names):
+        assert len(reopened.query(name)) == index + 1
+    reopened.close()
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from watchdawg.backend.event_recording import PrerollBuffer, TriggerRule
+from watchdawg.backend.messages import Detections
+
+
+def jpeg(index: int, size: int = 10) -> bytes:
+    return bytes([index % 256]) * size
+
+
+def drained(buffer: PrerollBuffer) -> list:
+    return [(data, frame.timestamp) for data, frame in buffer.drain()]
+
+
+def test_keeps_the_last_seconds():
+    buffer = PrerollBuffer(seconds=2.0, max_bytes=1000)
+    for index in range(10):
+        buffer.push(jpeg(index), 10, 10, timestamp=index * 0.5)
+    # Frames less than 2 seconds older than the last one
+    assert drained(buffer) == [
+        (jpeg(index), index * 0.5) for index in range(6, 10)
+    ]
+    assert len(buffer) == 0
+
+
+def test_wraps_around_without_corrupting_frames():
+    buffer = PrerollBuffer(seconds=100.0, max_bytes=35)
+    for index in range(10):
+        buffer.push(jpeg(index), 10, 10, timestamp=index)
+    frames = drained(buffer)
+    # Three frames fit, only whole frames come out
+    assert frames == [(jpeg(index), index) for index in (7, 8, 9)]
+
+
+def test_frames_of_varying_sizes():
+    buffer = PrerollBuffer(seconds=100.0, max_bytes=64)
+    pushed = []
+    for index in range(50):
+        data = jpeg(index, size=1 + index * 7 % 30)
+        buffer.push(data, 10, 10, timestamp=index, sequence=index)
+        pushed.append(data)
+    frames = list(buffer.drain())
+    sequences = [frame.sequence for _, frame in frames]
+    assert sequences == list(range(sequences[0], 50))
+    assert [data for data, _ in frames] == pushed[sequences[0] :]
+    assert sum(frame.size for _, frame in frames) <= 64
+
+
+def test_drops_frames_larger_than_the_buffer():
+    buffer = PrerollBuffer(seconds=10.0, max_bytes=16)
+    buffer.push(jpeg(1, size=8), 10, 10, timestamp=0)
+    buffer.push(jpeg(2, size=17), 10, 10, timestamp=1)
+    assert drained(buffer) == [(jpeg(1, size=8), 0)]
+
+
+def test_empty_after_drain():
+    buffer = PrerollBuffer(seconds=10.0, max_bytes=100)
+    buffer.push(jpeg(1), 10, 10, timestamp=0)
+    drained(buffer)
+    buffer.push(jpeg(2), 10, 10, timestamp=1)
+    assert drained(buffer) == [(jpeg(2), 1)]
+
+
+def test_trigger_rule():
+    detections = Detections(
+        boxes=np.array([[0, 0, 10, 10], [80, 80, 100, 100]], np.float32),
+        class_ids=np.array([0, 2], dtype=np.int32),
+        scores=np.array([0.9, 0.4], dtype=np.float32),
+    )
+    assert TriggerRule().matches(detections, 100, 100)
+    assert not TriggerRule(class_ids=[2]).matches(detections, 100, 100)
+    assert TriggerRule(class_ids=[2], min_score=0.3).matches(
+        detections, 100, 100
+    )
+    assert not TriggerRule(min_score=0.3, min_count=3).matches(
+        detections, 100, 100
+    )
+    assert not TriggerRule(roi=(0.5, 0.5, 1.0, 1.0)).matches(
+        detections, 100, 100
+    )
+    assert not TriggerRule().matches(None, 100, 100)
+    with pytest.raises(ValueError):
+        TriggerRule(roi=(0.5, 0.5, 0.4, 1.0))
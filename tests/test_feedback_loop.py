@@ -0,0 +1,189 @@
+import socket
+import struct
+import threading
+import time
+from queue import Empty
+from typing import Callable, List
+
+import pytest
+
+from watchdawg.backend.frame_decoder import FrameDecoder
+from watchdawg.backend.frame_scheduler import (
+    EncodedFramesQueue,
+    FairFrameScheduler,
+)
+from watchdawg.backend.messages import ProcessFrameMessage
+from watchdawg.backend.server import TCPServer
+from watchdawg.bench.common import find_free_port
+from watchdawg.client.quality_controller import (
+    DEFAULT_QUALITY_LEVELS,
+    AdaptiveQualityController,
+    SendSettings,
+)
+from watchdawg.client.tcp_client import TCPClient
+from watchdawg.config import Config
+from watchdawg.source.synthetic import SyntheticSource
+from watchdawg.util.frame_protocol import (
+    Feedback,
+    MessageType,
+    ProtocolError,
+    unpack_feedback,
+)
+
+
+SOURCE_FPS = 30.0
+BEST = DEFAULT_QUALITY_LEVELS[0]
+
+
+class SlowModel(threading.Thread):
+    """Takes frames off the scheduler at frame_time seconds each"""
+
+    def __init__(self, scheduler: FairFrameScheduler) -> None:
+        super().__init__(daemon=True)
+        self._scheduler = scheduler
+        self.frame_time = 0.0
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        while not self._stop_event.is_set():
+            try:
+                message = self._scheduler.get(timeout=0.1)
+            except Empty:
+                continue
+            if isinstance(message, ProcessFrameMessage):
+                time.sleep(self.frame_time)
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+def wait_for(
+    condition: Callable[[SendSettings], bool],
+    client: TCPClient,
+    timeout: float,
+    seen: List[SendSettings],
+) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        seen.append(client.settings)
+        if condition(client.settings):
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def degraded(settings: SendSettings) -> bool:
+    return (
+        settings.jpeg_quality < BEST.jpeg_quality
+        and settings.scale < BEST.scale
+        and 0 < settings.max_fps < SOURCE_FPS
+    )
+
+
+def recovered(settings: SendSettings) -> bool:
+    return (
+        settings.jpeg_quality == BEST.jpeg_quality
+        and settings.scale == BEST.scale
+        and (settings.max_fps == 0 or settings.max_fps >= SOURCE_FPS)
+    )
+
+
+def test_client_steps_down_and_recovers_with_a_slow_model(monkeypatch):
+    """Server and client over loopback: while the model is slower than the
+    camera the client sends fewer, smaller frames, and goes back to full
+    rate and quality once the model keeps up again
+    """
+    monkeypatch.setattr(Config, "CLIENT_MAX_LAG", 0.3)
+    port = find_free_port()
+    scheduler = FairFrameScheduler(client_queue_size=10)
+    encoded = EncodedFramesQueue(
+        max_frames=50, client_queue_size=10, on_drop=scheduler.record_drop
+    )
+    server = TCPServer(
+        events_queue=encoded,
+        port=port,
+        feedback_provider=scheduler.feedback,
+        feedback_interval=0.1,
+    )
+    decoder = FrameDecoder(encoded, scheduler, workers=1)
+    model = SlowModel(scheduler)
+    model.frame_time = 0.2
+    server.start_server()
+    decoder.start()
+    model.start()
+    time.sleep(0.1)  # The server listens from its own thread
+    client = TCPClient(
+        "camera",
+        SyntheticSource(160, 120, SOURCE_FPS),
+        server_host="127.0.0.1",
+        server_port=port,
+        adaptive_quality=True,
+        threaded=False,
+    )
+
+    def send() -> None:
+        try:
+            client.start_client()
+        except OSError:
+            pass  # The socket is closed under it at the end
+
+    sender = threading.Thread(target=send, daemon=True)
+    sender.start()
+    seen: List[SendSettings] = []  # For the failure message
+    try:
+        assert wait_for(degraded, client, 15.0, seen), seen[-1]
+        model.frame_time = 0.0
+        assert wait_for(recovered, client, 30.0, seen), seen[-1]
+    finally:
+        client.stop()
+        sender.join(timeout=2.0)
+        model.stop()
+        decoder.stop()
+        server.stop_server()
+        decoder.join(timeout=2.0)
+
+
+def test_controller_respects_the_servers_rate():
+    controller = AdaptiveQualityController(max_lag=1.0, recover_after=1)
+    settings = controller.update(Feedback(12.0, 0, 0, lag=0.1), 20.0)
+    assert settings.max_fps == 12.0
+    assert settings.jpeg_quality == BEST.jpeg_quality
+
+    settings = controller.update(Feedback(12.0, 5, 3, lag=3.0), 12.0)
+    assert settings.max_fps == pytest.approx(9.0)
+    assert settings.jpeg_quality < BEST.jpeg_quality
+
+    for _ in range(len(DEFAULT_QUALITY_LEVELS) + 2):
+        settings = controller.update(Feedback(0.0, 0, 3, lag=0.0), 9.0)
+    assert settings == SendSettings(0.0, BEST.jpeg_quality, BEST.scale)
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        b"XX" + bytes(30),  # Bad magic
+        struct.pack(">2sBBI", b"WD", 1, MessageType.FEEDBACK, 24) + bytes(24),
+        struct.pack(">2sBBI", b"WD", 1, MessageType.FEEDBACK, 4) + bytes(4),
+    ],
+)
+def test_client_survives_malformed_feedback(message):
+    with socket.create_server(("127.0.0.1", 0)) as listener:
+        client = TCPClient(
+            "camera",
+            SyntheticSource(16, 16, SOURCE_FPS),
+            server_host="127.0.0.1",
+            server_port=listener.getsockname()[1],
+            adaptive_quality=False,
+        )
+        connection, _ = listener.accept()
+        with connection:
+            connection.sendall(message)
+            # Logged, the feedback thread doesn't die with a traceback
+            client._receive_feedback()
+        assert client.settings.max_fps == 0.0
+        client.stop()
+
+
+def test_unpack_feedback_checks_the_size():
+    with pytest.raises(ProtocolError):
+        unpack_feedback(b"\0" * 4)
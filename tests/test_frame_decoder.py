@@ -0,0 +1,24 @@
+import cv2
+import numpy as np
+import pytest
+
+from watchdawg.backend.frame_decoder import decode_frame
+
+
+@pytest.mark.parametrize(
+    "target_size, expected_shape",
+    [
+        (None, (720, 1280, 3)),
+        ((640, 640), (360, 640, 3)),  # Letterboxed, not stretched
+        ((320, 320), (180, 320, 3)),
+        ((1280, 720), (720, 1280, 3)),
+        ((100, 100), (90, 160, 3)),  # 1/8 is the smallest scale
+    ],
+)
+def test_decodes_at_reduced_scale_keeping_the_aspect_ratio(
+    target_size, expected_shape
+):
+    frame = np.zeros((720, 1280, 3), dtype=np.uint8)
+    payload = cv2.imencode(".jpg", frame)[1].tobytes()
+    decoded, _, _ = decode_frame(payload, (1280, 720), target_size)
+    assert decoded.shape == expected_shape
@@ -0,0 +1,92 @@
+import struct
+
+import pytest
+
+from watchdawg.config import Config
+from watchdawg.util.frame_protocol import (
+    FRAME_META_SIZE,
+    MAX_HELLO_SIZE,
+    PREAMBLE_SIZE,
+    Codec,
+    Feedback,
+    FrameMeta,
+    MessageType,
+    ProtocolError,
+    pack_feedback,
+    pack_frame_header,
+    pack_hello,
+    unpack_feedback,
+    unpack_frame_meta,
+    unpack_hello,
+    unpack_preamble,
+)
+
+
+def preamble(
+    message_type: int, body_size: int, magic=b"WD", version=1
+) -> bytes:
+    return struct.pack(">2sBBI", magic, version, message_type, body_size)
+
+
+def test_frame_header_round_trip():
+    meta = FrameMeta(Codec.JPEG, 1280, 720, 42, 1.7e9 + 0.25)
+    header = pack_frame_header(meta, payload_size=1000)
+    assert len(header) == PREAMBLE_SIZE + FRAME_META_SIZE
+
+    parsed = unpack_preamble(header)
+    assert parsed.message_type == MessageType.FRAME
+    assert parsed.body_size == FRAME_META_SIZE + 1000
+    assert unpack_frame_meta(header[PREAMBLE_SIZE:]) == meta
+
+
+def test_hello_round_trip():
+    message = pack_hello("camera 1 é")
+    parsed = unpack_preamble(message)
+    assert parsed.message_type == MessageType.HELLO
+    assert unpack_hello(message[PREAMBLE_SIZE:]) == "camera 1 é"
+
+
+def test_feedback_round_trip():
+    feedback = Feedback(
+        target_fps=7.5, queued_frames=3, dropped_frames=2**40, lag=0.5
+    )
+    message = pack_feedback(feedback)
+    assert unpack_preamble(message).message_type == MessageType.FEEDBACK
+    assert unpack_feedback(message[PREAMBLE_SIZE:]) == feedback
+
+
+@pytest.mark.parametrize(
+    "header",
+    [
+        preamble(MessageType.FRAME, 100, magic=b"XX"),
+        preamble(MessageType.FRAME, 100, version=99),
+        preamble(99, 100),
+        preamble(MessageType.FRAME, FRAME_META_SIZE - 1),
+        preamble(MessageType.FRAME, Config.MAX_MESSAGE_SIZE + 1),
+        preamble(MessageType.FRAME, 2**32 - 1),
+        preamble(MessageType.HELLO, MAX_HELLO_SIZE + 1),
+        preamble(MessageType.FEEDBACK, 1000),
+    ],
+)
+def test_bad_preamble(header):
+    with pytest.raises(ProtocolError):
+        unpack_preamble(header)
+
+
+def test_preamble_max_body_size():
+    header = preamble(MessageType.FRAME, 1000)
+    assert unpack_preamble(header, max_body_size=1000).body_size == 1000
+    with pytest.raises(ProtocolError):
+        unpack_preamble(header, max_body_size=999)
+
+
+def test_bad_bodies():
+    with pytest.raises(ProtocolError):
+        unpack_frame_meta(struct.pack(">BxHHQd", 9, 1, 1, 0, 0.0))
+    with pytest.raises(ProtocolError):
+        unpack_hello(b"\xff\xfe")
+
+
+def test_hello_too_long():
+    with pytest.raises(ValueError):
+        pack_hello("x" * (MAX_HELLO_SIZE + 1))
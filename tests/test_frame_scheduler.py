@@ -0,0 +1,145 @@
+import collections
+import uuid
+
+import numpy as np
+
+from watchdawg.backend.frame_scheduler import (
+    ClientPolicy,
+    EncodedFramesQueue,
+    FairFrameScheduler,
+)
+from watchdawg.backend.messages import (
+    ClientDisconnectedMessage,
+    EncodedFrameMessage,
+    NewClientConnectedMessage,
+    ProcessFrameMessage,
+)
+
+
+FRAME = np.zeros((2, 2, 3), dtype=np.uint8)
+
+
+def connect(scheduler: FairFrameScheduler, name: str) -> uuid.UUID:
+    client_id = uuid.uuid4()
+    scheduler.put(NewClientConnectedMessage(client_id, ("", 0), name))
+    assert isinstance(scheduler.get_nowait(), NewClientConnectedMessage)
+    return client_id
+
+
+def put_frames(
+    scheduler: FairFrameScheduler, client_id: uuid.UUID, count: int
+) -> None:
+    for sequence in range(count):
+        scheduler.put(ProcessFrameMessage(client_id, FRAME, sequence=sequence))
+
+
+def served(scheduler: FairFrameScheduler, count: int) -> collections.Counter:
+    return collections.Counter(
+        scheduler.get_nowait().client_id for _ in range(count)
+    )
+
+
+def test_equal_weights_share_equally():
+    scheduler = FairFrameScheduler(client_queue_size=100)
+    busy, quiet = connect(scheduler, "busy"), connect(scheduler, "quiet")
+    put_frames(scheduler, busy, 90)
+    put_frames(scheduler, quiet, 30)
+    counts = served(scheduler, 40)
+    assert counts[busy] == counts[quiet] == 20
+
+
+def test_weights_share_proportionally():
+    scheduler = FairFrameScheduler(
+        client_queue_size=100,
+        policies={"heavy": ClientPolicy(weight=3.0)},
+    )
+    heavy, light = connect(scheduler, "heavy"), connect(scheduler, "light")
+    put_frames(scheduler, heavy, 100)
+    put_frames(scheduler, light, 100)
+    counts = served(scheduler, 80)
+    assert counts[heavy] == 60
+    assert counts[light] == 20
+
+
+def test_full_queue_drops_oldest():
+    scheduler = FairFrameScheduler(client_queue_size=3)
+    client_id = connect(scheduler, "camera")
+    put_frames(scheduler, client_id, 5)
+    assert scheduler.qsize() == 3
+    assert [scheduler.get_nowait().sequence for _ in range(3)] == [2, 3, 4]
+    assert scheduler.report()["camera"]["dropped_overflow"] == 2
+    # Arrivals count, not what is left to serve
+    assert scheduler.frames_admitted() == 5
+
+
+def test_disconnect_waits_for_queued_frames():
+    scheduler = FairFrameScheduler(client_queue_size=10)
+    client_id = connect(scheduler, "camera")
+    put_frames(scheduler, client_id, 2)
+    scheduler.put(ClientDisconnectedMessage(client_id, ("", 0)))
+    assert isinstance(scheduler.get_nowait(), ProcessFrameMessage)
+    assert isinstance(scheduler.get_nowait(), ProcessFrameMessage)
+    assert isinstance(scheduler.get_nowait(), ClientDisconnectedMessage)
+    assert scheduler.empty()
+    assert scheduler.feedback(client_id) is None
+
+
+def encoded(client_id: uuid.UUID, sequence: int) -> EncodedFrameMessage:
+    return EncodedFrameMessage(client_id, b"", 2, 2, sequence=sequence)
+
+
+def test_encoded_frames_queue_drops_the_clients_oldest():
+    dropped = []
+    queue = EncodedFramesQueue(
+        max_frames=100, client_queue_size=3, on_drop=dropped.append
+    )
+    busy, quiet = uuid.uuid4(), uuid.uuid4()
+    queue.put(NewClientConnectedMessage(busy, ("", 0), "busy"))
+    queue.put_nowait(encoded(quiet, 0))
+    for sequence in range(5):
+        queue.put_nowait(encoded(busy, sequence))
+
+    assert isinstance(queue.get_nowait(), NewClientConnectedMessage)
+    frames = [queue.get_nowait() for _ in range(queue.qsize())]
+    assert [(f.client_id, f.sequence) for f in frames] == [
+        (quiet, 0),
+        (busy, 2),
+        (busy, 3),
+        (busy, 4),
+    ]
+    assert dropped == [busy, busy]
+
+
+def test_encoded_frames_queue_full_drops_the_busiest_client():
+    queue = EncodedFramesQueue(max_frames=4, client_queue_size=10)
+    busy, quiet = uuid.uuid4(), uuid.uuid4()
+    for sequence in range(3):
+        queue.put_nowait(encoded(busy, sequence))
+    queue.put_nowait(encoded(quiet, 0))
+    queue.put_nowait(encoded(quiet, 1))
+    queue.put(ClientDisconnectedMessage(quiet, ("", 0)))
+
+    messages = [queue.get_nowait() for _ in range(queue.qsize())]
+    assert [
+        (m.client_id, m.sequence)
+        for m in messages
+        if isinstance(m, EncodedFrameMessage)
+    ] == [(busy, 1), (busy, 2), (quiet, 0), (quiet, 1)]
+    assert isinstance(messages[-1], ClientDisconnectedMessage)
+    assert queue.dropped == 1
+
+
+def test_drops_before_the_scheduler_slow_the_client_down():
+    scheduler = FairFrameScheduler(client_queue_size=10)
+    client_id = connect(scheduler, "camera")
+    put_frames(scheduler, client_id, 10)
+    served(scheduler, 10)
+    scheduler.feedback(client_id)
+
+    put_frames(scheduler, client_id, 10)
+    served(scheduler, 10)
+    scheduler.record_drop(client_id)
+    feedback = scheduler.feedback(client_id)
+    assert feedback.dropped_frames == 1
+    assert feedback.target_fps > 0
+    assert scheduler.report()["camera"]["dropped_upstream"] == 1
@@ -0,0 +1,60 @@
+import time
+from typing import Any, List
+
+import numpy as np
+import pytest
+
+from watchdawg.backend.inference_pool import MultiProcessModel
+from watchdawg.backend.model import MLModel
+
+
+HANG = 255
+
+
+class EchoModel(MLModel):
+    """Returns the frames it was given, hangs on frames of HANG"""
+
+    def __call__(self, batch: List[np.ndarray]) -> List[Any]:
+        if any(frame[0, 0, 0] == HANG for frame in batch):
+            time.sleep(60)
+        return [frame.copy() for frame in batch]
+
+
+@pytest.fixture
+def pool():
+    pool = MultiProcessModel(
+        EchoModel,
+        workers=1,
+        frame_size=(8, 8),
+        slots_per_worker=2,
+        pin_cpus=False,
+        start_timeout=60.0,
+        task_timeout=1.0,
+    )
+    yield pool
+    pool.close()
+
+
+def frames(first: int) -> List[np.ndarray]:
+    return [np.full((8, 8, 3), first + i, dtype=np.uint8) for i in range(2)]
+
+
+def check(outputs: List[np.ndarray], expected: List[np.ndarray]) -> None:
+    assert len(outputs) == len(expected)
+    for output, frame in zip(outputs, expected):
+        np.testing.assert_array_equal(output, frame)
+
+
+def test_late_results_are_not_mistaken_for_current_ones(pool):
+    check(pool(frames(0)), frames(0))  # Task 0
+
+    # A second result for task 0 turning up late
+    pool._results.put((0, 0, 0, "done", ["stale"] * 2))
+    check(pool(frames(10)), frames(10))  # Task 1
+
+    with pytest.raises(RuntimeError, match="took longer"):
+        pool(frames(HANG - 1))  # Task 2, the worker is replaced
+
+    # The replaced worker answering task 3 after all
+    pool._results.put((0, 0, 3, "done", ["stale"] * 2))
+    check(pool(frames(20)), frames(20))  # Task 3
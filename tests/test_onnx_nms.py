@@ -0,0 +1,42 @@
+import cv2
+import numpy as np
+
+from watchdawg.backend.onnx_model import fast_nms, nms
+
+
+def chain() -> tuple:
+    """A overlaps B, B overlaps C, A and C don't overlap"""
+    boxes = np.array(
+        [[0, 0, 10, 10], [5, 0, 15, 10], [10, 0, 20, 10]], dtype=np.float32
+    )
+    scores = np.array([0.9, 0.8, 0.7], dtype=np.float32)
+    return boxes, scores
+
+
+def test_suppressed_boxes_do_not_suppress():
+    boxes, scores = chain()
+    assert list(nms(boxes, scores, 0.3)) == [0, 2]
+    # Fast-NMS also drops C, over B which was itself dropped
+    assert list(fast_nms(boxes, scores, 0.3)) == [0]
+
+
+def test_matches_opencv():
+    rng = np.random.default_rng(0)
+    xy = rng.uniform(0, 200, (300, 2)).astype(np.float32)
+    wh = rng.uniform(10, 60, (300, 2)).astype(np.float32)
+    boxes = np.concatenate((xy, xy + wh), axis=1)
+    scores = rng.uniform(0, 1, 300).astype(np.float32)
+
+    expected = cv2.dnn.NMSBoxes(
+        [list(map(float, b)) for b in np.concatenate((xy, wh), axis=1)],
+        scores.tolist(),
+        0.0,
+        0.45,
+    )
+    assert sorted(nms(boxes, scores, 0.45)) == sorted(np.ravel(expected))
+
+
+def test_empty():
+    boxes = np.zeros((0, 4), dtype=np.float32)
+    scores = np.zeros(0, dtype=np.float32)
+    assert len(nms(boxes, scores, 0.45)) == 0
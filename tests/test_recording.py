@@ -0,0 +1,98 @@
+import cv2
+import numpy as np
+import pytest
+
+from watchdawg.backend.recording import MJPEGAviWriter
+from watchdawg.util.disk_writer import DiskWriter, FsyncPolicy
+
+
+WIDTH, HEIGHT = 160, 120
+
+
+def frames(count: int) -> list:
+    """Frames distinguishable by their mean brightness"""
+    return [
+        np.full((HEIGHT, WIDTH, 3), 20 + index * 20, dtype=np.uint8)
+        for index in range(count)
+    ]
+
+
+def encode(frame: np.ndarray) -> bytes:
+    ok, jpeg = cv2.imencode(".jpg", frame)
+    assert ok
+    return jpeg.tobytes()
+
+
+def read_back(path: str) -> tuple:
+    capture = cv2.VideoCapture(path)
+    assert capture.isOpened()
+    fps = capture.get(cv2.CAP_PROP_FPS)
+    decoded = []
+    while True:
+        grabbed, frame = capture.read()
+        if not grabbed:
+            break
+        decoded.append(frame)
+    capture.release()
+    return decoded, fps
+
+
+@pytest.fixture
+def disk_writer():
+    writer = DiskWriter(fsync_policy=FsyncPolicy.NEVER)
+    writer.start()
+    yield writer
+    if writer.is_alive():
+        writer.stop()
+        writer.join()
+
+
+@pytest.mark.parametrize("threaded", [False, True])
+def test_written_frames_read_back(tmp_path, disk_writer, threaded):
+    path = str(tmp_path / "video.avi")
+    writer = MJPEGAviWriter(
+        path, WIDTH, HEIGHT, disk_writer=disk_writer if threaded else None
+    )
+    originals = frames(8)
+    for index, frame in enumerate(originals):
+        # Every other JPEG of odd size, chunks must be padded
+        data = encode(frame)
+        writer.write(data + b"\0" * (index % 2), captured_at=index * 0.2)
+    closed = []
+    writer.close(lambda: closed.append(True))
+    if threaded:
+        disk_writer.stop()
+        disk_writer.join()
+    assert closed == [True]
+    assert writer.frames == 8
+
+    decoded, fps = read_back(path)
+    assert len(decoded) == 8
+    for original, frame in zip(originals, decoded):
+        assert frame.shape == original.shape
+        assert abs(frame.mean() - original.mean()) < 2
+    assert fps == pytest.approx(5.0, rel=0.01)
+
+
+def test_close_is_idempotent(tmp_path):
+    path = str(tmp_path / "video.avi")
+    writer = MJPEGAviWriter(path, WIDTH, HEIGHT)
+    writer.write(encode(frames(1)[0]))
+    writer.close()
+    writer.close()
+    assert len(read_back(path)[0]) == 1
+
+
+def test_disk_writer_keeps_the_order_of_operations(tmp_path, disk_writer):
+    path = str(tmp_path / "file")
+    events = []
+    file = disk_writer.open(path)
+    file.write(b"0123456789")
+    file.write_at(2, b"ab")
+    file.write(b"!")
+    assert file.tell() == 11
+    file.close(lambda: events.append(open(path, "rb").read()))
+    disk_writer.call(lambda: events.append("after close"))
+    disk_writer.stop()
+    disk_writer.join()
+    assert events == [b"01ab456789!", "after close"]
@@ -0,0 +1,62 @@
+import socket
+import threading
+
+import pytest
+
+from watchdawg.util.frame_protocol import ProtocolError
+from watchdawg.util.socket_reader import SocketReader
+
+
+@pytest.fixture
+def sockets():
+    sender, receiver = socket.socketpair()
+    yield sender, receiver
+    sender.close()
+    receiver.close()
+
+
+def test_reads_messages_in_order(sockets):
+    sender, receiver = sockets
+    reader = SocketReader(receiver, capacity=64)
+    messages = [bytes([index]) * (index * 7 + 1) for index in range(20)]
+    sender.sendall(b"".join(messages))
+    for message in messages:
+        assert bytes(reader.read(len(message))) == message
+    assert reader.bytes_received == sum(map(len, messages))
+
+
+def test_grows_for_large_messages(sockets):
+    sender, receiver = sockets
+    reader = SocketReader(receiver, capacity=16)
+    payload = bytes(range(256)) * 64
+    thread = threading.Thread(target=sender.sendall, args=(b"ab" + payload,))
+    thread.start()
+    assert bytes(reader.read(2)) == b"ab"
+    assert bytes(reader.read(len(payload))) == payload
+    assert reader.capacity >= len(payload)
+    thread.join()
+
+
+def test_earlier_views_survive_growing(sockets):
+    sender, receiver = sockets
+    reader = SocketReader(receiver, capacity=8)
+    sender.sendall(b"12345678" + b"x" * 100)
+    first = reader.read(8)
+    reader.read(100)
+    assert bytes(first) == b"12345678"
+
+
+def test_returns_none_when_closed(sockets):
+    sender, receiver = sockets
+    reader = SocketReader(receiver, capacity=64)
+    sender.sendall(b"abc")
+    sender.close()
+    assert reader.read(4) is None
+
+
+def test_rejects_reads_over_max_message_size(sockets):
+    _, receiver = sockets
+    reader = SocketReader(receiver, capacity=16, max_message_size=1024)
+    with pytest.raises(ProtocolError):
+        reader.read(1025)
+    assert reader.capacity == 16
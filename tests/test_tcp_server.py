@@ -0,0 +1,62 @@
+import socket
+import time
+
+import pytest
+
+from watchdawg.backend.frame_scheduler import EncodedFramesQueue
+from watchdawg.backend.messages import (
+    EncodedFrameMessage,
+    NewClientConnectedMessage,
+)
+from watchdawg.backend.server import AsyncTCPServer, TCPServer
+from watchdawg.bench.common import find_free_port
+from watchdawg.util.frame_protocol import (
+    Codec,
+    FrameMeta,
+    pack_frame_header,
+    pack_hello,
+)
+
+
+def connect(port: int, timeout: float = 5.0) -> socket.socket:
+    """The server listens from its own thread, soon after starting"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return socket.create_connection(("127.0.0.1", port))
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.01)
+
+
+@pytest.mark.parametrize("server_type", [TCPServer, AsyncTCPServer])
+def test_stalled_decoder_does_not_stall_readers(server_type):
+    """Nothing consumes the queue, the server keeps reading and only the
+    client's latest frames are left
+    """
+    queue = EncodedFramesQueue(max_frames=10, client_queue_size=5)
+    port = find_free_port()
+    server = server_type(events_queue=queue, port=port)
+    server.start_server()
+    payload = b"\xff" * 1000
+    try:
+        with connect(port) as sock:
+            sock.sendall(pack_hello("camera"))
+            for sequence in range(200):
+                meta = FrameMeta(Codec.JPEG, 4, 4, sequence, 0.0)
+                sock.sendall(pack_frame_header(meta, len(payload)) + payload)
+
+            deadline = time.monotonic() + 5.0
+            while time.monotonic() < deadline and queue.dropped < 195:
+                time.sleep(0.01)
+    finally:
+        server.stop_server()
+
+    messages = [queue.get_nowait() for _ in range(queue.qsize())]
+    assert isinstance(messages[0], NewClientConnectedMessage)
+    assert [
+        message.sequence
+        for message in messages
+        if isinstance(message, EncodedFrameMessage)
+    ] == list(range(195, 200))
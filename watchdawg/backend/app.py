@@ -1,44 +1,151 @@
+import functools
+import os
+import signal
 import time
 import threading
 from queue import Queue
+from typing import Optional
 
-from watchdawg.backend.server import TCPServer
+from watchdawg.backend.server import (
+    BaseServer,
+    FeedbackProvider,
+    TCPServer,
+    AsyncTCPServer,
+)
+from watchdawg.backend.frame_decoder import FrameDecoder
+from watchdawg.backend.frame_scheduler import (
+    ClientPolicy,
+    EncodedFramesQueue,
+    FairFrameScheduler,
+)
 from watchdawg.backend.feed_processor import FeedProcessor
+from watchdawg.backend.batching import AdaptiveBatchPolicy
+from watchdawg.backend.detections_store import DetectionsStore
 from watchdawg.backend.results_writer import ResultsWriter, ResultWriterMode
+from watchdawg.backend.tracing import FrameTracer
 from watchdawg.config import Config
+from watchdawg.util.metrics import MetricsServer
+from watchdawg.util.profiler import SamplingProfiler
 from watchdawg.util.resources import (
+    ResourceSampler,
     get_current_process_ram_usage,
     get_current_process_cpu_usage,
 )
+from watchdawg.backend import metrics
 from watchdawg.backend.messages import BusMessage
 from watchdawg.util.logger import get_logger
-from watchdawg.backend.model import UltralyticsYOLO
+from watchdawg.backend.model import MLModel, load_model
+from watchdawg.backend.inference_pool import MultiProcessModel
 
 
 logger = get_logger("app")
 
 
+def create_server(
+    implementation: str,
+    events_queue: "Queue[BusMessage]",
+    port: int,
+    feedback_provider: Optional[FeedbackProvider] = None,
+    feedback_interval: float = Config.CLIENT_FEEDBACK_INTERVAL,
+) -> BaseServer:
+    if implementation == "threaded":
+        return TCPServer(
+            events_queue=events_queue,
+            port=port,
+            feedback_provider=feedback_provider,
+            feedback_interval=feedback_interval,
+        )
+    elif implementation == "asyncio":
+        return AsyncTCPServer(
+            events_queue=events_queue,
+            port=port,
+            feedback_provider=feedback_provider,
+            feedback_interval=feedback_interval,
+        )
+    raise ValueError(f"Unknown server implementation {implementation}")
+
+
+# Modes recording the JPEGs clients send
+_RECORDING_MODES = {
+    ResultWriterMode.RECORD_FRAMES,
+    ResultWriterMode.RECORD_EVENTS,
+}
+
+
 class App:
     def __init__(
         self,
         mode: ResultWriterMode,
         save_feed_folder: str = Config.PROCESSED_FEED_LOCAL_FOLDER,
+        model: Optional[MLModel] = None,
+        port: int = Config.SERVER_PORT,
+        server_implementation: str = Config.SERVER_IMPLEMENTATION,
+        metrics_port: int = Config.METRICS_PORT,
     ) -> None:
-        self._server_processor_bus: "Queue[BusMessage]" = Queue(
-            Config.DECODED_FRAMES_QUEUE_SIZE
+        """model and ports default to what Config describes, passing them
+        in is meant for running the app embedded, e.g. in benchmarks
+        """
+        self._model = model if model is not None else self._load_model()
+        self._tracer = FrameTracer() if Config.TRACE_FRAMES else None
+        self._frame_scheduler = FairFrameScheduler(
+            client_queue_size=Config.CLIENT_QUEUE_SIZE,
+            default_policy=ClientPolicy(
+                weight=Config.CLIENT_DEFAULT_WEIGHT,
+                max_fps=Config.CLIENT_DEFAULT_MAX_FPS,
+            ),
+            policies={
+                name: ClientPolicy(**policy)
+                for name, policy in Config.CLIENT_POLICIES.items()
+            },
+        )
+        # Drops reach the scheduler, whose feedback slows the client down
+        self._server_decoder_bus: "Queue[BusMessage]" = EncodedFramesQueue(
+            max_frames=Config.ENCODED_FRAMES_QUEUE_SIZE,
+            client_queue_size=Config.CLIENT_ENCODED_QUEUE_SIZE,
+            on_drop=self._frame_scheduler.record_drop,
         )
         self.processor_writer_bus: "Queue[BusMessage]" = Queue(
             Config.PROCESSED_BATCHES_QUEUE_SIZE
         )
-        self._server = TCPServer(
-            events_queue=self._server_processor_bus, port=Config.SERVER_PORT
+        self._server = create_server(
+            server_implementation,
+            events_queue=self._server_decoder_bus,
+            port=port,
+            feedback_provider=self._frame_scheduler.feedback,
+        )
+        self._frame_decoder = FrameDecoder(
+            events_queue_in=self._server_decoder_bus,
+            events_queue_out=self._frame_scheduler,
+            workers=Config.DECODE_WORKERS,
+            executor_type=Config.DECODE_EXECUTOR,
+            max_in_flight=Config.DECODE_MAX_IN_FLIGHT,
+            target_size=(
+                (Config.MODEL_INPUT_WIDTH, Config.MODEL_INPUT_HEIGHT)
+                if Config.DECODE_TO_MODEL_INPUT_SIZE
+                else None
+            ),
+            trace_frames=Config.TRACE_FRAMES,
+            keep_encoded=mode in _RECORDING_MODES,
         )
+        self._frame_decoder.name = "FrameDecoder"  # Thread name
         self._feed_processor = FeedProcessor(
-            events_queue_in=self._server_processor_bus,
+            events_queue_in=self._frame_scheduler,
             batch_size=Config.MODEL_BATCH_SIZE,
             build_batch_time_window=Config.BUILD_BATCH_TIME_WINDOW,
             events_queue_out=self.processor_writer_bus,
-            model=UltralyticsYOLO(model="yolov8n.pt"),
+            model=self._model,
+            pipeline_depth=Config.PIPELINE_DEPTH,
+            batch_policy=(
+                AdaptiveBatchPolicy(
+                    max_batch_size=Config.MODEL_BATCH_SIZE,
+                    max_time_window=Config.BUILD_BATCH_TIME_WINDOW,
+                    latency_target_p99=Config.ADAPTIVE_BATCHING_LATENCY_TARGET,
+                    decision_interval=Config.ADAPTIVE_BATCHING_INTERVAL,
+                    arrivals=self._frame_scheduler.frames_admitted,
+                )
+                if Config.ADAPTIVE_BATCHING
+                else None
+            ),
         )
         self._feed_processor.name = "FeedProcessor"  # Thread name
 
@@ -46,9 +153,30 @@ class App:
             events_queue_in=self.processor_writer_bus,
             mode=mode,
             save_folder=save_feed_folder,
+            class_names=self._model.class_names,
+            tracer=self._tracer,
+            detections_store=(
+                DetectionsStore(
+                    Config.DETECTIONS_STORE_FOLDER,
+                    buffer_rows=Config.DETECTIONS_STORE_BUFFER_ROWS,
+                )
+                if Config.DETECTIONS_STORE_FOLDER
+                else None
+            ),
         )
         self._results_writer.name = "ResultsWriter"  # Thread name
 
+        self._metrics_server = (
+            MetricsServer(metrics.REGISTRY, metrics_port, Config.METRICS_HOST)
+            if metrics_port
+            else None
+        )
+        self._register_metrics()
+        self._resource_sampler = ResourceSampler()
+        self._profiler = SamplingProfiler(
+            Config.PROFILE_OUTPUT_FOLDER, interval=Config.PROFILE_INTERVAL
+        )
+        self._profile_trigger_existed = False
         self._reporter_thread = threading.Thread(
             name="StateReporter",
             target=self._report_state,
@@ -57,17 +185,65 @@ class App:
         )
         logger.info("App initialised")
 
+    def _register_metrics(self) -> None:
+        """Gauges read from the stages when scraped"""
+        metrics.CONNECTED_CLIENTS.set_function(
+            lambda: self._server.total_connected_clients
+        )
+        writer = self._results_writer
+        queues = {
+            "server_decoder": self._server_decoder_bus.qsize,
+            "scheduler": self._frame_scheduler.qsize,
+            "processor_writer": self.processor_writer_bus.qsize,
+            "writer_workers": lambda: sum(writer.report_worker_queue_sizes()),
+        }
+        for name, qsize in queues.items():
+            metrics.QUEUE_DEPTH.labels(name).set_function(qsize)
+        metrics.DISK_WRITE_PENDING_BYTES.set_function(
+            lambda: (writer.report_disk() or {}).get("pending_bytes", 0)
+        )
+
+    @staticmethod
+    def _load_model() -> MLModel:
+        model_factory = functools.partial(
+            load_model, Config.MODEL_BACKEND, Config.MODEL_WEIGHTS
+        )
+        if not Config.INFERENCE_WORKERS:
+            return model_factory()
+        return MultiProcessModel(
+            model_factory,
+            workers=Config.INFERENCE_WORKERS,
+            frame_size=(Config.MODEL_INPUT_WIDTH, Config.MODEL_INPUT_HEIGHT),
+            slots_per_worker=Config.MODEL_BATCH_SIZE,
+            torch_threads=Config.INFERENCE_WORKER_TORCH_THREADS,
+            pin_cpus=Config.INFERENCE_WORKER_PIN_CPUS,
+            task_timeout=Config.INFERENCE_WORKER_TASK_TIMEOUT,
+        )
+
     def start(self):
         self._results_writer.start()
         self._feed_processor.start()
+        self._frame_decoder.start()
         self._server.start_server()
         self._reporter_thread.start()
+        if self._metrics_server is not None:
+            self._metrics_server.start()
+        self._install_profiler_signal()
+        if Config.PROFILE_ON_START:
+            self._profiler.enable()
 
     def stop(self):
+        if self._metrics_server is not None:
+            self._metrics_server.stop()
         self._server.stop_server()
+        self._frame_decoder.stop()
         self._feed_processor.stop()
         self._results_writer.stop()
 
+        self._frame_decoder.join(timeout=2.0)
+        if self._frame_decoder.is_alive():
+            logger.error("Failed to stop FrameDecoder in reasonable time")
+
         self._feed_processor.join(timeout=2.0)
         if self._feed_processor.is_alive():
             logger.error("Failed to stop FeedProcessor in reasonable time")
@@ -76,24 +252,116 @@ class App:
         if self._results_writer.is_alive():
             logger.error("Failed to stop ResultsWriter in reasonable time")
 
+        self._model.close()
+        self._profiler.disable()
+
         logger.info("App shutdown")
 
+    def report(self) -> dict:
+        """The state of every stage, for programmatic use"""
+        return {
+            "connected_clients": self._server.total_connected_clients,
+            "threads": threading.active_count(),
+            "cpu_percent": get_current_process_cpu_usage(),
+            "rss_mb": get_current_process_ram_usage(),
+            "queues": {
+                "server_decoder": self._server_decoder_bus.qsize(),
+                "scheduler": self._frame_scheduler.qsize(),
+                "processor_writer": self.processor_writer_bus.qsize(),
+            },
+            "decoder": self._frame_decoder.report_stats(),
+            "clients": self._frame_scheduler.report(),
+            "processor_stages": self._feed_processor.report_stage_timings(),
+            "batching": self._feed_processor.report_batching(),
+            "writer": self._results_writer.report(),
+            "traces": self.report_traces(),
+        }
+
+    def report_traces(self, per_client: bool = True) -> dict:
+        """Latency percentiles of every stage frames went through, empty if
+        tracing is off
+        """
+        if self._tracer is None:
+            return {}
+        return self._tracer.report(per_client)
+
+    def reset_traces(self) -> None:
+        if self._tracer is not None:
+            self._tracer.reset()
+
+    def toggle_profiling(self) -> None:
+        """Starts the sampling profiler, or stops it and writes the
+        profile
+        """
+        self._profiler.toggle()
+
+    def _install_profiler_signal(self) -> None:
+        if not hasattr(signal, "SIGUSR1"):
+            return  # Windows, the trigger file still works
+        try:
+            signal.signal(
+                signal.SIGUSR1, lambda signum, frame: self._toggle_soon()
+            )
+        except ValueError:
+            # Signals can only be handled from the main thread
+            logger.debug("App not started from the main thread, no SIGUSR1")
+
+    def _toggle_soon(self) -> None:
+        """Writing the profile takes a while, not in the signal handler"""
+        threading.Thread(
+            name="ProfilerToggle", target=self.toggle_profiling, daemon=True
+        ).start()
+
+    def _check_profile_trigger(self) -> None:
+        """Follows the trigger file being created or removed, so it doesn't
+        fight SIGUSR1
+        """
+        trigger = Config.PROFILE_TRIGGER_FILE
+        exists = bool(trigger) and os.path.exists(trigger)
+        if exists == self._profile_trigger_existed:
+            return
+        self._profile_trigger_existed = exists
+        if exists:
+            self._profiler.enable()
+        else:
+            self._profiler.disable()
+
     def _report_state(self, interval: int) -> None:
+        """Samples resource usage over every interval for the metrics and,
+        if Config.REPORT_STATE_LOG, logs the state of every stage
+        """
         while True:
             time.sleep(interval)
 
-            # TODO: Measure CPU usage over interval - blocking?
-            # TODO: Add network usage
-            cpu_usage = get_current_process_cpu_usage()
-            memory_usage = get_current_process_ram_usage()
+            self._check_profile_trigger()
+            usage = self._resource_sampler.sample()
+            metrics.PROCESS_CPU_PERCENT.set(usage.cpu_percent)
+            metrics.PROCESS_RSS_BYTES.set(usage.rss_bytes)
+            metrics.NETWORK_BYTES_PER_SECOND.labels("receive").set(
+                usage.network_received_per_second
+            )
+            metrics.NETWORK_BYTES_PER_SECOND.labels("transmit").set(
+                usage.network_sent_per_second
+            )
+            if not Config.REPORT_STATE_LOG:
+                continue
             logger.info(
                 f"Connected clients: {self._server.total_connected_clients}; "
                 f"Active threads: {threading.active_count()} "
                 f"({', '.join([thread.name for thread in threading.enumerate()])}); "  # noqa
-                f"CPU usage: {cpu_usage}%; "
-                f"Memory usage (MB): {memory_usage: .2f}; "
-                f"Server-processor queue: {self._server_processor_bus.qsize()}; "  # noqa
-                f"Processor-writer queue: {self._server_processor_bus.qsize()}; "  # noqa
-                f"ResultWriter handler queues: "
-                f"{self._results_writer.report_handlers_queue_size()}"
+                f"CPU usage: {usage.cpu_percent:.1f}%; "
+                f"Memory usage (MB): {usage.rss_bytes / 2 ** 20:.2f}; "
+                f"Network (MB/s): in "
+                f"{usage.network_received_per_second / 2 ** 20:.2f}, out "
+                f"{usage.network_sent_per_second / 2 ** 20:.2f}; "
+                f"Decoder: {self._frame_decoder.report_stats()}; "
+                f"Server-decoder queue: {self._server_decoder_bus.qsize()}; "
+                f"Scheduler queue: {self._frame_scheduler.qsize()}; "
+                f"Processor-writer queue: {self.processor_writer_bus.qsize()}; "  # noqa
+                f"Clients: {self._frame_scheduler.report()}; "
+                f"Processor stages: {self._feed_processor.report_stage_timings()}; "  # noqa
+                f"Batching: {self._feed_processor.report_batching()}; "
+                f"Latency: {self.report_traces(per_client=False)}; "
+                f"ResultWriter worker queues: "
+                f"{self._results_writer.report_worker_queue_sizes()}"
             )
@@ -0,0 +1,146 @@
+from dataclasses import dataclass
+from typing import List, Optional, Tuple
+
+import numpy as np
+import cv2
+
+
+_LETTERBOX_FILL = 114
+
+# Frame height, width, scale, top, left, resized height, resized width
+_Geometry = Tuple[int, int, float, int, int, int, int]
+
+
+@dataclass
+class TensorBatch:
+    """A batch letterboxed into an RGB NCHW tensor, plus what is needed to
+    map boxes back to frame coordinates. The tensor is a view into a
+    BatchBuilder buffer and is only valid until that buffer comes around
+    again
+    """
+
+    tensor: np.ndarray  # (N, 3, H, W), float32 in [0, 1] or raw uint8
+    scales: np.ndarray  # (N,) float32, model input / frame
+    pads: np.ndarray  # (N, 2) float32, (x, y) offset in the model input
+    frame_sizes: np.ndarray  # (N, 2) int32, (height, width) of each frame
+
+    def __len__(self) -> int:
+        return len(self.tensor)
+
+
+class BatchBuilder:
+    """Letterboxes frames straight into preallocated batch buffers.
+
+    Every frame is resized into its place in a uint8 NHWC canvas, then
+    BGR -> RGB, HWC -> CHW and scaling to [0, 1] are done for the whole batch
+    in one NumPy operation writing into a preallocated NCHW tensor. Nothing
+    is allocated per frame or per batch, and the padding is only repainted
+    when a slot's letterbox geometry changes.
+
+    The buffers rotate, so a batch built earlier stays intact while up to
+    buffers - 1 newer batches are built, e.g. while it waits in a pipeline
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int,
+        input_size: Tuple[int, int],
+        buffers: int = 1,
+        dtype: type = np.float32,
+    ) -> None:
+        height, width = input_size
+        self.max_batch_size = max_batch_size
+        self.input_size = input_size
+        self._canvas = np.full(
+            (buffers, max_batch_size, height, width, 3),
+            _LETTERBOX_FILL,
+            dtype=np.uint8,
+        )
+        self._tensors: np.ndarray = np.empty(
+            (buffers, max_batch_size, 3, height, width), dtype=dtype
+        )
+        self._scales = np.empty((buffers, max_batch_size), dtype=np.float32)
+        self._pads = np.empty((buffers, max_batch_size, 2), dtype=np.float32)
+        self._frame_sizes = np.zeros(
+            (buffers, max_batch_size, 2), dtype=np.int32
+        )
+        # Per slot letterbox geometry as Python scalars, so placing a frame
+        # with known geometry allocates nothing
+        self._geometry: List[List[Optional[_Geometry]]] = [
+            [None] * max_batch_size for _ in range(buffers)
+        ]
+        self._next_buffer = 0
+
+    @property
+    def nbytes(self) -> int:
+        return self._canvas.nbytes + self._tensors.nbytes
+
+    def build(self, frames: List[np.ndarray]) -> TensorBatch:
+        size = len(frames)
+        if size > self.max_batch_size:
+            raise ValueError(
+                f"Batch of {size} frames doesn't fit in {self.max_batch_size}"
+            )
+        index = self._next_buffer
+        self._next_buffer = (index + 1) % len(self._tensors)
+
+        canvas = self._canvas[index]
+        for i, frame in enumerate(frames):
+            self._place(index, i, frame)
+
+        tensor = self._tensors[index, :size]
+        rgb_chw = canvas[:size, :, :, ::-1].transpose(0, 3, 1, 2)
+        if tensor.dtype == np.uint8:
+            np.copyto(tensor, rgb_chw)
+        else:
+            np.multiply(rgb_chw, tensor.dtype.type(1 / 255.0), out=tensor)
+        return TensorBatch(
+            tensor=tensor,
+            scales=self._scales[index, :size],
+            pads=self._pads[index, :size],
+            frame_sizes=self._frame_sizes[index, :size],
+        )
+
+    def _place(self, index: int, slot: int, frame: np.ndarray) -> None:
+        frame_height, frame_width = frame.shape[:2]
+        canvas = self._canvas[index, slot]
+        geometry = self._geometry[index][slot]
+        if geometry is None or geometry[:2] != (frame_height, frame_width):
+            # New geometry, the old image might show in the new padding
+            canvas.fill(_LETTERBOX_FILL)
+            geometry = self._letterbox_geometry(frame_height, frame_width)
+            self._geometry[index][slot] = geometry
+            self._scales[index, slot] = geometry[2]
+            self._pads[index, slot] = geometry[4], geometry[3]
+            self._frame_sizes[index, slot] = frame_height, frame_width
+
+        _, _, _, top, left, new_height, new_width = geometry
+        target = canvas[top : top + new_height, left : left + new_width]
+        if (new_height, new_width) == (frame_height, frame_width):
+            np.copyto(target, frame)
+        else:
+            cv2.resize(
+                frame,
+                (new_width, new_height),
+                dst=target,
+                interpolation=cv2.INTER_LINEAR,
+            )
+
+    def _letterbox_geometry(
+        self, frame_height: int, frame_width: int
+    ) -> _Geometry:
+        height, width = self.input_size
+        scale = min(height / frame_height, width / frame_width)
+        new_height = round(frame_height * scale)
+        new_width = round(frame_width * scale)
+        top = (height - new_height) // 2
+        left = (width - new_width) // 2
+        return (
+            frame_height,
+            frame_width,
+            scale,
+            top,
+            left,
+            new_height,
+            new_width,
+        )
@@ -0,0 +1,218 @@
+import abc
+import collections
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Deque, Optional, Sequence, Tuple
+
+import numpy as np
+
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("batching")
+
+
+@dataclass
+class BatchingDecision:
+    batch_size: int
+    time_window: float
+    expected_throughput: float = 0.0  # Frames/s the model can sustain
+    expected_latency_p99: float = 0.0  # Seconds spent in the processor
+
+
+class BatchPolicy(abc.ABC):
+    """Decides how many frames FeedProcessor collects into a batch and for
+    how long it waits for them
+    """
+
+    @abc.abstractmethod
+    def current(self) -> BatchingDecision:
+        ...
+
+    def record_batch(self, batch_size: int, inference_time: float) -> None:
+        pass
+
+    def report(self) -> dict:
+        decision = self.current()
+        return {
+            "batch_size": decision.batch_size,
+            "time_window": round(decision.time_window, 4),
+        }
+
+
+class FixedBatchPolicy(BatchPolicy):
+    def __init__(self, batch_size: int, time_window: float) -> None:
+        self._decision = BatchingDecision(batch_size, time_window)
+
+    def current(self) -> BatchingDecision:
+        return self._decision
+
+
+class AdaptiveBatchPolicy(BatchPolicy):
+    """Picks the batch size and time window from measured model latency and
+    the frame arrival rate.
+
+    Model latency is fitted as `fixed + per_frame * batch_size` over recent
+    batches, scaled by the observed p99/fit ratio. For every candidate size
+    the worst case time a frame spends in the processor is the time to fill
+    the batch plus two inferences (the batch ahead of it and its own). Among
+    the candidates within the latency target, the smallest one that keeps up
+    with the arrival rate is chosen, as larger batches wouldn't increase
+    throughput, only latency. If none keeps up, the one with the highest
+    throughput is chosen.
+
+    arrivals counts the frames arriving at the processor's queue, e.g.
+    FairFrameScheduler.frames_admitted. Without it the arrival rate is
+    taken from the frames served, which reads low as soon as the model
+    falls behind, exactly when a bigger batch is needed.
+    """
+
+    def __init__(
+        self,
+        max_batch_size: int,
+        max_time_window: float,
+        latency_target_p99: float,
+        min_time_window: float = 0.005,
+        decision_interval: float = 5.0,
+        min_samples: int = 20,
+        headroom: float = 1.2,
+        candidate_sizes: Optional[Sequence[int]] = None,
+        arrivals: Optional[Callable[[], int]] = None,
+    ) -> None:
+        self._max_time_window = max_time_window
+        self._min_time_window = min_time_window
+        self._latency_target = latency_target_p99
+        self._decision_interval = decision_interval
+        self._min_samples = min_samples
+        self._headroom = headroom
+        if candidate_sizes is None:
+            candidate_sizes = [1]
+            while candidate_sizes[-1] * 2 < max_batch_size:
+                candidate_sizes.append(candidate_sizes[-1] * 2)
+            candidate_sizes.append(max_batch_size)
+        self._candidate_sizes = sorted(set(candidate_sizes))
+
+        self._samples: Deque[Tuple[int, float]] = collections.deque(maxlen=500)
+        self._arrivals_counter = arrivals
+        self._frames_served = 0
+        # (time, frames arrived so far)
+        self._arrivals: Deque[Tuple[float, int]] = collections.deque(
+            maxlen=500
+        )
+        self._decision = BatchingDecision(max_batch_size, max_time_window)
+        self._last_decision_at = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def current(self) -> BatchingDecision:
+        return self._decision
+
+    def record_batch(self, batch_size: int, inference_time: float) -> None:
+        now = time.perf_counter()
+        with self._lock:
+            self._samples.append((batch_size, inference_time))
+            self._frames_served += batch_size
+            self._arrivals.append(
+                (
+                    now,
+                    self._arrivals_counter()
+                    if self._arrivals_counter
+                    else self._frames_served,
+                )
+            )
+            if now - self._last_decision_at < self._decision_interval:
+                return
+            self._last_decision_at = now
+            if len(self._samples) < self._min_samples:
+                return
+            decision = self._decide()
+
+        # The window follows the arrival rate closely, only batch size
+        # changes are worth an info line
+        log = (
+            logger.info
+            if decision.batch_size != self._decision.batch_size
+            else logger.debug
+        )
+        log(
+            f"Batching set to {decision.batch_size} frames / "
+            f"{decision.time_window * 1e3:.0f} ms window. Expected "
+            f"throughput {decision.expected_throughput:.1f} frames/s, "
+            f"p99 latency {decision.expected_latency_p99 * 1e3:.0f} ms, "
+            f"arrival rate {self._arrival_rate():.1f} frames/s"
+        )
+        self._decision = decision
+
+    def report(self) -> dict:
+        decision = self._decision
+        return {
+            "batch_size": decision.batch_size,
+            "time_window": round(decision.time_window, 4),
+            "expected_throughput": round(decision.expected_throughput, 1),
+            "expected_latency_p99": round(decision.expected_latency_p99, 4),
+            "arrival_rate": round(self._arrival_rate(), 1),
+        }
+
+    def _arrival_rate(self) -> float:
+        arrivals = list(self._arrivals)
+        if len(arrivals) < 2:
+            return 0.0
+        elapsed = arrivals[-1][0] - arrivals[0][0]
+        frames = arrivals[-1][1] - arrivals[0][1]
+        return frames / elapsed if elapsed > 0 else 0.0
+
+    def _fit_latency(self) -> Tuple[float, float, float]:
+        """Returns (fixed cost, per frame cost, p99 / fit ratio)"""
+        sizes = np.array([size for size, _ in self._samples], np.float64)
+        latencies = np.array([lat for _, lat in self._samples], np.float64)
+        if len(np.unique(sizes)) > 1:
+            per_frame, fixed = np.polyfit(sizes, latencies, 1)
+            fixed = max(float(fixed), 0.0)
+            per_frame = max(float(per_frame), 1e-6)
+        else:
+            # A single size gives no slope, assume latency is linear in the
+            # batch size which is pessimistic for bigger batches
+            fixed, per_frame = 0.0, float(latencies.mean() / sizes.mean())
+        fit = fixed + per_frame * sizes
+        ratio = float(np.percentile(latencies / fit, 99))
+        return fixed, per_frame, max(ratio, 1.0)
+
+    def _decide(self) -> BatchingDecision:
+        fixed, per_frame, p99_ratio = self._fit_latency()
+        arrival_rate = self._arrival_rate()
+
+        best: Optional[BatchingDecision] = None
+        fallback: Optional[BatchingDecision] = None
+        for size in self._candidate_sizes:
+            inference_p99 = (fixed + per_frame * size) * p99_ratio
+            throughput = size / (fixed + per_frame * size)
+            fill_time = (
+                size / arrival_rate if arrival_rate else self._max_time_window
+            )
+            budget = self._latency_target - 2 * inference_p99
+            window = min(
+                self._max_time_window,
+                max(self._min_time_window, fill_time),
+                max(budget, self._min_time_window),
+            )
+            decision = BatchingDecision(
+                batch_size=size,
+                time_window=window,
+                expected_throughput=throughput,
+                expected_latency_p99=window + 2 * inference_p99,
+            )
+            if fallback is None or throughput > fallback.expected_throughput:
+                fallback = decision
+            if decision.expected_latency_p99 > self._latency_target:
+                continue
+            if throughput >= arrival_rate * self._headroom:
+                return decision
+            if best is None or throughput > best.expected_throughput:
+                best = decision
+
+        if best is None:
+            logger.warning(
+                "No batch size meets the latency target "
+                f"{self._latency_target * 1e3:.0f} ms, maximising throughput"
+            )
+        return best or fallback  # type: ignore[return-value]
@@ -0,0 +1,385 @@
+"""Append-only columnar store of detections, to answer "every person on
+camera X between 02:00 and 03:00" over weeks of results.
+
+Every detection is a fixed width record (RECORD_DTYPE, 32 bytes). Records
+of a client are buffered and appended in large batches to segment files:
+
+    <root>/<client>/<segment>.det   records, back to back
+    <root>/<client>/<segment>.zone  (min, max) timestamp of every
+                                    BLOCK_ROWS records, the sparse index
+    <root>/<client>/name            the client's name, in UTF-8
+
+Folders are named after the client percent-encoded, so no two clients
+share one.
+
+Queries memory map the segments, use the zone maps to skip segments and
+blocks outside the time range and only filter the blocks left. Zone maps
+don't need the records to be sorted, clients' clocks may jump.
+"""
+import contextlib
+import hashlib
+import os
+import string
+import threading
+from typing import (
+    Any,
+    ContextManager,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+
+import numpy as np
+
+from watchdawg.backend.messages import Detections
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("detections_store")
+
+
+RECORD_DTYPE = np.dtype(
+    [
+        ("timestamp", "<f8"),  # Capture time, seconds since epoch
+        ("sequence", "<u4"),  # Frame sequence number of the client
+        ("class_id", "<u2"),
+        ("score", "<f2"),
+        # x1 y1 x2 y2 as fractions of the frame's width and height, so
+        # records survive clients changing resolution
+        ("box", "<f4", (4,)),
+    ]
+)
+ZONE_DTYPE = np.dtype([("min", "<f8"), ("max", "<f8")])
+BLOCK_ROWS = 4096
+_SEGMENT_SUFFIX = ".det"
+_ZONE_SUFFIX = ".zone"
+_NAME_FILE = "name"
+_FOLDER_SAFE = frozenset(string.ascii_letters + string.digits + "_-@")
+_MAX_FOLDER_NAME = 200
+
+
+def _client_folder_name(client: str) -> str:
+    """Percent-encoded client, every byte outside _FOLDER_SAFE is escaped
+    (dots too, so never "." or ".."). Names too long for a folder are cut
+    and end with a hash of the whole name instead
+    """
+    folder = "".join(
+        chr(byte) if chr(byte) in _FOLDER_SAFE else f"%{byte:02X}"
+        for byte in client.encode("utf-8")
+    )
+    if not folder:
+        return "%"  # Not the encoding of any other name
+    if len(folder) > _MAX_FOLDER_NAME:
+        digest = hashlib.sha1(client.encode("utf-8")).hexdigest()
+        folder = f"{folder[: _MAX_FOLDER_NAME - 41]}~{digest}"
+    return folder
+
+
+class _Segment:
+    """A segment file being appended to and its zone map"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.rows = 0
+        self.zones = np.empty(0, dtype=ZONE_DTYPE)
+        self._file = open(path + _SEGMENT_SUFFIX, "ab")
+        self._zone_file = open(path + _ZONE_SUFFIX, "wb")
+
+    def append(self, records: np.ndarray) -> None:
+        self._file.write(records.data)
+        self._file.flush()
+        start = self.rows
+        first_block = start // BLOCK_ROWS
+        self.rows += len(records)
+        blocks = (self.rows + BLOCK_ROWS - 1) // BLOCK_ROWS
+        if blocks > len(self.zones):
+            grown = np.empty(blocks, dtype=ZONE_DTYPE)
+            grown[: len(self.zones)] = self.zones
+            grown[len(self.zones) :]["min"] = np.inf
+            grown[len(self.zones) :]["max"] = -np.inf
+            self.zones = grown
+
+        # Where every block starts in records, the first block may have
+        # been filled partly by the last append
+        splits = np.arange(first_block, blocks) * BLOCK_ROWS - start
+        splits[0] = 0
+        timestamps = records["timestamp"]
+        changed = self.zones[first_block:blocks]
+        changed["min"] = np.minimum(
+            changed["min"], np.minimum.reduceat(timestamps, splits)
+        )
+        changed["max"] = np.maximum(
+            changed["max"], np.maximum.reduceat(timestamps, splits)
+        )
+        # Only the entries of the blocks appended to are written, after the
+        # records so they never cover records not on disk yet
+        self._zone_file.seek(first_block * ZONE_DTYPE.itemsize)
+        self._zone_file.write(changed.data)
+        self._zone_file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+        self._zone_file.close()
+
+
+class _ClientWriter:
+    def __init__(
+        self, folder: str, client: str, buffer_rows: int, segment_rows: int
+    ) -> None:
+        self._folder = folder
+        self._segment_rows = segment_rows
+        self._buffer = np.zeros(buffer_rows, dtype=RECORD_DTYPE)
+        self._buffered = 0
+        self._segment: Optional[_Segment] = None
+        self.lock = threading.Lock()
+        os.makedirs(folder, exist_ok=True)
+        name_path = os.path.join(folder, _NAME_FILE)
+        if not os.path.exists(name_path):
+            with open(name_path, "w", encoding="utf-8") as file:
+                file.write(client)
+
+    @property
+    def buffered(self) -> np.ndarray:
+        return self._buffer[: self._buffered]
+
+    def reserve(self, rows: int) -> np.ndarray:
+        """Room for rows more records in the buffer, flushed first if full"""
+        if self._buffered + rows > len(self._buffer):
+            self.flush()
+            if rows > len(self._buffer):
+                self._buffer = np.zeros(rows, dtype=RECORD_DTYPE)
+        view = self._buffer[self._buffered : self._buffered + rows]
+        self._buffered += rows
+        return view
+
+    def flush(self) -> None:
+        records = self._buffer[: self._buffered]
+        while len(records):
+            if (
+                self._segment is None
+                or self._segment.rows >= self._segment_rows
+            ):
+                self._next_segment()
+            assert self._segment is not None
+            room = self._segment_rows - self._segment.rows
+            self._segment.append(records[:room])
+            records = records[room:]
+        self._buffered = 0
+
+    def _next_segment(self) -> None:
+        if self._segment is not None:
+            self._segment.close()
+        existing = _segment_paths(self._folder)
+        number = int(os.path.basename(existing[-1])) + 1 if existing else 0
+        self._segment = _Segment(os.path.join(self._folder, f"{number:08d}"))
+        logger.debug(f"Appending detections to {self._segment.path}")
+
+    def close(self) -> None:
+        self.flush()
+        if self._segment is not None:
+            self._segment.close()
+            self._segment = None
+
+
+def _segment_paths(folder: str) -> List[str]:
+    """Paths of the client's segments without suffix, oldest first"""
+    if not os.path.isdir(folder):
+        return []
+    return sorted(
+        os.path.join(folder, name[: -len(_SEGMENT_SUFFIX)])
+        for name in os.listdir(folder)
+        if name.endswith(_SEGMENT_SUFFIX)
+    )
+
+
+class DetectionsStore:
+    """Stores the detections of every client and queries them by time.
+
+    Writes are buffered per client, buffer_rows records at a time, and
+    segments are closed after segment_rows records. append() is safe to
+    call from several threads, query() too while writes go on: it reads
+    what was flushed plus the writer's own buffers.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        buffer_rows: int = 65536,
+        segment_rows: int = BLOCK_ROWS * 1024,
+    ) -> None:
+        self._root = root
+        self._buffer_rows = buffer_rows
+        self._segment_rows = segment_rows
+        # By folder name, like the folders, clients never share a writer
+        self._writers: Dict[str, _ClientWriter] = {}
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _writer(self, client: str) -> _ClientWriter:
+        folder = _client_folder_name(client)
+        writer = self._writers.get(folder)
+        if writer is None:
+            with self._lock:
+                writer = self._writers.get(folder)
+                if writer is None:
+                    writer = self._writers[folder] = _ClientWriter(
+                        os.path.join(self._root, folder),
+                        client,
+                        self._buffer_rows,
+                        self._segment_rows,
+                    )
+        return writer
+
+    def append(
+        self,
+        client: str,
+        timestamp: float,
+        sequence: int,
+        detections: Detections,
+        frame_size: Tuple[int, int],
+    ) -> None:
+        """Detections of one frame, frame_size is (width, height) of the
+        frame the boxes are in
+        """
+        rows = len(detections)
+        if not rows:
+            return
+        writer = self._writer(client)
+        with writer.lock:
+            records = writer.reserve(rows)
+            records["timestamp"] = timestamp
+            records["sequence"] = sequence
+            records["class_id"] = detections.class_ids
+            records["score"] = detections.scores
+            records["box"] = detections.boxes / np.array(
+                frame_size * 2, dtype=np.float32
+            )
+
+    def append_records(self, client: str, records: np.ndarray) -> None:
+        """Records already in RECORD_DTYPE, e.g. when importing"""
+        writer = self._writer(client)
+        with writer.lock:
+            for start in range(0, len(records), self._buffer_rows):
+                chunk = records[start : start + self._buffer_rows]
+                writer.reserve(len(chunk))[:] = chunk
+
+    def flush(self) -> None:
+        """Writes every client's buffered records"""
+        with self._lock:
+            writers = list(self._writers.values())
+        for writer in writers:
+            with writer.lock:
+                writer.flush()
+
+    def close_client(self, client: str) -> None:
+        """Flushes and closes the client's segment, e.g. on disconnect"""
+        with self._lock:
+            writer = self._writers.pop(_client_folder_name(client), None)
+        if writer is not None:
+            with writer.lock:
+                writer.close()
+
+    def close(self) -> None:
+        with self._lock:
+            writers = list(self._writers.values())
+            self._writers.clear()
+        for writer in writers:
+            with writer.lock:
+                writer.close()
+
+    def clients(self) -> List[str]:
+        """Names of the clients with stored detections"""
+        names = []
+        for folder in os.listdir(self._root):
+            path = os.path.join(self._root, folder)
+            if not os.path.isdir(path):
+                continue
+            try:
+                with open(
+                    os.path.join(path, _NAME_FILE), encoding="utf-8"
+                ) as file:
+                    names.append(file.read())
+            except FileNotFoundError:
+                names.append(folder)
+        return sorted(names)
+
+    def query(
+        self,
+        client: str,
+        start: float = -np.inf,
+        end: float = np.inf,
+        class_ids: Optional[Iterable[int]] = None,
+        min_score: float = 0.0,
+    ) -> np.ndarray:
+        """Records of the client with start <= timestamp < end, in the order
+        they were stored
+        """
+        parts = []
+        folder_name = _client_folder_name(client)
+        folder = os.path.join(self._root, folder_name)
+        writer = self._writers.get(folder_name)
+        # Records can't move from the buffer to a segment while being read
+        lock: ContextManager[Any] = contextlib.nullcontext()
+        if writer is not None:
+            lock = writer.lock
+        with lock:
+            for path in _segment_paths(folder):
+                parts.extend(self._query_segment(path, start, end))
+            if writer is not None:
+                buffered = writer.buffered
+                parts.append(buffered[self._time_mask(buffered, start, end)])
+
+        records = (
+            np.concatenate(parts) if parts else np.empty(0, dtype=RECORD_DTYPE)
+        )
+        mask = np.ones(len(records), dtype=bool)
+        if class_ids is not None:
+            mask &= np.isin(records["class_id"], list(class_ids))
+        if min_score:
+            mask &= records["score"] >= min_score
+        return records if mask.all() else records[mask]
+
+    @staticmethod
+    def _time_mask(
+        records: np.ndarray, start: float, end: float
+    ) -> np.ndarray:
+        timestamps = records["timestamp"]
+        return (timestamps >= start) & (timestamps < end)
+
+    def _query_segment(
+        self, path: str, start: float, end: float
+    ) -> List[np.ndarray]:
+        try:
+            zones = np.fromfile(path + _ZONE_SUFFIX, dtype=ZONE_DTYPE)
+        except FileNotFoundError:
+            return []  # Created, nothing flushed yet
+        overlapping = np.flatnonzero(
+            (zones["max"] >= start) & (zones["min"] < end)
+        )
+        if not len(overlapping):
+            return []
+        # A record being written may be incomplete, the zone map is written
+        # after the records so it never covers it
+        rows = min(
+            os.path.getsize(path + _SEGMENT_SUFFIX) // RECORD_DTYPE.itemsize,
+            len(zones) * BLOCK_ROWS,
+        )
+        if not rows:
+            return []
+        records = np.memmap(
+            path + _SEGMENT_SUFFIX,
+            dtype=RECORD_DTYPE,
+            mode="r",
+            shape=(rows,),
+        )
+        parts = []
+        # Neighbouring blocks are read as one range
+        breaks = np.flatnonzero(np.diff(overlapping) > 1) + 1
+        for run in np.split(overlapping, breaks):
+            lo = run[0] * BLOCK_ROWS
+            hi = min((run[-1] + 1) * BLOCK_ROWS, rows)
+            block = records[lo:hi]
+            parts.append(np.array(block[self._time_mask(block, start, end)]))
+        return parts
@@ -0,0 +1,261 @@
+"""Recording of a client's frames only around events, for cameras that
+watch empty scenes most of the time.
+
+The last seconds of frames are kept as JPEGs in a PrerollBuffer of fixed
+size. When the detections of a frame match the client's TriggerRule, the
+buffer is written out, then every frame until post-roll seconds pass
+without another match. Every event becomes its own recorded segment, with
+its time range in the recordings index.
+"""
+import collections
+import time
+from dataclasses import dataclass
+from typing import Deque, Iterator, Optional, Sequence, Tuple
+
+import numpy as np
+
+from watchdawg.backend.messages import Detections, ProcessFrameMessage
+from watchdawg.backend.recording import JpegRecorder
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("event_recording")
+
+
+@dataclass
+class TriggerRule:
+    """Detections that start an event, or extend the one going on"""
+
+    class_ids: Optional[Sequence[int]] = None  # None is any class
+    min_score: float = 0.5
+    min_count: int = 1  # Matching detections in the same frame
+    # x1 y1 x2 y2 as fractions of the frame, detections match if the center
+    # of their box is in it. None is the whole frame
+    roi: Optional[Tuple[float, float, float, float]] = None
+
+    def __post_init__(self) -> None:
+        if self.min_count < 1:
+            raise ValueError(f"min_count must be positive: {self.min_count}")
+        if self.roi is not None:
+            x1, y1, x2, y2 = self.roi
+            if not (0 <= x1 < x2 <= 1 and 0 <= y1 < y2 <= 1):
+                raise ValueError(f"Bad region of interest: {self.roi}")
+
+    def matches(
+        self, detections: Optional[Detections], width: int, height: int
+    ) -> bool:
+        """width and height are of the frame the boxes are in"""
+        if detections is None or len(detections) < self.min_count:
+            return False
+        mask = detections.scores >= self.min_score
+        if self.class_ids is not None:
+            mask &= np.isin(detections.class_ids, self.class_ids)
+        if self.roi is not None:
+            boxes = detections.boxes
+            x = (boxes[:, 0] + boxes[:, 2]) / (2 * width)
+            y = (boxes[:, 1] + boxes[:, 3]) / (2 * height)
+            x1, y1, x2, y2 = self.roi
+            mask &= (x >= x1) & (x <= x2) & (y >= y1) & (y <= y2)
+        return int(np.count_nonzero(mask)) >= self.min_count
+
+
+@dataclass
+class _BufferedFrame:
+    offset: int
+    size: int
+    width: int
+    height: int
+    timestamp: float
+    sequence: int
+    detections: Optional[Detections]
+    scale: float  # Of the boxes to the JPEG's pixels
+
+
+class PrerollBuffer:
+    """The last seconds of a client's JPEGs, in a ring of max_bytes
+    allocated up front. Frames older than seconds, or overwritten when the
+    ring wraps around, are forgotten
+    """
+
+    def __init__(self, seconds: float, max_bytes: int) -> None:
+        self._seconds = seconds
+        # np.empty, the pages only count once written to
+        self._ring = np.empty(max_bytes, dtype=np.uint8)
+        self._frames: Deque[_BufferedFrame] = collections.deque()
+        self._head = 0  # Where the next frame goes
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def push(
+        self,
+        jpeg: bytes,
+        width: int,
+        height: int,
+        timestamp: float,
+        sequence: int = 0,
+        detections: Optional[Detections] = None,
+        scale: float = 1.0,
+    ) -> None:
+        size = len(jpeg)
+        frames = self._frames
+        while frames and frames[0].timestamp <= timestamp - self._seconds:
+            frames.popleft()
+        if size > len(self._ring):
+            logger.warning(f"Frame of {size} bytes is too big to pre-roll")
+            return
+
+        start = self._head
+        if start + size > len(self._ring):
+            # Frames are contiguous, the end of the ring is left unused and
+            # the oldest frames are the ones past the head
+            while frames and frames[0].offset >= start:
+                frames.popleft()
+            start = 0
+        end = start + size
+        while (
+            frames
+            and frames[0].offset < end
+            and frames[0].offset + frames[0].size > start
+        ):
+            frames.popleft()
+
+        self._ring[start:end] = np.frombuffer(jpeg, dtype=np.uint8)
+        frames.append(
+            _BufferedFrame(
+                start,
+                size,
+                width,
+                height,
+                timestamp,
+                sequence,
+                detections,
+                scale,
+            )
+        )
+        self._head = end
+
+    def drain(self) -> Iterator[Tuple[bytes, _BufferedFrame]]:
+        """The buffered frames, oldest first, and empties the buffer"""
+        while self._frames:
+            frame = self._frames.popleft()
+            yield (
+                self._ring[frame.offset : frame.offset + frame.size].tobytes(),
+                frame,
+            )
+        self._head = 0
+
+
+class EventRecorder:
+    """Records a client's frames around the frames matching rule: from
+    preroll_seconds before the first one to postroll_seconds after the last
+    one. Events go to recorder, which is closed after each so every event
+    is a segment of its own
+    """
+
+    def __init__(
+        self,
+        recorder: JpegRecorder,
+        rule: TriggerRule,
+        preroll_seconds: float = 5.0,
+        postroll_seconds: float = 10.0,
+        preroll_max_bytes: int = 2**23,
+        name: str = "",
+    ) -> None:
+        self._recorder = recorder
+        self._rule = rule
+        self._postroll_seconds = postroll_seconds
+        self._preroll = PrerollBuffer(preroll_seconds, preroll_max_bytes)
+        self._name = name
+        # Capture time the current event ends at, if frames keep not
+        # matching
+        self._recording_until: Optional[float] = None
+        self.events = 0
+        self.frames_seen = 0
+        self.frames_recorded = 0
+
+    @property
+    def recording(self) -> bool:
+        return self._recording_until is not None
+
+    def write(
+        self,
+        message: ProcessFrameMessage,
+        jpeg: bytes,
+        width: int,
+        height: int,
+    ) -> bool:
+        """Buffers or records the frame, jpeg is the message's frame as
+        width x height pixels. Returns True if the frame started an event
+        """
+        self.frames_seen += 1
+        timestamp = message.timestamp or time.time()
+        frame_height, frame_width = message.frame.shape[:2]
+        scale = width / frame_width
+        started = False
+        if (
+            self._recording_until is not None
+            and timestamp >= self._recording_until
+        ):
+            self._end_event()
+
+        if self._rule.matches(message.detections, frame_width, frame_height):
+            if self._recording_until is None:
+                started = True
+                self._start_event(timestamp)
+            self._recording_until = timestamp + self._postroll_seconds
+
+        if self._recording_until is not None:
+            self._recorder.write_frame(
+                jpeg,
+                width,
+                height,
+                timestamp,
+                message.sequence,
+                message.detections,
+                scale,
+            )
+            self.frames_recorded += 1
+        else:
+            self._preroll.push(
+                jpeg,
+                width,
+                height,
+                timestamp,
+                message.sequence,
+                message.detections,
+                scale,
+            )
+        return started
+
+    def _start_event(self, timestamp: float) -> None:
+        self.events += 1
+        logger.info(
+            f"Event {self.events} of {self._name} started, recording "
+            f"{len(self._preroll)} frames of pre-roll"
+        )
+        for jpeg, frame in self._preroll.drain():
+            self._recorder.write_frame(
+                jpeg,
+                frame.width,
+                frame.height,
+                frame.timestamp,
+                frame.sequence,
+                frame.detections,
+                frame.scale,
+            )
+            self.frames_recorded += 1
+
+    def _end_event(self) -> None:
+        self._recording_until = None
+        self._recorder.close()
+        logger.debug(f"Event {self.events} of {self._name} ended")
+
+    def close(self) -> None:
+        if self._recording_until is not None:
+            self._end_event()
+        self._recorder.close()
+        logger.info(
+            f"{self._name}: {self.events} events, recorded "
+            f"{self.frames_recorded} of {self.frames_seen} frames"
+        )
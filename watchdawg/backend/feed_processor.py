@@ -1,9 +1,13 @@
+import collections
 import time
-from typing import Optional, List, Tuple
+from typing import Any, Deque, Dict, Optional, List, Tuple
 from queue import Queue, Empty
 import threading
 
+import numpy as np
+
 from watchdawg.util.logger import get_logger
+from watchdawg.util.profiler import section
 from watchdawg.backend.messages import (
     ClientDisconnectedMessage,
     ProcessFrameMessage,
@@ -11,12 +15,74 @@ from watchdawg.backend.messages import (
     FramesBatchMessage,
 )
 from watchdawg.backend.model import MLModel
+from watchdawg.backend.batch_builder import TensorBatch
+from watchdawg.backend.batching import BatchPolicy, FixedBatchPolicy
+from watchdawg.backend.metrics import BATCH_SIZE, INFERENCE_SECONDS
+from watchdawg.backend.tracing import TracePoint, mark_all
 
 
 logger = get_logger("feed_processor")
 
 
+_Batch = List[ProcessFrameMessage]
+_PipelineItem = Tuple[_Batch, Any, Optional[ClientDisconnectedMessage]]
+
+
+class StageStats:
+    """Durations of a pipeline stage, plus how busy the stage was over the
+    last busy_window seconds. A stage close to 100% busy is the bottleneck,
+    except for "collect" which includes waiting for frames: a busy collect
+    stage means the processor is starved by upstream
+    """
+
+    def __init__(self, window: int = 500, busy_window: float = 10.0) -> None:
+        # (end time, duration) of the most recent runs
+        self._runs: Deque[Tuple[float, float]] = collections.deque(
+            maxlen=window
+        )
+        self._busy_window = busy_window
+        self._created = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, duration: float) -> None:
+        with self._lock:
+            self._runs.append((time.perf_counter(), duration))
+
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            runs = list(self._runs)
+        now = time.perf_counter()
+        window = min(self._busy_window, max(now - self._created, 1e-9))
+        busy = sum(
+            min(duration, ended - (now - window))
+            for ended, duration in runs
+            if ended > now - window
+        )
+        busy = busy / window
+        if not runs:
+            return {"mean_ms": 0.0, "p95_ms": 0.0, "busy": round(busy, 3)}
+        durations = [duration for _, duration in runs]
+        return {
+            "mean_ms": round(float(np.mean(durations)) * 1e3, 2),
+            "p95_ms": round(float(np.percentile(durations, 95)) * 1e3, 2),
+            "busy": round(busy, 3),
+        }
+
+
 class FeedProcessor(threading.Thread):
+    """Collects frames into batches, runs the model and hands the results to
+    the writer.
+
+    With pipeline_depth == 0 the three stages run one after another on this
+    thread. Otherwise each stage gets its own thread connected by queues of
+    pipeline_depth batches, so batch N+1 is assembled while batch N is in
+    the model and batch N-1's results are being dispatched. Queues are FIFO
+    and each stage is a single thread, so frame order is preserved.
+
+    If the model takes a prebuilt tensor, the batch is letterboxed into one
+    of its preallocated buffers while being assembled.
+    """
+
     def __init__(
         self,
         events_queue_in: Queue,
@@ -24,54 +90,182 @@ class FeedProcessor(threading.Thread):
         build_batch_time_window: float,
         events_queue_out: Queue,
         model: MLModel,
+        pipeline_depth: int = 0,
+        batch_policy: Optional[BatchPolicy] = None,
         *args,
-        **kwargs
+        **kwargs,
     ) -> None:
         super().__init__(*args, **kwargs)
         self._events_queue_in = events_queue_in
-        self._batch_size = batch_size
-        self._time_window = build_batch_time_window
+        self._batch_policy = batch_policy or FixedBatchPolicy(
+            batch_size, build_batch_time_window
+        )
         self._events_queue_out = events_queue_out
         self._model = model
+        self._pipeline_depth = pipeline_depth
+        # A batch's tensor must survive while it is queued for and inside
+        # the model: the one being assembled, pipeline_depth queued and one
+        # in inference
+        self._batch_builder = model.create_batch_builder(
+            batch_size, buffers=pipeline_depth + 2 if pipeline_depth else 1
+        )
+        self._stage_stats = {
+            "collect": StageStats(),
+            "preprocess": StageStats(),
+            "inference": StageStats(),
+            "dispatch": StageStats(),
+        }
         self._stop_event = threading.Event()
         logger.debug("FeedProcessor initialised")
 
-    # TODO: Batches are processed sequentially, parallelize?
+    def report_stage_timings(self) -> Dict[str, Dict[str, float]]:
+        return {
+            stage: stats.snapshot()
+            for stage, stats in self._stage_stats.items()
+        }
+
+    def report_batching(self) -> dict:
+        return self._batch_policy.report()
+
     def run(self) -> None:
         logger.debug("Processor started")
+        if self._pipeline_depth > 0:
+            self._run_pipelined()
+        else:
+            self._run_sequential()
+        logger.debug("Processor stopped")
 
+    def _run_sequential(self) -> None:
         while not self._stop_event.is_set():
-            frames_batch, disconnected_client = self._collect_batch()
+            batch, model_input, disconnected_client = self._assemble()
+            self._infer(batch, model_input)
+            self._dispatch(batch, disconnected_client)
 
-            if disconnected_client:
-                self._events_queue_out.put(disconnected_client)
+    def _run_pipelined(self) -> None:
+        inference_queue: "Queue[Optional[_PipelineItem]]" = Queue(
+            self._pipeline_depth
+        )
+        dispatch_queue: "Queue[Optional[_PipelineItem]]" = Queue(
+            self._pipeline_depth
+        )
+        inference_thread = threading.Thread(
+            name="FeedProcessorInference",
+            target=self._inference_stage,
+            args=(inference_queue, dispatch_queue),
+            daemon=True,
+        )
+        dispatch_thread = threading.Thread(
+            name="FeedProcessorDispatch",
+            target=self._dispatch_stage,
+            args=(dispatch_queue,),
+            daemon=True,
+        )
+        inference_thread.start()
+        dispatch_thread.start()
 
-            if not len(frames_batch):
-                continue
+        while not self._stop_event.is_set():
+            item = self._assemble()
+            if item[0] or item[2]:
+                inference_queue.put(item)
 
-            # detections = self._model([item.frame for item in frames_batch])
-            # for detection, frame_message in zip(detections, frames_batch):
-            #     frame_message.detections = detection
+        # None flows through the stages and stops them in order
+        inference_queue.put(None)
+        inference_thread.join(timeout=2.0)
+        dispatch_thread.join(timeout=2.0)
 
-            # TODO: A lot of overhead with Ultralytics (copies etc)
-            # ULTRALYTICS draw BB for us
-            processed_frames = self._model(
-                [item.frame for item in frames_batch]
+    def _inference_stage(
+        self,
+        inference_queue: "Queue[Optional[_PipelineItem]]",
+        dispatch_queue: "Queue[Optional[_PipelineItem]]",
+    ) -> None:
+        while True:
+            item = inference_queue.get()
+            if item is None:
+                dispatch_queue.put(None)
+                return
+            batch, model_input, _ = item
+            self._infer(batch, model_input)
+            dispatch_queue.put(item)
+
+    def _dispatch_stage(
+        self, dispatch_queue: "Queue[Optional[_PipelineItem]]"
+    ) -> None:
+        while True:
+            item = dispatch_queue.get()
+            if item is None:
+                return
+            batch, _, disconnected_client = item
+            self._dispatch(batch, disconnected_client)
+
+    def _assemble(self) -> _PipelineItem:
+        start = time.perf_counter()
+        batch, disconnected_client = self._collect_batch()
+        if not batch:
+            return batch, None, disconnected_client
+        collected = time.perf_counter()
+        self._stage_stats["collect"].record(collected - start)
+
+        frames = [item.frame for item in batch]
+        with section("build_batch"):
+            model_input = (
+                self._batch_builder.build(frames)
+                if self._batch_builder
+                else frames
             )
-            for processed_frame, frame_message in zip(
-                processed_frames, frames_batch
-            ):
-                frame_message.frame = processed_frame
+        self._stage_stats["preprocess"].record(time.perf_counter() - collected)
+        mark_all([item.trace for item in batch], TracePoint.BATCHED)
+        return batch, model_input, disconnected_client
 
-            self._events_queue_out.put(FramesBatchMessage(frames_batch))
+    def _infer(self, batch: _Batch, model_input: Any) -> None:
+        if not batch:
+            return
+        traces = [item.trace for item in batch]
+        mark_all(traces, TracePoint.INFERENCE_STARTED)
+        start = time.perf_counter()
+        try:
+            with section("inference"):
+                if isinstance(model_input, TensorBatch):
+                    detections = self._model.infer_tensor(model_input)
+                else:
+                    detections = self._model(model_input)
+        except Exception as e:
+            logger.error(
+                f"Model failed on a batch of {len(batch)} frames, dropping "
+                f"it. Error: {e}"
+            )
+            batch.clear()
+            return
+        inference_time = time.perf_counter() - start
+        mark_all(traces, TracePoint.INFERENCE_DONE)
+        for frame_detections, frame_message in zip(detections, batch):
+            frame_message.detections = frame_detections
+        self._stage_stats["inference"].record(inference_time)
+        INFERENCE_SECONDS.observe(inference_time)
+        BATCH_SIZE.observe(len(batch))
+        self._batch_policy.record_batch(len(batch), inference_time)
 
-        logger.debug("Processor stopped")
+    def _dispatch(
+        self,
+        batch: _Batch,
+        disconnected_client: Optional[ClientDisconnectedMessage],
+    ) -> None:
+        start = time.perf_counter()
+        if batch:
+            # Blocks while the writer is behind
+            with section("dispatch"):
+                self._events_queue_out.put(FramesBatchMessage(batch))
+        # After the batch, which might still have the client's last frames
+        if disconnected_client:
+            self._events_queue_out.put(disconnected_client)
+        if batch:
+            self._stage_stats["dispatch"].record(time.perf_counter() - start)
 
     def _collect_batch(
         self,
     ) -> Tuple[List[ProcessFrameMessage], Optional[ClientDisconnectedMessage]]:
-        time_window = self._time_window
-        batch_size = self._batch_size
+        decision = self._batch_policy.current()
+        time_window = decision.time_window
+        batch_size = decision.batch_size
         queue = self._events_queue_in
 
         batch: List[ProcessFrameMessage] = []
@@ -0,0 +1,210 @@
+import collections
+import time
+from concurrent.futures import (
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from typing import Deque, Optional, Tuple
+from queue import Queue, Empty
+import threading
+
+import numpy as np
+import cv2
+
+from watchdawg.util.logger import get_logger
+from watchdawg.util.profiler import section
+from watchdawg.backend.messages import (
+    BusMessage,
+    EncodedFrameMessage,
+    ProcessFrameMessage,
+)
+from watchdawg.backend.metrics import DECODE_FAILURES, DECODE_SECONDS
+from watchdawg.backend.tracing import FrameTrace, TracePoint
+
+
+logger = get_logger("frame_decoder")
+
+
+_REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def decode_frame(
+    payload: bytes,
+    source_size: Tuple[int, int],
+    target_size: Optional[Tuple[int, int]] = None,
+) -> Tuple[Optional[np.ndarray], float, float]:
+    """Decodes a JPEG payload, returns the frame, the decode time in seconds
+    and the time.monotonic() it finished at.
+
+    If target_size (width, height) is given, the JPEG is decoded at the
+    smallest 1/2, 1/4 or 1/8 scale that still covers the frame letterboxed
+    into the target, which is much cheaper than a full decode. Resizing and
+    padding is left to the BatchBuilder, so the aspect ratio is kept and no
+    intermediate frame is allocated.
+    Top level function so it can be sent to a process pool.
+    """
+    start = time.perf_counter()
+    flags = cv2.IMREAD_COLOR
+    if target_size:
+        width, height = source_size
+        # Same fit as BatchBuilder's letterbox
+        scale = min(target_size[0] / width, target_size[1] / height)
+        for factor, reduced_flags in _REDUCED_DECODE_FLAGS:
+            if factor * scale <= 1.0:
+                flags = reduced_flags
+                break
+
+    with section("decode"):
+        frame = cv2.imdecode(np.frombuffer(payload, dtype=np.uint8), flags)
+    return frame, time.perf_counter() - start, time.monotonic()
+
+
+class FrameDecoder(threading.Thread):
+    """Decodes frames received by the server on a pool of threads or
+    processes, so socket readers never wait for JPEG decoding.
+
+    Messages are submitted to the pool in the order they arrive and published
+    downstream in that same order, which keeps every client's frames (and its
+    connect/disconnect messages) in order while decodes run in parallel.
+    """
+
+    def __init__(
+        self,
+        events_queue_in: Queue,
+        events_queue_out: Queue,
+        workers: int,
+        executor_type: str = "thread",
+        max_in_flight: int = 32,
+        target_size: Optional[Tuple[int, int]] = None,
+        trace_frames: bool = False,
+        keep_encoded: bool = False,
+        *args,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self._events_queue_in = events_queue_in
+        self._events_queue_out = events_queue_out
+        self._target_size = target_size
+        self._trace_frames = trace_frames
+        # Passes the received JPEG on with the decoded frame, to record it
+        self._keep_encoded = keep_encoded
+        self._executor = self._create_executor(executor_type, workers)
+        # Bounded, so the number of frames being decoded is bounded too
+        self._pending: "Queue[Tuple[BusMessage, Optional[Future]]]" = Queue(
+            max_in_flight
+        )
+        self._decode_times: Deque[float] = collections.deque(maxlen=1000)
+        self._frames_decoded = 0
+        self._frames_failed = 0
+        self._stop_event = threading.Event()
+        self._publisher = threading.Thread(
+            name="FrameDecoderPublisher", target=self._publish, daemon=True
+        )
+        logger.debug(
+            f"FrameDecoder initialised with {workers} {executor_type} workers"
+        )
+
+    @staticmethod
+    def _create_executor(executor_type: str, workers: int) -> Executor:
+        if executor_type == "thread":
+            return ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="FrameDecoderWorker"
+            )
+        elif executor_type == "process":
+            return ProcessPoolExecutor(max_workers=workers)
+        raise ValueError(f"Unknown decoder executor type {executor_type}")
+
+    def report_stats(self) -> dict:
+        decode_times = list(self._decode_times)
+        return {
+            "queue_in": self._events_queue_in.qsize(),
+            "in_flight": self._pending.qsize(),
+            "frames_decoded": self._frames_decoded,
+            "frames_failed": self._frames_failed,
+            "decode_ms_mean": (
+                float(np.mean(decode_times)) * 1e3 if decode_times else 0.0
+            ),
+            "decode_ms_p95": (
+                float(np.percentile(decode_times, 95)) * 1e3
+                if decode_times
+                else 0.0
+            ),
+        }
+
+    def run(self) -> None:
+        logger.debug("FrameDecoder started")
+        self._publisher.start()
+
+        while not self._stop_event.is_set():
+            try:
+                message = self._events_queue_in.get(timeout=0.5)
+            except Empty:
+                continue
+
+            future = None
+            if isinstance(message, EncodedFrameMessage):
+                future = self._executor.submit(
+                    decode_frame,
+                    message.payload,
+                    (message.width, message.height),
+                    self._target_size,
+                )
+            self._pending.put((message, future))
+
+        self._pending.put((BusMessage(), None))  # Stops the publisher
+        self._publisher.join(timeout=2.0)
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        logger.debug("FrameDecoder stopped")
+
+    def _publish(self) -> None:
+        while True:
+            message, future = self._pending.get()
+            if future is None:
+                if type(message) is BusMessage:
+                    break
+                self._events_queue_out.put(message)
+                continue
+
+            assert isinstance(message, EncodedFrameMessage)
+            try:
+                frame, decode_time, decoded_at = future.result()
+            except Exception as e:
+                logger.error(f"Failed to decode frame. Error: {e}")
+                frame = None
+            if frame is None:
+                self._frames_failed += 1
+                DECODE_FAILURES.inc()
+                continue
+
+            self._decode_times.append(decode_time)
+            DECODE_SECONDS.observe(decode_time)
+            self._frames_decoded += 1
+            trace = None
+            if self._trace_frames:
+                # CLOCK_MONOTONIC is system wide, worker processes included
+                trace = FrameTrace(message.timestamp, message.received_at)
+                trace.times[TracePoint.DECODED] = decoded_at
+                trace.mark(TracePoint.ENQUEUED)
+            self._events_queue_out.put(
+                ProcessFrameMessage(
+                    client_id=message.client_id,
+                    frame=frame,
+                    sequence=message.sequence,
+                    timestamp=message.timestamp,
+                    received_at=message.received_at,
+                    trace=trace,
+                    encoded=message if self._keep_encoded else None,
+                )
+            )
+
+    def stop(self) -> None:
+        if not self._stop_event.is_set():
+            self._stop_event.set()
+        else:
+            logger.warning("Called stop on already stopping FrameDecoder")
@@ -0,0 +1,370 @@
+import collections
+import time
+import uuid
+from dataclasses import dataclass, field
+from queue import Queue
+from typing import Any, Callable, Deque, Dict, Optional
+
+from watchdawg.backend.messages import (
+    BusMessage,
+    ClientDisconnectedMessage,
+    EncodedFrameMessage,
+    NewClientConnectedMessage,
+    ProcessFrameMessage,
+)
+from watchdawg.backend.metrics import FRAMES_DROPPED
+from watchdawg.util.frame_protocol import Feedback
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("frame_scheduler")
+
+
+@dataclass
+class ClientPolicy:
+    weight: float = 1.0  # Share of the model relative to other clients
+    max_fps: float = 0.0  # 0 is no cap
+
+    def __post_init__(self) -> None:
+        if self.weight <= 0:
+            raise ValueError(f"Client weight must be positive: {self.weight}")
+
+
+@dataclass
+class _ClientState:
+    name: str
+    policy: ClientPolicy
+    frames: Deque[ProcessFrameMessage] = field(
+        default_factory=collections.deque
+    )
+    deficit: float = 0.0
+    next_admit_at: float = 0.0
+    disconnect: Optional[ClientDisconnectedMessage] = None
+    received: int = 0
+    delivered: int = 0
+    dropped_overflow: int = 0
+    dropped_fps_cap: int = 0
+    dropped_upstream: int = 0  # Before decoding, see EncodedFramesQueue
+    # Feedback window
+    window_start: float = field(default_factory=time.monotonic)
+    window_received: int = 0
+    window_delivered: int = 0
+    window_dropped: int = 0
+    window_max_lag: float = 0.0
+    target_fps: float = 0.0
+
+
+class FairFrameScheduler(Queue):
+    """Drop in replacement for the decoder -> processor queue that keeps a
+    bounded queue per client and hands frames out fairly.
+
+    Frames are served with deficit round robin weighted by each client's
+    policy, so a 30 fps camera gets no more of a batch than a 5 fps one with
+    the same weight while the model is the bottleneck. puts never block:
+    when a client's queue is full its oldest frame is dropped (latest frame
+    wins), and frames above the client's FPS cap are dropped on arrival.
+
+    feedback() turns a client's recent drops and queue depth into a send
+    rate to advertise back to it (AIMD: cut below what is being served on
+    congestion, grow back slowly otherwise), and reports how long its frames
+    waited to be served. Control messages are served before frames, except
+    a disconnect which waits until the client's queued frames have been
+    served.
+    """
+
+    def __init__(
+        self,
+        client_queue_size: int,
+        default_policy: Optional[ClientPolicy] = None,
+        policies: Optional[Dict[str, ClientPolicy]] = None,
+    ) -> None:
+        self._client_queue_size = client_queue_size
+        self._default_policy = default_policy or ClientPolicy()
+        self._policies = policies or {}
+        # Queue.__init__ calls _init, the state must exist before that
+        super().__init__(maxsize=0)
+
+    def _init(self, maxsize: int) -> None:
+        self._clients: Dict[uuid.UUID, _ClientState] = {}
+        self._control: Deque[BusMessage] = collections.deque()
+        # Round robin order of clients with queued frames
+        self._active: Deque[uuid.UUID] = collections.deque()
+        self._frames_queued = 0
+        self._frames_admitted = 0
+
+    def _qsize(self) -> int:
+        return len(self._control) + self._frames_queued
+
+    def _put(self, message: BusMessage) -> None:
+        if isinstance(message, ProcessFrameMessage):
+            self._put_frame(message)
+        elif isinstance(message, NewClientConnectedMessage):
+            self._register(message.client_id, message.client_name)
+            self._control.append(message)
+        elif isinstance(message, ClientDisconnectedMessage):
+            client = self._clients.get(message.client_id)
+            if client is not None and client.frames:
+                client.disconnect = message
+            else:
+                self._unregister(message.client_id)
+                self._control.append(message)
+        else:
+            self._control.append(message)
+
+    def _register(
+        self, client_id: uuid.UUID, name: Optional[str]
+    ) -> _ClientState:
+        name = name or str(client_id)
+        client = self._clients.get(client_id)
+        if client is not None:
+            # Known from its frames or drops before its connect message
+            client.name = name
+            client.policy = self._policies.get(name, self._default_policy)
+            return client
+        client = _ClientState(
+            name=name, policy=self._policies.get(name, self._default_policy)
+        )
+        self._clients[client_id] = client
+        logger.debug(f"Client {name} registered with {client.policy}")
+        return client
+
+    def _unregister(self, client_id: uuid.UUID) -> None:
+        client = self._clients.pop(client_id, None)
+        if client is not None:
+            logger.info(
+                f"Client {client.name} done. Frames received: "
+                f"{client.received}, delivered: {client.delivered}, dropped "
+                f"(queue full): {client.dropped_overflow}, dropped (FPS "
+                f"cap): {client.dropped_fps_cap}, dropped (before "
+                f"decoding): {client.dropped_upstream}"
+            )
+
+    def _put_frame(self, message: ProcessFrameMessage) -> None:
+        client = self._clients.get(message.client_id)
+        if client is None:
+            client = self._register(message.client_id, None)
+        client.received += 1
+        client.window_received += 1
+
+        if client.policy.max_fps:
+            now = time.monotonic()
+            if now < client.next_admit_at:
+                client.dropped_fps_cap += 1
+                client.window_dropped += 1
+                FRAMES_DROPPED.labels(client.name, "fps_cap").inc()
+                return
+            # Allow a little jitter in the client's frame timing
+            interval = 1.0 / client.policy.max_fps
+            client.next_admit_at = max(
+                now + interval * 0.9, client.next_admit_at + interval
+            )
+
+        self._frames_admitted += 1
+        if len(client.frames) >= self._client_queue_size:
+            client.frames.popleft()
+            client.dropped_overflow += 1
+            client.window_dropped += 1
+            self._frames_queued -= 1
+            FRAMES_DROPPED.labels(client.name, "queue_full").inc()
+        elif not client.frames:
+            self._active.append(message.client_id)
+        client.frames.append(message)
+        self._frames_queued += 1
+
+    def _get(self) -> Any:
+        if self._control:
+            return self._control.popleft()
+
+        while True:
+            client_id = self._active[0]
+            client = self._clients[client_id]
+            if client.deficit < 1.0:
+                # The client's turn is over, it gets a new quantum for the
+                # next one
+                client.deficit += client.policy.weight
+                self._active.rotate(-1)
+                continue
+            break
+
+        client.deficit -= 1.0
+        message = client.frames.popleft()
+        self._frames_queued -= 1
+        client.delivered += 1
+        client.window_delivered += 1
+        if message.received_at:
+            client.window_max_lag = max(
+                client.window_max_lag, time.monotonic() - message.received_at
+            )
+        if not client.frames:
+            self._active.popleft()
+            client.deficit = 0.0
+            if client.disconnect is not None:
+                self._control.append(client.disconnect)
+                self._unregister(client_id)
+        return message
+
+    def frames_admitted(self) -> int:
+        """Frames let in past the FPS caps so far, served or dropped later"""
+        return self._frames_admitted
+
+    def record_drop(self, client_id: uuid.UUID) -> None:
+        """Counts a frame of the client dropped before reaching the
+        scheduler, so its feedback slows it down like its own drops do
+        """
+        with self.mutex:
+            client = self._clients.get(client_id)
+            if client is None:
+                client = self._register(client_id, None)
+            client.dropped_upstream += 1
+            client.window_dropped += 1
+
+    def feedback(self, client_id: uuid.UUID) -> Optional[Feedback]:
+        """Closes the client's feedback window and returns the send rate it
+        should use. Meant to be called every few seconds per client
+        """
+        with self.mutex:
+            client = self._clients.get(client_id)
+            if client is None:
+                return None
+            now = time.monotonic()
+            elapsed = max(now - client.window_start, 1e-3)
+            received_fps = client.window_received / elapsed
+            delivered_fps = client.window_delivered / elapsed
+
+            # A queue that doesn't drain is congestion too: frames aren't
+            # dropped yet but wait longer and longer
+            congested = (
+                client.window_dropped
+                or len(client.frames) > self._client_queue_size // 2
+            )
+            if congested:
+                # Below what is being served, so the queue drains
+                client.target_fps = max(1.0, delivered_fps * 0.75)
+            elif client.target_fps:
+                client.target_fps += max(1.0, client.target_fps * 0.05)
+                if client.target_fps > received_fps * 2:
+                    # The client sends well below the limit on its own
+                    client.target_fps = 0.0
+            if client.policy.max_fps:
+                client.target_fps = (
+                    min(client.target_fps, client.policy.max_fps)
+                    if client.target_fps
+                    else client.policy.max_fps
+                )
+
+            client.window_start = now
+            client.window_received = 0
+            client.window_delivered = 0
+            client.window_dropped = 0
+            # Frames still queued count too, or a stalled processor would
+            # report no lag at all
+            lag = client.window_max_lag
+            if client.frames and client.frames[0].received_at:
+                lag = max(lag, now - client.frames[0].received_at)
+            client.window_max_lag = 0.0
+            return Feedback(
+                target_fps=client.target_fps,
+                queued_frames=len(client.frames),
+                dropped_frames=(
+                    client.dropped_overflow
+                    + client.dropped_fps_cap
+                    + client.dropped_upstream
+                ),
+                lag=lag,
+            )
+
+    def report(self) -> Dict[str, dict]:
+        with self.mutex:
+            return {
+                client.name: {
+                    "queued": len(client.frames),
+                    "received": client.received,
+                    "delivered": client.delivered,
+                    "dropped_overflow": client.dropped_overflow,
+                    "dropped_fps_cap": client.dropped_fps_cap,
+                    "dropped_upstream": client.dropped_upstream,
+                    "target_fps": round(client.target_fps, 1),
+                }
+                for client in self._clients.values()
+            }
+
+
+class EncodedFramesQueue(Queue):
+    """Queue between the server and the decoder whose puts never block, so
+    a decoder falling behind never stalls the socket readers.
+
+    It holds at most client_queue_size frames of a client, past that the
+    client's own oldest frame is dropped. When max_frames are queued in
+    total, the oldest frame of the client with the most queued is dropped
+    instead. Connect and disconnect messages are always queued. Drops are
+    counted against the client whose frame was dropped and passed to
+    on_drop, e.g. FairFrameScheduler.record_drop so that the client is told
+    to slow down.
+    """
+
+    def __init__(
+        self,
+        max_frames: int,
+        client_queue_size: int,
+        on_drop: Optional[Callable[[uuid.UUID], None]] = None,
+    ) -> None:
+        self._max_frames = max_frames
+        self._client_queue_size = client_queue_size
+        self._on_drop = on_drop
+        self.dropped = 0
+        # Unbounded for Queue, the limits are enforced in _put
+        super().__init__(maxsize=0)
+
+    def _init(self, maxsize: int) -> None:
+        self.queue: Deque[BusMessage] = collections.deque()
+        # Queued frames, of every client and in total
+        self._frames: Dict[uuid.UUID, int] = collections.Counter()
+        self._frames_queued = 0
+        self._names: Dict[uuid.UUID, str] = {}
+
+    def _put(self, message: BusMessage) -> None:
+        if isinstance(message, EncodedFrameMessage):
+            client_id = message.client_id
+            if self._frames[client_id] >= self._client_queue_size:
+                self._drop_oldest(client_id)
+            elif self._frames_queued >= self._max_frames:
+                self._drop_oldest(
+                    max(self._frames, key=self._frames.__getitem__)
+                )
+            self._frames[client_id] += 1
+            self._frames_queued += 1
+        elif isinstance(message, NewClientConnectedMessage):
+            self._names[message.client_id] = message.client_name or str(
+                message.client_id
+            )
+        self.queue.append(message)
+
+    def _get(self) -> BusMessage:
+        message = self.queue.popleft()
+        if isinstance(message, EncodedFrameMessage):
+            self._forget_frame(message.client_id)
+        elif isinstance(message, ClientDisconnectedMessage):
+            self._names.pop(message.client_id, None)
+        return message
+
+    def _drop_oldest(self, client_id: uuid.UUID) -> None:
+        for index, message in enumerate(self.queue):
+            if (
+                isinstance(message, EncodedFrameMessage)
+                and message.client_id == client_id
+            ):
+                del self.queue[index]
+                break
+        self._forget_frame(client_id)
+        self.dropped += 1
+        FRAMES_DROPPED.labels(
+            self._names.get(client_id, str(client_id)), "decoder_behind"
+        ).inc()
+        if self._on_drop is not None:
+            self._on_drop(client_id)
+
+    def _forget_frame(self, client_id: uuid.UUID) -> None:
+        self._frames[client_id] -= 1
+        self._frames_queued -= 1
+        if not self._frames[client_id]:
+            del self._frames[client_id]
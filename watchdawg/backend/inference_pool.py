@@ -0,0 +1,454 @@
+import itertools
+import math
+import multiprocessing as mp
+import os
+import threading
+import time
+from queue import Empty
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+import cv2
+
+from watchdawg.backend.messages import Detections
+from watchdawg.backend.model import MLModel
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("inference_pool")
+
+
+# Marks an output that the worker wrote back into the input's slot
+_IN_SLOT = "__in_slot__"
+
+# How a frame was fitted into its slot: scale, x and y padding
+Letterbox = Tuple[float, int, int]
+
+# A task id and the number of frames in the worker's slots, None to stop
+_Task = Optional[Tuple[int, int]]
+
+# Worker index, worker generation, task id (None when starting), status and
+# payload. The generation tells a restarted worker from the one it replaced
+_Result = Tuple[int, int, Optional[int], str, Any]
+
+
+class SharedFrameSlots:
+    """A fixed number of preallocated HxWx3 uint8 frames living in one shared
+    memory block, accessible from several processes by name
+    """
+
+    def __init__(
+        self,
+        slots: int,
+        height: int,
+        width: int,
+        name: Optional[str] = None,
+    ) -> None:
+        self.shape = (slots, height, width, 3)
+        size = int(np.prod(self.shape))
+        if name is None:
+            self._shm = SharedMemory(create=True, size=size)
+            self._owner = True
+        else:
+            self._shm = SharedMemory(name=name)
+            self._owner = False
+        self.frames: np.ndarray = np.ndarray(
+            self.shape, dtype=np.uint8, buffer=self._shm.buf
+        )
+
+    @property
+    def name(self) -> str:
+        return self._shm.name
+
+    def write(self, index: int, frame: np.ndarray) -> Letterbox:
+        """Frames of another size are scaled to fit the slot keeping their
+        aspect ratio, the rest of the slot is black. Returns how, to map
+        boxes found in the slot back to the frame
+        """
+        slot = self.frames[index]
+        if frame.shape == slot.shape:
+            np.copyto(slot, frame)
+            return 1.0, 0, 0
+        slot_height, slot_width = slot.shape[:2]
+        height, width = frame.shape[:2]
+        scale = min(slot_width / width, slot_height / height)
+        resized_width = min(slot_width, max(1, round(width * scale)))
+        resized_height = min(slot_height, max(1, round(height * scale)))
+        pad_x = (slot_width - resized_width) // 2
+        pad_y = (slot_height - resized_height) // 2
+        slot.fill(0)
+        slot[
+            pad_y : pad_y + resized_height, pad_x : pad_x + resized_width
+        ] = cv2.resize(
+            frame,
+            (resized_width, resized_height),
+            interpolation=cv2.INTER_AREA,
+        )
+        return scale, pad_x, pad_y
+
+    def close(self) -> None:
+        del self.frames
+        self._shm.close()
+        if self._owner:
+            self._shm.unlink()
+
+
+def _available_cpus() -> List[int]:
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _run_task(model: MLModel, slots: SharedFrameSlots, size: int) -> List[Any]:
+    frames = slots.frames
+    outputs = model([frames[i] for i in range(size)])
+    packed: List[Any] = []
+    for i, output in enumerate(outputs):
+        # Frames go back through shared memory, anything else (e.g.
+        # detections) is small enough to be pickled
+        slot = frames[i]
+        if isinstance(output, np.ndarray) and output.shape == slot.shape:
+            if output is not slot:
+                np.copyto(slot, output)
+            packed.append(_IN_SLOT)
+        else:
+            packed.append(output)
+    return packed
+
+
+def _to_frame_coordinates(
+    detections: Detections,
+    letterbox: Letterbox,
+    frame_shape: Tuple[int, ...],
+) -> Detections:
+    """Boxes found in a slot, mapped back to the frame written to it"""
+    scale, pad_x, pad_y = letterbox
+    if (scale, pad_x, pad_y) == (1.0, 0, 0) or not len(detections):
+        return detections
+    height, width = frame_shape[:2]
+    boxes = (detections.boxes - np.array([pad_x, pad_y] * 2)) / scale
+    np.clip(boxes[:, 0::2], 0, width, out=boxes[:, 0::2])
+    np.clip(boxes[:, 1::2], 0, height, out=boxes[:, 1::2])
+    return Detections(
+        boxes=boxes.astype(np.float32),
+        class_ids=detections.class_ids,
+        scores=detections.scores,
+    )
+
+
+def _worker_main(
+    index: int,
+    generation: int,
+    model_factory: Callable[[], MLModel],
+    slots_name: str,
+    slots_shape: Tuple[int, int, int, int],
+    tasks: "mp.Queue[_Task]",
+    results: "mp.Queue[_Result]",
+    torch_threads: Optional[int],
+    cpu_affinity: Optional[Set[int]],
+) -> None:
+    slots = SharedFrameSlots(
+        slots_shape[0], slots_shape[1], slots_shape[2], name=slots_name
+    )
+    try:
+        if cpu_affinity and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpu_affinity)
+        if torch_threads:
+            try:
+                import torch
+
+                torch.set_num_threads(torch_threads)
+            except ImportError:
+                pass
+        model = model_factory()
+    except Exception as e:
+        results.put(
+            (index, generation, None, "error", f"Failed to start: {e}")
+        )
+        slots.close()
+        return
+    results.put((index, generation, None, "ready", model.class_names))
+
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        task_id, size = task
+        try:
+            output = _run_task(model, slots, size)
+            results.put((index, generation, task_id, "done", output))
+        except Exception as e:
+            results.put((index, generation, task_id, "error", str(e)))
+
+    slots.close()
+
+
+# A worker's frame slots, task queue and process
+_Worker = Tuple[SharedFrameSlots, "mp.Queue[_Task]", Any]
+
+
+class MultiProcessModel(MLModel):
+    """Runs N worker processes, each holding its own model, and splits every
+    batch between them.
+
+    Frames are copied into a fixed pool of shared memory slots per worker
+    rather than pickled, and output frames are written back into the same
+    slots. Frames of another size than the slots are letterboxed into them
+    and the boxes found mapped back. Each worker can be pinned to its own
+    set of CPUs and limited to a number of torch threads, so workers don't
+    fight over cores.
+
+    A worker that dies or takes longer than task_timeout fails the batch
+    with a RuntimeError and is restarted. If it fails to restart, the
+    others carry on without it. Results are tagged with the worker's
+    generation and the task id, so a late result from a replaced worker or
+    an abandoned task is never taken for the current one.
+    """
+
+    def __init__(
+        self,
+        model_factory: Callable[[], MLModel],
+        workers: int,
+        frame_size: Tuple[int, int],
+        slots_per_worker: int,
+        torch_threads: Optional[int] = None,
+        pin_cpus: bool = True,
+        start_timeout: float = 300.0,
+        task_timeout: float = 60.0,
+    ) -> None:
+        # Spawn, forking a process that already runs threads (and maybe
+        # torch) is unsafe
+        self._context = mp.get_context("spawn")
+        width, height = frame_size
+        self._cpu_sets = (
+            self._split_cpus(workers) if pin_cpus else [None] * workers
+        )
+        if torch_threads is None:
+            torch_threads = max(1, len(_available_cpus()) // workers)
+        self._model_factory = model_factory
+        self._torch_threads = torch_threads
+        self._start_timeout = start_timeout
+        self._task_timeout = task_timeout
+
+        self._results: "mp.Queue[_Result]" = self._context.Queue()
+        self._generations = [0] * workers
+        self._task_ids = itertools.count()
+        self._workers: List[_Worker] = [
+            self._start_worker(
+                index, SharedFrameSlots(slots_per_worker, height, width)
+            )
+            for index in range(workers)
+        ]
+        # Workers that failed to restart
+        self._failed: Set[int] = set()
+
+        self._lock = threading.Lock()
+        self._class_names: Dict[int, str] = {}
+        try:
+            self._wait_until_ready(start_timeout, set(range(workers)))
+        except Exception:
+            self.close()
+            raise
+        logger.info(
+            f"{workers} inference workers started, {torch_threads} torch "
+            f"threads each, CPU sets: {self._cpu_sets}"
+        )
+
+    def _start_worker(self, index: int, slots: SharedFrameSlots) -> _Worker:
+        tasks: "mp.Queue[_Task]" = self._context.Queue()
+        process = self._context.Process(
+            name=f"InferenceWorker_{index}",
+            target=_worker_main,
+            args=(
+                index,
+                self._generations[index],
+                self._model_factory,
+                slots.name,
+                slots.shape,
+                tasks,
+                self._results,
+                self._torch_threads,
+                self._cpu_sets[index],
+            ),
+            daemon=True,
+        )
+        process.start()
+        return slots, tasks, process
+
+    def _wait_until_ready(self, timeout: float, indices: Set[int]) -> None:
+        deadline = time.monotonic() + timeout
+        waiting = set(indices)
+        while waiting:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Inference workers failed to start in time")
+            try:
+                result = self._results.get(timeout=1.0)
+            except Empty:
+                for index in waiting:
+                    process = self._workers[index][2]
+                    if process.exitcode is not None:
+                        raise RuntimeError(
+                            f"{process.name} exited with {process.exitcode}"
+                        )
+                continue
+            index, generation, task_id, status, payload = result
+            if (
+                index not in waiting
+                or generation != self._generations[index]
+                or task_id is not None
+            ):
+                continue  # Left over from a worker or task given up on
+            if status != "ready":
+                raise RuntimeError(f"Inference worker {index}: {payload}")
+            self._class_names = payload
+            waiting.discard(index)
+
+    @staticmethod
+    def _split_cpus(workers: int) -> Sequence[Optional[Set[int]]]:
+        cpus = _available_cpus()
+        if len(cpus) < workers:
+            return [None] * workers
+        per_worker = len(cpus) // workers
+        return [
+            set(cpus[i * per_worker : (i + 1) * per_worker])
+            for i in range(workers)
+        ]
+
+    @property
+    def class_names(self) -> Dict[int, str]:
+        return self._class_names
+
+    def _active_workers(self) -> List[int]:
+        active = [
+            index
+            for index in range(len(self._workers))
+            if index not in self._failed
+        ]
+        if not active:
+            raise RuntimeError("Every inference worker failed")
+        return active
+
+    def __call__(self, batch: List[np.ndarray]) -> List[Any]:
+        with self._lock:
+            outputs: List[Any] = []
+            slots_per_worker = self._workers[0][0].shape[0]
+            round_size = slots_per_worker * len(self._active_workers())
+            for start in range(0, len(batch), round_size):
+                outputs.extend(
+                    self._run_round(batch[start : start + round_size])
+                )
+            return outputs
+
+    def _run_round(self, batch: List[np.ndarray]) -> List[Any]:
+        active = self._active_workers()
+        chunk_size = math.ceil(len(batch) / len(active))
+        # Letterbox and shape of every frame by worker
+        chunks: Dict[int, List[Tuple[Letterbox, Tuple[int, ...]]]] = {}
+        task_id = next(self._task_ids)
+        for position, index in enumerate(active):
+            chunk = batch[position * chunk_size : (position + 1) * chunk_size]
+            if not chunk:
+                break
+            slots, tasks, _ = self._workers[index]
+            chunks[index] = [
+                (slots.write(i, frame), frame.shape)
+                for i, frame in enumerate(chunk)
+            ]
+            tasks.put((task_id, len(chunk)))
+
+        results, errors = self._collect(set(chunks), task_id)
+        if errors:
+            raise RuntimeError("; ".join(errors))
+
+        outputs: List[Any] = []
+        for index in sorted(chunks):
+            frames = self._workers[index][0].frames
+            for i, output in enumerate(results[index]):
+                # Slots are reused by the next batch, copy the frame out
+                if isinstance(output, str) and output == _IN_SLOT:
+                    output = frames[i].copy()
+                elif isinstance(output, Detections):
+                    output = _to_frame_coordinates(output, *chunks[index][i])
+                outputs.append(output)
+        return outputs
+
+    def _collect(
+        self, indices: Set[int], task_id: int
+    ) -> Tuple[Dict[int, Any], List[str]]:
+        """Outputs of the workers given task_id, and errors of the ones that
+        failed. Workers that died or hung are restarted once the others
+        are done
+        """
+        results: Dict[int, Any] = {}
+        errors: List[str] = []
+        lost: List[int] = []
+        pending = set(indices)
+        deadline = time.monotonic() + self._task_timeout
+        while pending:
+            try:
+                result = self._results.get(timeout=1.0)
+            except Empty:
+                timed_out = time.monotonic() > deadline
+                for index in sorted(pending):
+                    process = self._workers[index][2]
+                    if process.is_alive() and not timed_out:
+                        continue
+                    pending.discard(index)
+                    lost.append(index)
+                    errors.append(
+                        f"{process.name} took longer than "
+                        f"{self._task_timeout}s"
+                        if process.is_alive()
+                        else f"{process.name} died, exit code "
+                        f"{process.exitcode}"
+                    )
+                continue
+            index, generation, result_task_id, status, payload = result
+            if (
+                index not in pending
+                or generation != self._generations[index]
+                or result_task_id != task_id
+            ):
+                continue  # Left over from a worker or task given up on
+            pending.discard(index)
+            if status == "error":
+                errors.append(f"Inference worker {index} failed: {payload}")
+            else:
+                results[index] = payload
+
+        for index in lost:
+            self._restart_worker(index)
+        return results, errors
+
+    def _restart_worker(self, index: int) -> None:
+        slots, _, process = self._workers[index]
+        if process.is_alive():
+            process.terminate()
+            process.join(timeout=5.0)
+        logger.error(f"Restarting {process.name}")
+        # Anything the old process still sends is stale
+        self._generations[index] += 1
+        try:
+            self._workers[index] = self._start_worker(index, slots)
+            self._wait_until_ready(self._start_timeout, {index})
+        except Exception as e:
+            logger.error(
+                f"Failed to restart {process.name}, going on without it. "
+                f"Error: {e}"
+            )
+            restarted = self._workers[index][2]
+            if restarted is not process and restarted.is_alive():
+                restarted.terminate()
+            self._failed.add(index)
+
+    def close(self) -> None:
+        for slots, tasks, process in self._workers:
+            if process.is_alive():
+                tasks.put(None)
+        for slots, _, process in self._workers:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+            slots.close()
+        self._workers = []
@@ -4,11 +4,31 @@ from dataclasses import dataclass
 
 import numpy as np
 
+from watchdawg.backend.tracing import FrameTrace
+
 
 class BusMessage:
     pass
 
 
+@dataclass
+class Detections:
+    boxes: np.ndarray  # (N, 4) float32, x1 y1 x2 y2 in frame pixels
+    class_ids: np.ndarray  # (N,) int32
+    scores: np.ndarray  # (N,) float32
+
+    @classmethod
+    def empty(cls) -> "Detections":
+        return cls(
+            boxes=np.empty((0, 4), dtype=np.float32),
+            class_ids=np.empty(0, dtype=np.int32),
+            scores=np.empty(0, dtype=np.float32),
+        )
+
+    def __len__(self) -> int:
+        return len(self.scores)
+
+
 @dataclass
 class ClientDisconnectedMessage(BusMessage):
     client_id: uuid.UUID
@@ -19,13 +39,31 @@ class ClientDisconnectedMessage(BusMessage):
 class NewClientConnectedMessage(BusMessage):
     client_id: uuid.UUID
     address: Tuple[str, int]
+    client_name: Optional[str] = None  # From the client's HELLO
+
+
+@dataclass
+class EncodedFrameMessage(BusMessage):
+    client_id: uuid.UUID
+    payload: bytes
+    width: int
+    height: int
+    sequence: int = 0
+    timestamp: float = 0.0  # Client's capture time, seconds since epoch
+    received_at: float = 0.0  # Server's time.monotonic() on arrival
 
 
 @dataclass
 class ProcessFrameMessage(BusMessage):
     client_id: uuid.UUID
     frame: np.ndarray
-    detections: Optional[dict] = None
+    detections: Optional[Detections] = None
+    sequence: int = 0
+    timestamp: float = 0.0  # Client's capture time, seconds since epoch
+    received_at: float = 0.0  # Server's time.monotonic() on arrival
+    trace: Optional[FrameTrace] = None
+    # The frame as received, kept when it is recorded without re-encoding
+    encoded: Optional[EncodedFrameMessage] = None
 
 
 @dataclass
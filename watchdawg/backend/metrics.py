@@ -0,0 +1,70 @@
+"""Metrics of the server process. Stages update them as frames go through,
+App serves them over HTTP when Config.METRICS_PORT is set
+"""
+from watchdawg.util.metrics import MetricsRegistry
+
+
+REGISTRY = MetricsRegistry(prefix="watchdawg_")
+
+CONNECTED_CLIENTS = REGISTRY.gauge(
+    "connected_clients", "Clients connected to the server"
+)
+FRAMES_RECEIVED = REGISTRY.counter(
+    "frames_received_total", "Frames received from a client", ["client"]
+)
+BYTES_RECEIVED = REGISTRY.counter(
+    "received_bytes_total", "Bytes of frames received", ["client"]
+)
+FRAMES_WRITTEN = REGISTRY.counter(
+    "frames_written_total",
+    "Frames with results that made it to the writer's output",
+    ["client"],
+)
+# reason: "queue_full", "fps_cap" (scheduler) or "writer_queue_full"
+FRAMES_DROPPED = REGISTRY.counter(
+    "frames_dropped_total", "Frames dropped on the way", ["client", "reason"]
+)
+DISK_WRITE_PENDING_BYTES = REGISTRY.gauge(
+    "disk_write_pending_bytes", "Bytes of recordings waiting to be written"
+)
+RECORDED_SEGMENTS_DELETED = REGISTRY.counter(
+    "recorded_segments_deleted_total", "Recorded segments deleted by retention"
+)
+RECORDED_EVENTS = REGISTRY.counter(
+    "recorded_events_total",
+    "Events that started an event recording",
+    ["client"],
+)
+DECODE_FAILURES = REGISTRY.counter(
+    "decode_failures_total", "Frames that failed to decode"
+)
+DECODE_SECONDS = REGISTRY.histogram(
+    "decode_seconds",
+    "JPEG decode time per frame",
+    buckets=(0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1),
+)
+QUEUE_DEPTH = REGISTRY.gauge(
+    "queue_depth", "Messages waiting in a queue between stages", ["queue"]
+)
+BATCH_SIZE = REGISTRY.histogram(
+    "batch_size",
+    "Frames per batch sent to the model",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+INFERENCE_SECONDS = REGISTRY.histogram(
+    "inference_seconds", "Model time per batch"
+)
+PROCESS_CPU_PERCENT = REGISTRY.gauge(
+    "process_cpu_percent",
+    "CPU used by the server process over the last sampling interval, 100 "
+    "is one core",
+)
+PROCESS_RSS_BYTES = REGISTRY.gauge(
+    "process_resident_memory_bytes", "Resident memory of the server process"
+)
+# direction: "receive" or "transmit"
+NETWORK_BYTES_PER_SECOND = REGISTRY.gauge(
+    "network_bytes_per_second",
+    "Host network throughput over the last sampling interval",
+    ["direction"],
+)
@@ -1,11 +1,13 @@
 import abc
-from typing import List
+import math
+from typing import Dict, List, Optional
 
 import numpy as np
-import torch
-from ultralytics import YOLO
 
+from watchdawg.backend.messages import Detections
+from watchdawg.backend.batch_builder import BatchBuilder, TensorBatch
 from watchdawg.util.logger import get_logger
+from watchdawg.config import Config
 
 
 logger = get_logger("ml")
@@ -13,27 +15,95 @@ logger = get_logger("ml")
 
 class MLModel(abc.ABC):
     @abc.abstractmethod
-    def __call__(self, batch: List[np.ndarray]):
+    def __call__(self, batch: List[np.ndarray]) -> List[Detections]:
+        pass
+
+    @property
+    def class_names(self) -> Dict[int, str]:
+        return {}
+
+    def create_batch_builder(
+        self, max_batch_size: int, buffers: int
+    ) -> Optional[BatchBuilder]:
+        """Models that take a prebuilt tensor return a builder for their
+        input here and implement infer_tensor(). Others get a list of frames
+        """
+        return None
+
+    def infer_tensor(self, batch: TensorBatch) -> List[Detections]:
+        raise NotImplementedError
+
+    def close(self) -> None:
         pass
 
 
 class PlaceHolderModel(MLModel):
-    def __call__(self, batch: List[np.ndarray]) -> List[dict]:
-        return [{} for _ in batch]
+    def __call__(self, batch: List[np.ndarray]) -> List[Detections]:
+        return [Detections.empty() for _ in batch]
 
 
 class UltralyticsYOLO(MLModel):
     def __init__(self, model: str) -> None:
+        # Heavy optional dependencies, only needed for this backend
+        import torch
+        from ultralytics import YOLO
+
         try:
             self._model = YOLO(model)
         except Exception as e:
             logger.error(
                 f"Failed while loading ultralytics model {model}. Error: {e}"
             )
+            raise e
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         self._model.to(device)
         logger.info(f"UltralyticsYOLO loaded. Inference device: {device}")
 
-    def __call__(self, batch: List[np.ndarray]) -> List[np.ndarray]:
-        results = self._model(batch)
-        return [result.plot() for result in results]
+    @property
+    def class_names(self) -> Dict[int, str]:
+        return dict(self._model.names)
+
+    def __call__(self, batch: List[np.ndarray]) -> List[Detections]:
+        results = self._model(batch, verbose=False)
+        detections = []
+        for result in results:
+            boxes = result.boxes
+            detections.append(
+                Detections(
+                    boxes=boxes.xyxy.cpu().numpy().astype(np.float32),
+                    class_ids=boxes.cls.cpu().numpy().astype(np.int32),
+                    scores=boxes.conf.cpu().numpy().astype(np.float32),
+                )
+            )
+        return detections
+
+
+def load_model(backend: str, weights: str) -> MLModel:
+    """Creates the model for a backend, importing its dependencies only when
+    it is actually used
+    """
+    if backend == "placeholder":
+        return PlaceHolderModel()
+    elif backend == "ultralytics":
+        return UltralyticsYOLO(model=weights)
+    elif backend in ("onnxruntime", "openvino"):
+        from watchdawg.backend.onnx_model import ONNXRuntimeYOLO
+
+        providers = ["CPUExecutionProvider"]
+        if backend == "openvino":
+            providers.insert(0, "OpenVINOExecutionProvider")
+        return ONNXRuntimeYOLO(
+            model=weights,
+            intra_op_threads=Config.ONNX_INTRA_OP_THREADS,
+            inter_op_threads=Config.ONNX_INTER_OP_THREADS,
+            providers=providers,
+            conf_threshold=Config.MODEL_CONF_THRESHOLD,
+            iou_threshold=Config.MODEL_IOU_THRESHOLD,
+            use_fast_nms=Config.ONNX_FAST_NMS,
+            # Dynamic exports: the smallest stride multiple holding a frame
+            input_size=(
+                math.ceil(Config.MODEL_INPUT_HEIGHT / 32) * 32,
+                math.ceil(Config.MODEL_INPUT_WIDTH / 32) * 32,
+            ),
+        )
+    raise ValueError(f"Unknown model backend {backend}")
@@ -0,0 +1,250 @@
+import ast
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import onnxruntime as ort
+
+from watchdawg.backend.messages import Detections
+from watchdawg.backend.batch_builder import BatchBuilder, TensorBatch
+from watchdawg.backend.model import MLModel
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("onnx_model")
+
+
+def nms(
+    boxes: np.ndarray, scores: np.ndarray, iou_threshold: float
+) -> np.ndarray:
+    """Greedy NMS: takes the best remaining box and drops the boxes it
+    overlaps by more than the threshold, until none are left. Loops once per
+    kept box, each pass vectorised over the remaining ones. Returns indices
+    of kept boxes, best first
+    """
+    order = np.argsort(-scores, kind="stable")
+    x1, y1, x2, y2 = boxes[order].T
+    areas = (x2 - x1) * (y2 - y1)
+    keep = []
+    remaining = np.arange(len(order))
+    while len(remaining):
+        best, rest = remaining[0], remaining[1:]
+        keep.append(best)
+        inter = np.clip(
+            np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]),
+            0,
+            None,
+        ) * np.clip(
+            np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]),
+            0,
+            None,
+        )
+        iou = inter / (areas[best] + areas[rest] - inter + 1e-9)
+        remaining = rest[iou <= iou_threshold]
+    return order[np.array(keep, dtype=np.intp)]
+
+
+def fast_nms(
+    boxes: np.ndarray, scores: np.ndarray, iou_threshold: float
+) -> np.ndarray:
+    """Fully vectorised NMS: a box is dropped if it overlaps any higher
+    scoring box by more than the threshold. More aggressive than greedy NMS
+    (a suppressed box still suppresses others), which loses detections in
+    crowds, but has no Python loop over boxes. Returns indices of kept
+    boxes, best first
+    """
+    order = np.argsort(-scores, kind="stable")
+    boxes = boxes[order]
+    x1, y1, x2, y2 = boxes.T
+    areas = (x2 - x1) * (y2 - y1)
+    inter_w = np.clip(
+        np.minimum(x2[:, None], x2[None]) - np.maximum(x1[:, None], x1[None]),
+        0,
+        None,
+    )
+    inter_h = np.clip(
+        np.minimum(y2[:, None], y2[None]) - np.maximum(y1[:, None], y1[None]),
+        0,
+        None,
+    )
+    inter = inter_w * inter_h
+    iou = inter / (areas[:, None] + areas[None] - inter + 1e-9)
+    # Only overlaps with higher scoring boxes (rows before) count
+    iou = np.triu(iou, k=1)
+    return order[iou.max(axis=0, initial=0.0) <= iou_threshold]
+
+
+class ONNXRuntimeYOLO(MLModel):
+    """YOLOv8 exported to ONNX (`yolo export format=onnx dynamic=True`)
+    running on ONNX Runtime. Pass OpenVINOExecutionProvider in providers to
+    run it through OpenVINO (needs onnxruntime-openvino).
+
+    input_size (height, width) is only used when the export has dynamic
+    spatial axes, and must be a multiple of the model stride (32).
+    use_fast_nms trades greedy NMS for Fast-NMS, which drops more
+    overlapping detections in crowded scenes.
+    """
+
+    def __init__(
+        self,
+        model: str,
+        intra_op_threads: int = 0,
+        inter_op_threads: int = 0,
+        providers: Optional[Sequence[str]] = None,
+        conf_threshold: float = 0.25,
+        iou_threshold: float = 0.45,
+        max_candidates: int = 1000,
+        input_size: Tuple[int, int] = (640, 640),
+        use_fast_nms: bool = False,
+    ) -> None:
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = intra_op_threads
+        options.inter_op_num_threads = inter_op_threads
+        options.graph_optimization_level = (
+            ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        )
+        if inter_op_threads > 1:
+            options.execution_mode = ort.ExecutionMode.ORT_PARALLEL
+        try:
+            self._session = ort.InferenceSession(
+                model,
+                sess_options=options,
+                providers=list(providers or ["CPUExecutionProvider"]),
+            )
+        except Exception as e:
+            logger.error(
+                f"Failed while loading ONNX model {model}. Error: {e}"
+            )
+            raise e
+
+        model_input = self._session.get_inputs()[0]
+        self._input_name = model_input.name
+        batch, _, height, width = model_input.shape
+        # Dynamic axes come as strings or None
+        self._input_size = (
+            height if isinstance(height, int) else input_size[0],
+            width if isinstance(width, int) else input_size[1],
+        )
+        self._input_dtype = (
+            np.uint8 if model_input.type == "tensor(uint8)" else np.float32
+        )
+        self._max_batch = batch if isinstance(batch, int) else None
+        # Used by __call__, FeedProcessor brings its own via
+        # create_batch_builder
+        self._batch_builder: Optional[BatchBuilder] = None
+        self._conf_threshold = conf_threshold
+        self._iou_threshold = iou_threshold
+        self._max_candidates = max_candidates
+        self._nms = fast_nms if use_fast_nms else nms
+        self._class_names = self._read_class_names()
+        logger.info(
+            f"ONNXRuntimeYOLO loaded. Input {self._input_size}, providers: "
+            f"{self._session.get_providers()}"
+        )
+
+    def _read_class_names(self) -> Dict[int, str]:
+        metadata = self._session.get_modelmeta().custom_metadata_map
+        try:
+            return ast.literal_eval(metadata["names"])
+        except (KeyError, ValueError, SyntaxError):
+            return {}
+
+    @property
+    def class_names(self) -> Dict[int, str]:
+        return self._class_names
+
+    @property
+    def input_size(self) -> Tuple[int, int]:
+        """(height, width) the model expects"""
+        return self._input_size
+
+    def create_batch_builder(
+        self, max_batch_size: int, buffers: int
+    ) -> BatchBuilder:
+        return BatchBuilder(
+            max_batch_size,
+            self._input_size,
+            buffers=buffers,
+            dtype=self._input_dtype,
+        )
+
+    def __call__(self, batch: List[np.ndarray]) -> List[Detections]:
+        builder = self._batch_builder
+        if builder is None or builder.max_batch_size < len(batch):
+            builder = self.create_batch_builder(len(batch), buffers=1)
+            self._batch_builder = builder
+        return self.infer_tensor(builder.build(batch))
+
+    def infer_tensor(self, batch: TensorBatch) -> List[Detections]:
+        tensor = batch.tensor
+        step = self._max_batch or len(tensor)
+        predictions = [
+            self._session.run(
+                None, {self._input_name: tensor[start : start + step]}
+            )[0]
+            for start in range(0, len(tensor), step)
+        ]
+        return self._postprocess(
+            (
+                predictions[0]
+                if len(predictions) == 1
+                else np.concatenate(predictions)
+            ),
+            batch.scales,
+            batch.pads,
+            batch.frame_sizes,
+        )
+
+    def _postprocess(
+        self,
+        predictions: np.ndarray,
+        scales: np.ndarray,
+        pads: np.ndarray,
+        frame_sizes: np.ndarray,
+    ) -> List[Detections]:
+        # (N, 4 + classes, anchors) -> (N, anchors, 4 + classes)
+        predictions = predictions.transpose(0, 2, 1)
+        class_scores = predictions[..., 4:]
+        class_ids = class_scores.argmax(axis=-1)
+        scores = np.take_along_axis(
+            class_scores, class_ids[..., None], axis=-1
+        )[..., 0]
+        candidates = scores > self._conf_threshold
+
+        results = []
+        for i in range(len(predictions)):
+            mask = candidates[i]
+            if not mask.any():
+                results.append(Detections.empty())
+                continue
+            frame_scores = scores[i][mask]
+            frame_classes = class_ids[i][mask]
+            cx, cy, w, h = predictions[i][mask][:, :4].T
+            boxes = np.stack(
+                (cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2), axis=1
+            )
+            if len(frame_scores) > self._max_candidates:
+                top = np.argpartition(-frame_scores, self._max_candidates)
+                top = top[: self._max_candidates]
+                boxes = boxes[top]
+                frame_scores = frame_scores[top]
+                frame_classes = frame_classes[top]
+
+            # Offsetting boxes by class keeps NMS from suppressing across
+            # classes while still running it once for all of them
+            offsets = frame_classes[:, None] * float(max(self._input_size))
+            keep = self._nms(
+                boxes + offsets, frame_scores, self._iou_threshold
+            )
+
+            frame_height, frame_width = frame_sizes[i]
+            boxes = (boxes[keep] - np.tile(pads[i], 2)) / scales[i]
+            np.clip(boxes[:, 0::2], 0, frame_width, out=boxes[:, 0::2])
+            np.clip(boxes[:, 1::2], 0, frame_height, out=boxes[:, 1::2])
+            results.append(
+                Detections(
+                    boxes=boxes.astype(np.float32),
+                    class_ids=frame_classes[keep].astype(np.int32),
+                    scores=frame_scores[keep].astype(np.float32),
+                )
+            )
+        return results
@@ -0,0 +1,493 @@
+"""Recording of clients' frames as MJPEG AVI segments, from the JPEGs
+clients send as they are or from frames encoded for saving. A client's
+recording is split into segments bounded in duration and size (and by
+resolution changes), each with the detections of every frame in a JSON
+Lines sidecar next to it. Closed segments are listed with their time range
+in the folder's index, which retention prunes. render.py draws the
+detections on a segment when somebody wants to watch it annotated.
+"""
+import array
+import dataclasses
+import json
+import os
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Union
+
+import numpy as np
+
+from watchdawg.backend.messages import Detections, ProcessFrameMessage
+from watchdawg.util.disk_writer import AsyncFile, DiskWriter, LocalFile
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("recording")
+
+
+_AVIF_HASINDEX = 0x10
+_AVIIF_KEYFRAME = 0x10
+_AVIH_SIZE = 56
+_STRH_SIZE = 56
+_STRF_SIZE = 40
+# RIFF AVI 1.0 sizes are 32 bit and many players stop at 1 GiB
+MAX_AVI_SIZE = 2**30
+
+
+def _chunk_header(fourcc: bytes, size: int) -> bytes:
+    return fourcc + struct.pack("<I", size)
+
+
+class MJPEGAviWriter:
+    """Writes JPEG frames into an AVI file as they are.
+
+    The headers are written with placeholders first and patched on
+    close(), with the frame count, the index and the average frame rate of
+    what was written (frames arrive at a variable rate, AVI has a single
+    one; exact capture times are in the sidecar). The file is written by
+    disk_writer's thread if given.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        width: int,
+        height: int,
+        fps: float = 10.0,
+        disk_writer: Optional[DiskWriter] = None,
+    ) -> None:
+        self.path = path
+        self.width = width
+        self.height = height
+        self._fps = fps
+        self._file: Union[AsyncFile, LocalFile] = (
+            disk_writer.open(path)
+            if disk_writer is not None
+            else LocalFile(path)
+        )
+        # (offset from the "movi" fourcc, size) of every frame
+        self._offsets = array.array("I")
+        self._sizes = array.array("I")
+        self._max_frame_size = 0
+        self._first_at: Optional[float] = None
+        self._last_at: Optional[float] = None
+        self._file.write(self._headers(frames=0, fps=fps))
+        self._movi_start = self._file.tell()
+        self._file.write(b"LIST" + b"\0\0\0\0" + b"movi")
+
+    @property
+    def frames(self) -> int:
+        return len(self._sizes)
+
+    @property
+    def size(self) -> int:
+        """Bytes written so far, without the index written on close"""
+        return self._file.tell()
+
+    def _headers(self, frames: int, fps: float) -> bytes:
+        width, height = self.width, self.height
+        scale, rate = 1000, max(1, round(fps * 1000))
+        avih = struct.pack(
+            "<14I",
+            round(1e6 / max(fps, 1e-3)),  # Microseconds per frame
+            0,  # Max bytes per second
+            0,  # Padding granularity
+            _AVIF_HASINDEX,
+            frames,
+            0,  # Initial frames
+            1,  # Streams
+            self._max_frame_size,  # Suggested buffer size
+            width,
+            height,
+            0,
+            0,
+            0,
+            0,
+        )
+        strh = b"vidsMJPG" + struct.pack(
+            "<IHHIIIIIIIIhhhh",
+            0,  # Flags
+            0,  # Priority
+            0,  # Language
+            0,  # Initial frames
+            scale,
+            rate,
+            0,  # Start
+            frames,  # Length
+            self._max_frame_size,
+            0xFFFFFFFF,  # Quality, -1 is the default
+            0,  # Sample size, 0 is variable
+            0,
+            0,
+            width,
+            height,
+        )
+        strf = struct.pack(
+            "<IiiHH4sIiiII",
+            _STRF_SIZE,
+            width,
+            height,
+            1,  # Planes
+            24,  # Bits per pixel
+            b"MJPG",
+            width * height * 3,
+            0,
+            0,
+            0,
+            0,
+        )
+        strl = (
+            b"strl"
+            + _chunk_header(b"strh", _STRH_SIZE)
+            + strh
+            + _chunk_header(b"strf", _STRF_SIZE)
+            + strf
+        )
+        hdrl = (
+            b"hdrl"
+            + _chunk_header(b"avih", _AVIH_SIZE)
+            + avih
+            + _chunk_header(b"LIST", len(strl))
+            + strl
+        )
+        return (
+            b"RIFF"
+            + b"\0\0\0\0"  # Patched on close
+            + b"AVI "
+            + _chunk_header(b"LIST", len(hdrl))
+            + hdrl
+        )
+
+    def write(self, jpeg: bytes, captured_at: Optional[float] = None) -> None:
+        """captured_at, in seconds, is used for the average frame rate"""
+        size = len(jpeg)
+        # Offsets are relative to the "movi" fourcc
+        self._offsets.append(self._file.tell() - self._movi_start - 8)
+        self._sizes.append(size)
+        self._max_frame_size = max(self._max_frame_size, size)
+        self._file.write(_chunk_header(b"00dc", size))
+        self._file.write(jpeg)
+        if size % 2:
+            self._file.write(b"\0")
+        now = captured_at if captured_at is not None else time.time()
+        if self._first_at is None:
+            self._first_at = now
+        self._last_at = now
+
+    def close(self, on_closed: Optional[Callable[[], None]] = None) -> None:
+        """on_closed is called once the file is complete on disk"""
+        if self._file.closed:
+            return
+        movi_end = self._file.tell()
+        index = bytearray()
+        for offset, size in zip(self._offsets, self._sizes):
+            index += struct.pack(
+                "<4sIII", b"00dc", _AVIIF_KEYFRAME, offset, size
+            )
+        self._file.write(_chunk_header(b"idx1", len(index)) + index)
+        riff_end = self._file.tell()
+
+        fps = self._fps
+        first_at, last_at = self._first_at, self._last_at
+        if first_at is not None and last_at is not None and last_at > first_at:
+            fps = (self.frames - 1) / (last_at - first_at)
+        headers = bytearray(self._headers(frames=self.frames, fps=fps))
+        headers[4:8] = struct.pack("<I", riff_end - 8)
+        self._file.write_at(0, headers)
+        self._file.write_at(
+            self._movi_start + 4,
+            struct.pack("<I", movi_end - self._movi_start - 8),
+        )
+        self._file.close(on_closed)
+
+
+def detections_record(
+    index: int,
+    sequence: int,
+    timestamp: float,
+    detections: Optional[Detections],
+    scale: float = 1.0,
+) -> dict:
+    """The sidecar line of a frame. Boxes are scaled by scale to the
+    recorded JPEG's pixels, the model may have seen a resized frame
+    """
+    record = {
+        "index": index,
+        "sequence": sequence,
+        "timestamp": timestamp,
+    }
+    if detections is not None and len(detections):
+        record["boxes"] = np.round(
+            detections.boxes.astype(np.float64) * scale, 1
+        ).tolist()
+        record["class_ids"] = detections.class_ids.tolist()
+        record["scores"] = np.round(
+            detections.scores.astype(np.float64), 3
+        ).tolist()
+    return record
+
+
+def read_detections(path: str) -> Dict[int, Detections]:
+    """Detections of a sidecar by frame index"""
+    detections = {}
+    with open(path) as f:
+        for line in f:
+            record = json.loads(line)
+            if "boxes" not in record:
+                continue
+            detections[record["index"]] = Detections(
+                boxes=np.array(record["boxes"], dtype=np.float32),
+                class_ids=np.array(record["class_ids"], dtype=np.int32),
+                scores=np.array(record["scores"], dtype=np.float32),
+            )
+    return detections
+
+
+@dataclass
+class RecordedSegment:
+    """A closed segment in the index, paths are relative to its folder"""
+
+    client: str
+    video: str
+    sidecar: str
+    start: float  # Capture times of the first and the last frame
+    end: float
+    frames: int
+    size: int  # Bytes of the video and the sidecar
+
+
+class RecordingIndex:
+    """The closed segments of a recordings folder, in <folder>/index.jsonl.
+
+    Segments are added once their files are complete, so the index never
+    lists one being written, and deleted oldest first by prune(). Safe to
+    use from several threads.
+    """
+
+    FILENAME = "index.jsonl"
+
+    def __init__(self, folder: str) -> None:
+        self._folder = folder
+        self._path = os.path.join(folder, self.FILENAME)
+        self._lock = threading.Lock()
+        self._segments: List[RecordedSegment] = []
+        if os.path.exists(self._path):
+            with open(self._path) as f:
+                for line in f:
+                    try:
+                        self._segments.append(
+                            RecordedSegment(**json.loads(line))
+                        )
+                    except (ValueError, TypeError):
+                        # The last line, cut short by a crash
+                        logger.warning(f"Skipped a bad line of {self._path}")
+
+    def add(self, segment: RecordedSegment) -> None:
+        with self._lock:
+            self._segments.append(segment)
+            with open(self._path, "a") as f:
+                f.write(json.dumps(dataclasses.asdict(segment)) + "\n")
+
+    def segments(
+        self,
+        client: Optional[str] = None,
+        start: float = -np.inf,
+        end: float = np.inf,
+    ) -> List[RecordedSegment]:
+        """Segments with frames in [start, end), oldest first"""
+        with self._lock:
+            return sorted(
+                (
+                    segment
+                    for segment in self._segments
+                    if (client is None or segment.client == client)
+                    and segment.end >= start
+                    and segment.start < end
+                ),
+                key=lambda segment: segment.start,
+            )
+
+    def prune(
+        self, max_age: float = 0.0, max_size: int = 0
+    ) -> List[RecordedSegment]:
+        """Deletes the segments that ended more than max_age seconds ago,
+        then the oldest ones until the others take max_size bytes at most.
+        0 disables either. Returns the deleted segments
+        """
+        with self._lock:
+            kept = sorted(self._segments, key=lambda segment: segment.end)
+            deleted = []
+            if max_age:
+                oldest_end = time.time() - max_age
+                deleted = [s for s in kept if s.end < oldest_end]
+                kept = kept[len(deleted) :]
+            if max_size:
+                size = sum(segment.size for segment in kept)
+                while kept and size > max_size:
+                    deleted.append(kept.pop(0))
+                    size -= deleted[-1].size
+            if not deleted:
+                return []
+
+            for segment in deleted:
+                for name in (segment.video, segment.sidecar):
+                    try:
+                        os.remove(os.path.join(self._folder, name))
+                    except FileNotFoundError:
+                        pass
+            self._segments = kept
+            with open(self._path + ".tmp", "w") as f:
+                for segment in kept:
+                    f.write(json.dumps(dataclasses.asdict(segment)) + "\n")
+            os.replace(self._path + ".tmp", self._path)
+        logger.info(
+            f"Deleted {len(deleted)} recorded segments, "
+            f"{sum(segment.size for segment in deleted) / 2**20:.0f} MB"
+        )
+        return deleted
+
+
+class JpegRecorder:
+    """Records a client's frames as JPEGs, the ones they arrived as or
+    frames the caller encoded.
+
+    Frames go to <prefix>_<part>.avi and their detections to
+    <prefix>_<part>.jsonl. A new part starts when the client changes its
+    resolution, which AVI can't express, a part reaches max_file_size or
+    spans max_duration seconds (0 is unbounded). Files are written by
+    disk_writer's thread if given, closed parts are added to index.
+    """
+
+    def __init__(
+        self,
+        prefix: str,
+        fps: float = 10.0,
+        max_file_size: int = MAX_AVI_SIZE,
+        max_duration: float = 0.0,
+        disk_writer: Optional[DiskWriter] = None,
+        index: Optional[RecordingIndex] = None,
+        client: str = "",
+    ) -> None:
+        self._prefix = prefix
+        self._fps = fps
+        self._max_file_size = max_file_size
+        self._max_duration = max_duration
+        self._disk_writer = disk_writer
+        self._index = index
+        self._client = client
+        self._part = 0
+        self._writer: Optional[MJPEGAviWriter] = None
+        self._sidecar: Union[AsyncFile, LocalFile, None] = None
+        # Capture times of the part's first and last frame
+        self._started_at = 0.0
+        self._ended_at = 0.0
+
+    def write(self, message: ProcessFrameMessage) -> bool:
+        """Returns False if the frame has no JPEG to record"""
+        encoded = message.encoded
+        if encoded is None:
+            return False
+        self.write_jpeg(
+            message, encoded.payload, encoded.width, encoded.height
+        )
+        return True
+
+    def write_jpeg(
+        self,
+        message: ProcessFrameMessage,
+        jpeg: bytes,
+        width: int,
+        height: int,
+    ) -> None:
+        """Records jpeg, width x height pixels, as message's frame. The
+        message's boxes are scaled to it
+        """
+        self.write_frame(
+            jpeg,
+            width,
+            height,
+            message.timestamp or time.time(),
+            message.sequence,
+            message.detections,
+            width / message.frame.shape[1],
+        )
+
+    def write_frame(
+        self,
+        jpeg: bytes,
+        width: int,
+        height: int,
+        timestamp: float,
+        sequence: int = 0,
+        detections: Optional[Detections] = None,
+        scale: float = 1.0,
+    ) -> None:
+        """Records a frame kept without its message, e.g. buffered. Boxes
+        are scaled by scale to the JPEG's pixels
+        """
+        writer = self._writer
+        if (
+            writer is None
+            or (writer.width, writer.height) != (width, height)
+            or writer.size + len(jpeg) > self._max_file_size
+            or (
+                self._max_duration
+                and timestamp - self._started_at >= self._max_duration
+            )
+        ):
+            writer = self._next_part(width, height, timestamp)
+
+        assert self._sidecar is not None
+        record = detections_record(
+            writer.frames, sequence, timestamp, detections, scale
+        )
+        self._sidecar.write(json.dumps(record).encode() + b"\n")
+        writer.write(jpeg, timestamp)
+        self._ended_at = timestamp
+
+    def _open(self, path: str) -> Union[AsyncFile, LocalFile]:
+        if self._disk_writer is not None:
+            return self._disk_writer.open(path)
+        return LocalFile(path)
+
+    def _next_part(
+        self, width: int, height: int, timestamp: float
+    ) -> MJPEGAviWriter:
+        self.close()
+        self._part += 1
+        path = f"{self._prefix}_{self._part:03d}"
+        self._writer = MJPEGAviWriter(
+            f"{path}.avi", width, height, self._fps, self._disk_writer
+        )
+        self._sidecar = self._open(f"{path}.jsonl")
+        self._started_at = timestamp
+        logger.debug(f"Recording to {path}.avi at {width}x{height}")
+        return self._writer
+
+    def close(self) -> None:
+        writer, sidecar = self._writer, self._sidecar
+        if writer is None or sidecar is None:
+            return
+        self._writer = self._sidecar = None
+        segment = RecordedSegment(
+            client=self._client,
+            video=os.path.basename(writer.path),
+            sidecar=os.path.basename(sidecar.path),
+            start=self._started_at,
+            end=self._ended_at,
+            frames=writer.frames,
+            size=0,
+        )
+        index = self._index
+        paths = (writer.path, sidecar.path)
+
+        def on_closed() -> None:
+            if index is not None:
+                segment.size = sum(os.path.getsize(path) for path in paths)
+                index.add(segment)
+
+        # Both are closed in order by the disk writer's thread
+        sidecar.close()
+        writer.close(on_closed)
+        logger.debug(f"Recorded {segment.frames} frames to {segment.video}")
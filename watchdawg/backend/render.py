@@ -0,0 +1,78 @@
+"""Renders a recording made with ResultWriterMode.RECORD_FRAMES with its
+detections drawn on, into a new video or a window.
+
+    python -m watchdawg.backend.render recordings/10.0.0.5:5000_<id>_001.avi \
+        --output annotated.avi
+"""
+import argparse
+import os
+from typing import List, Optional
+
+import cv2
+
+from watchdawg.backend.recording import read_detections
+from watchdawg.backend.results_writer import draw_detections
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("render")
+
+
+def render(
+    recording: str, output: Optional[str] = None, show: bool = False
+) -> int:
+    """Returns the number of frames rendered"""
+    sidecar = os.path.splitext(recording)[0] + ".jsonl"
+    detections = read_detections(sidecar) if os.path.exists(sidecar) else {}
+    capture = cv2.VideoCapture(recording)
+    if not capture.isOpened():
+        raise RuntimeError(f"Failed to open {recording}")
+    video_out = None
+    index = 0
+    try:
+        while True:
+            grabbed, frame = capture.read()
+            if not grabbed:
+                break
+            if index in detections:
+                draw_detections(frame, detections[index])
+            if output:
+                if video_out is None:
+                    video_out = cv2.VideoWriter(
+                        output,
+                        cv2.VideoWriter_fourcc(*"MJPG"),
+                        capture.get(cv2.CAP_PROP_FPS) or 10.0,
+                        (frame.shape[1], frame.shape[0]),
+                    )
+                video_out.write(frame)
+            if show:
+                cv2.imshow(recording, frame)
+                if cv2.waitKey(1) & 0xFF == ord("q"):
+                    break
+            index += 1
+    finally:
+        capture.release()
+        if video_out is not None:
+            video_out.release()
+        if show:
+            cv2.destroyWindow(recording)
+    logger.info(
+        f"Rendered {index} frames of {recording}, {len(detections)} with "
+        f"detections"
+    )
+    return index
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m watchdawg.backend.render")
+    parser.add_argument("recording", help="An .avi with a .jsonl sidecar")
+    parser.add_argument("--output", default=None, help="Annotated video")
+    parser.add_argument("--show", action="store_true")
+    args = parser.parse_args(argv)
+    if not args.output and not args.show:
+        parser.error("Nothing to do, pass --output and/or --show")
+    render(args.recording, args.output, args.show)
+
+
+if __name__ == "__main__":
+    main()
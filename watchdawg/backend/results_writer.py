@@ -1,37 +1,135 @@
 import enum
 import uuid
-from queue import Queue, Empty, Full
+from dataclasses import dataclass
+from queue import Queue, Empty
 import os
 import threading
-from typing import MutableMapping, Tuple, Union, List
+import time
+from typing import Any, Dict, Optional, Tuple, Union, List
 
 import numpy as np
 import cv2
 
+from watchdawg.util.disk_writer import DiskWriter, FsyncPolicy
 from watchdawg.util.logger import get_logger
+from watchdawg.util.profiler import section
 from watchdawg.backend.messages import (
+    Detections,
     NewClientConnectedMessage,
     ClientDisconnectedMessage,
     FramesBatchMessage,
+    ProcessFrameMessage,
 )
+from watchdawg.backend.detections_store import DetectionsStore
+from watchdawg.backend.event_recording import EventRecorder, TriggerRule
+from watchdawg.backend.metrics import (
+    FRAMES_DROPPED,
+    FRAMES_WRITTEN,
+    RECORDED_EVENTS,
+    RECORDED_SEGMENTS_DELETED,
+)
+from watchdawg.backend.recording import JpegRecorder, RecordingIndex
+from watchdawg.backend.tracing import FrameTracer, TracePoint
 from watchdawg.config import Config
 
 
 logger = get_logger("results_writer")
 
 
+# None stops the worker
+_WorkerItem = Union[
+    NewClientConnectedMessage,
+    ProcessFrameMessage,
+    ClientDisconnectedMessage,
+    None,
+]
+
+
+def _class_color(class_id: int) -> Tuple[int, int, int]:
+    return (
+        (37 * class_id + 80) % 256,
+        (17 * class_id + 160) % 256,
+        (29 * class_id + 40) % 256,
+    )
+
+
+def draw_detections(
+    frame: np.ndarray,
+    detections: Detections,
+    class_names: Optional[Dict[int, str]] = None,
+) -> None:
+    """Draws boxes and labels on the frame in place"""
+    class_names = class_names or {}
+    for box, class_id, score in zip(
+        detections.boxes.astype(np.int32),
+        detections.class_ids,
+        detections.scores,
+    ):
+        color = _class_color(int(class_id))
+        x1, y1, x2, y2 = box
+        label = class_names.get(int(class_id), str(class_id))
+        cv2.rectangle(frame, (x1, y1), (x2, y2), color, 2)
+        cv2.putText(
+            frame,
+            f"{label} {score:.2f}",
+            (x1, max(y1 - 5, 10)),
+            cv2.FONT_HERSHEY_SIMPLEX,
+            0.5,
+            color,
+            1,
+            cv2.LINE_AA,
+        )
+
+
 class ResultWriterMode(enum.Enum):
     SHOW_FRAMES = 1
     SAVE_FRAMES = 2
     SHOW_AND_SAVE_FRAMES = 3
+    DISCARD_FRAMES = 4  # Headless, e.g. for benchmarks
+    # The JPEGs as received and a detections sidecar, nothing re-encoded
+    RECORD_FRAMES = 5
+    # Like RECORD_FRAMES, around frames with detections matching a rule
+    RECORD_EVENTS = 6
+
+
+@dataclass
+class _ClientOutput:
+    """Where a worker sends a client's frames"""
+
+    name: str
+    frames_written: Any  # The client's FRAMES_WRITTEN series
+    window_name: Optional[str] = None
+    saver: Optional[JpegRecorder] = None  # Frames encoded here
+    recorder: Optional[JpegRecorder] = None  # JPEGs as received
+    events: Optional[EventRecorder] = None
 
 
 class ResultsWriter(threading.Thread):
+    """Hands processed frames to a fixed pool of worker threads that show
+    and/or save them.
+
+    Clients are sharded over the workers by ID, so all frames of a client go
+    to the same worker, in order, and the number of threads doesn't grow
+    with the number of cameras. Connects and disconnects are queued to the
+    worker like frames and never block, only frames are dropped when a
+    worker falls behind by more than worker_queue_size messages.
+
+    Saved and recorded videos are written in segments by a DiskWriter
+    thread, so workers only encode, and old segments are deleted as
+    Config.RECORD_RETENTION_* say. Detections are appended to
+    detections_store if given, it is closed when the writer stops.
+    """
+
     def __init__(
         self,
         events_queue_in: Queue,
         mode: ResultWriterMode,
         save_folder: str,
+        class_names: Optional[Dict[int, str]] = None,
+        tracer: Optional[FrameTracer] = None,
+        workers: int = Config.RESULT_WRITER_WORKERS,
+        worker_queue_size: int = Config.RESULT_WRITER_WORKER_QUEUE,
+        detections_store: Optional[DetectionsStore] = None,
         *args,
         **kwargs,
     ) -> None:
@@ -39,32 +137,97 @@ class ResultsWriter(threading.Thread):
         self._queue = events_queue_in
         self._mode = mode
         self._save_folder = save_folder
+        self._class_names = class_names or {}
+        self._tracer = tracer
+        self._detections_store = detections_store
+        self._worker_queue_size = worker_queue_size
+        self._is_visual_mode = mode in {
+            ResultWriterMode.SHOW_FRAMES,
+            ResultWriterMode.SHOW_AND_SAVE_FRAMES,
+        }
+        self._is_disk_mode = mode in {
+            ResultWriterMode.SAVE_FRAMES,
+            ResultWriterMode.SHOW_AND_SAVE_FRAMES,
+        }
+        self._is_record_mode = mode is ResultWriterMode.RECORD_FRAMES
+        self._is_event_mode = mode is ResultWriterMode.RECORD_EVENTS
+        self._disk_writer: Optional[DiskWriter] = None
+        self._index: Optional[RecordingIndex] = None
 
+        self._frames_in = 0
         self._stop_event = threading.Event()
-        self._client_handlers: MutableMapping[
-            uuid.UUID, Tuple[Queue, threading.Thread]
-        ] = {}
+        # Unbounded so control messages never block, frames are bounded by
+        # worker_queue_size when they are put
+        self._worker_queues: List["Queue[_WorkerItem]"] = [
+            Queue() for _ in range(workers)
+        ]
+        self._workers = [
+            threading.Thread(
+                name=f"ResultsWriterWorker_{index}",
+                target=self._safe_work,
+                args=(worker_queue,),
+            )
+            for index, worker_queue in enumerate(self._worker_queues)
+        ]
+        # Names of connected clients
+        self._client_names: Dict[uuid.UUID, str] = {}
         self._prepare()
-        logger.debug("ResultsWriter initialised")
+        logger.debug(f"ResultsWriter initialised with {workers} workers")
 
     def _prepare(self) -> None:
-        if self._mode in [
-            ResultWriterMode.SAVE_FRAMES,
-            ResultWriterMode.SHOW_AND_SAVE_FRAMES,
-        ] and not os.path.exists(self._save_folder):
+        if not (
+            self._is_disk_mode or self._is_record_mode or self._is_event_mode
+        ):
+            return
+        if not os.path.exists(self._save_folder):
             os.mkdir(self._save_folder)
             logger.debug(f"Created folder {self._save_folder} to save feed to")
+        self._index = RecordingIndex(self._save_folder)
+        self._disk_writer = DiskWriter(
+            fsync_policy=FsyncPolicy(Config.RECORD_FSYNC),
+            fsync_interval=Config.RECORD_FSYNC_INTERVAL,
+            buffer_size=Config.RECORD_WRITE_BUFFER,
+            max_pending_bytes=Config.RECORD_MAX_PENDING_BYTES,
+            name="DiskWriter",
+        )
+
+    @property
+    def recording_index(self) -> Optional[RecordingIndex]:
+        return self._index
 
-    def report_handlers_queue_size(self) -> List[Tuple[uuid.UUID, int]]:
-        queue_sizes = []
-        for client, (queue, _) in self._client_handlers.items():
-            queue_sizes.append((client, queue.qsize()))
-        return queue_sizes
+    def report_worker_queue_sizes(self) -> List[int]:
+        return [worker_queue.qsize() for worker_queue in self._worker_queues]
+
+    def report_disk(self) -> Optional[dict]:
+        if self._disk_writer is None:
+            return None
+        return self._disk_writer.report()
+
+    def report(self) -> dict:
+        """Frames that reached the writer. Latencies are in the tracer's
+        report
+        """
+        return {
+            "frames_in": self._frames_in,
+            "worker_queues": self.report_worker_queue_sizes(),
+            "disk": self.report_disk(),
+        }
+
+    def _worker_queue(self, client_id: uuid.UUID) -> "Queue[_WorkerItem]":
+        return self._worker_queues[client_id.int % len(self._worker_queues)]
 
     def run(self) -> None:
         logger.debug("ResultsWriter started")
+        if self._disk_writer is not None:
+            self._disk_writer.start()
+        for worker in self._workers:
+            worker.start()
 
+        retention_at = time.monotonic()
         while not self._stop_event.is_set():
+            if time.monotonic() >= retention_at:
+                self._schedule_retention()
+                retention_at += Config.RECORD_RETENTION_CHECK_INTERVAL
             try:
                 message = self._queue.get(timeout=0.5)
             except Empty:
@@ -77,140 +240,260 @@ class ResultsWriter(threading.Thread):
             elif isinstance(message, FramesBatchMessage):
                 self._process_batch(message)
 
+        # Workers close the outputs of clients still connected on the way
+        # out
+        for worker_queue in self._worker_queues:
+            worker_queue.put(None)
+        for worker in self._workers:
+            worker.join(timeout=2.0)
+            if worker.is_alive():
+                logger.error(f"Failed to stop {worker.name} in time")
+        # After the workers, their last segments are still written
+        if self._disk_writer is not None:
+            self._disk_writer.stop()
+            self._disk_writer.join(timeout=10.0)
+            if self._disk_writer.is_alive():
+                logger.error("Failed to write recordings in time")
+        if self._detections_store is not None:
+            self._detections_store.close()
+        self._client_names.clear()
         logger.debug("ResultsWriter finished")
 
+    def _schedule_retention(self) -> None:
+        """Deletes old segments on the disk writer's thread, in order with
+        the writes
+        """
+        if self._disk_writer is None or not (
+            Config.RECORD_RETENTION_SECONDS or Config.RECORD_RETENTION_BYTES
+        ):
+            return
+        index = self._index
+        assert index is not None
+        prune = index.prune
+
+        def apply_retention() -> None:
+            deleted = prune(
+                Config.RECORD_RETENTION_SECONDS, Config.RECORD_RETENTION_BYTES
+            )
+            RECORDED_SEGMENTS_DELETED.inc(len(deleted))
+
+        self._disk_writer.call(apply_retention)
+
     def _connect_new_client(self, message: NewClientConnectedMessage) -> None:
         client_id = message.client_id
-        address = f"{message.address[0]}:{message.address[1]}"
-        if client_id in self._client_handlers:
+        if client_id in self._client_names:
             logger.error(
                 "Client with such ID already exists and is being processed"
             )
             return
-
-        client_queue: "Queue[Union[np.ndarray, ClientDisconnectedMessage]]" = (
-            Queue(Config.CLIENT_RESULT_WRITER_HANDLER_QUEUE)
-        )
-        handler_thread = threading.Thread(
-            name=f"ResultWriterClientHandler_{address}",
-            target=self._safe_handle_processed_client_data,
-            args=(
-                message,
-                client_queue,
-            ),
-        )
-        handler_thread.start()
-
-        self._client_handlers[client_id] = (
-            client_queue,
-            handler_thread,
-        )
+        self._client_names[client_id] = message.client_name or str(client_id)
+        self._worker_queue(client_id).put(message)
 
     def _disconnect_client(self, message: ClientDisconnectedMessage) -> None:
         client_id = message.client_id
-        if client_id not in self._client_handlers:
+        if self._client_names.pop(client_id, None) is None:
             logger.error("Cannot disconnected not connected client")
             return
-
-        client_queue, _ = self._client_handlers[client_id]
-        # TODO: This is blocking
-        client_queue.put(message)
-
-        # TODO: This naively assumes the thread will exit, no joining? Can leak
-        del self._client_handlers[client_id]
+        # After the client's last frames, in the same queue
+        self._worker_queue(client_id).put(message)
 
     def _process_batch(self, batch: FramesBatchMessage) -> None:
         for item in batch.batch:
             client_id = item.client_id
-            frame = item.frame
-            detections = item.detections
-
-            if detections:
-                # TODO: Draw detections of the frame
-                pass
+            self._frames_in += 1
+            client_name = self._client_names.get(client_id)
+            if client_name is None:
+                logger.error(f"Frame of unknown client {client_id}, dropped")
+                continue
 
+            worker_queue = self._worker_queue(client_id)
             # TODO: Is there a better solution than dropping frames?
-            try:
-                self._client_handlers[client_id][0].put_nowait(frame)
-            except Full:
-                logger.warning("Client handler queue is full, dropping frames")
+            if worker_queue.qsize() >= self._worker_queue_size:
+                logger.warning("Writer worker queue is full, dropping frames")
+                FRAMES_DROPPED.labels(client_name, "writer_queue_full").inc()
                 continue
+            worker_queue.put(item)
+
+    def _safe_work(self, worker_queue: "Queue[_WorkerItem]") -> None:
+        """Serves the clients sharded to this worker until stopped. A failing
+        client doesn't stop the worker, the others are served by it too
+        """
+        outputs: Dict[uuid.UUID, _ClientOutput] = {}
+        while True:
+            item = worker_queue.get()
+            if item is None:
+                break
+            client_id = item.client_id
+            try:
+                if isinstance(item, ProcessFrameMessage):
+                    output = outputs.get(client_id)
+                    if output is not None:
+                        self._write(output, item)
+                elif isinstance(item, NewClientConnectedMessage):
+                    outputs[client_id] = self._open_output(item)
+                elif isinstance(item, ClientDisconnectedMessage):
+                    output = outputs.pop(client_id, None)
+                    if output is not None:
+                        self._close_output(output)
             except Exception as e:
                 logger.error(
-                    f"Error occurred while directing frame to its "
-                    f"handler. Error: {e}"
+                    f"ResultsWriter failed on a message of client "
+                    f"{client_id}. Error: {e}"
                 )
-                continue
 
-    def _safe_handle_processed_client_data(
-        self, client: NewClientConnectedMessage, client_queue: Queue
-    ) -> None:
-        """A wrapper to catch any exceptions happening in a thread to avoid
-        leaking memory
-        """
-        client_id = client.client_id
-        logger.debug(
-            f"ResultsWriter thread handling client {client_id} started"
-        )
-        try:
-            self._handle_processed_client_data(client, client_queue)
-        except Exception as e:
-            logger.error(
-                f"ResultWriter handler processing client {client_id} failed "
-                f"with error: {e}"
-            )
-        logger.debug(
-            f"ResultsWriter thread handling client {client_id} stopped"
-        )
+        for output in outputs.values():
+            try:
+                self._close_output(output)
+            except Exception as e:
+                logger.error(f"Failed to close output of {output.name}: {e}")
 
-    def _handle_processed_client_data(
-        self, client: NewClientConnectedMessage, client_queue: Queue
-    ) -> None:
+    def _open_output(self, client: NewClientConnectedMessage) -> _ClientOutput:
         client_id = client.client_id
         client_address = f"{client.address[0]}:{client.address[1]}"
-        is_visual_mode = self._mode in {
-            ResultWriterMode.SHOW_FRAMES,
-            ResultWriterMode.SHOW_AND_SAVE_FRAMES,
-        }
-        is_disk_mode = self._mode in {
-            ResultWriterMode.SAVE_FRAMES,
-            ResultWriterMode.SHOW_AND_SAVE_FRAMES,
-        }
-        if is_visual_mode:
-            window_name = f"Client - {client_address}"
-            cv2.namedWindow(window_name)
+        name = client.client_name or str(client_id)
+        output = _ClientOutput(
+            name=name, frames_written=FRAMES_WRITTEN.labels(name)
+        )
+        if self._is_visual_mode:
+            output.window_name = f"Client - {client_address}"
+            cv2.namedWindow(output.window_name)
 
-        if is_disk_mode:
-            filename = os.path.join(
-                self._save_folder, f"{client_address}_{client_id}_feed.avi"
+        if self._is_disk_mode:
+            output.saver = self._segment_recorder(
+                f"{client_address}_{client_id}_feed", name
+            )
+        if self._is_record_mode:
+            output.recorder = self._segment_recorder(
+                f"{client_address}_{client_id}", name
             )
-            video_out = cv2.VideoWriter(
-                filename,
-                cv2.VideoWriter_fourcc(*"MJPG"),
-                Config.SAVE_VIDEO_FPS,
-                (Config.SAVE_VIDEO_WIDTH, Config.SAVE_VIDEO_HEIGHT),
+        if self._is_event_mode:
+            output.events = EventRecorder(
+                self._segment_recorder(
+                    f"{client_address}_{client_id}_event", name
+                ),
+                TriggerRule(
+                    **Config.EVENT_TRIGGERS.get(
+                        name, Config.EVENT_DEFAULT_TRIGGER
+                    )
+                ),
+                preroll_seconds=Config.EVENT_PREROLL_SECONDS,
+                postroll_seconds=Config.EVENT_POSTROLL_SECONDS,
+                preroll_max_bytes=Config.EVENT_PREROLL_MAX_BYTES,
+                name=name,
             )
+        logger.debug(f"ResultsWriter started writing client {output.name}")
+        return output
+
+    def _segment_recorder(self, prefix: str, name: str) -> JpegRecorder:
+        return JpegRecorder(
+            os.path.join(self._save_folder, prefix),
+            fps=Config.SAVE_VIDEO_FPS,
+            max_file_size=Config.RECORD_MAX_FILE_SIZE,
+            max_duration=Config.RECORD_SEGMENT_SECONDS,
+            disk_writer=self._disk_writer,
+            index=self._index,
+            client=name,
+        )
 
-        while True:
-            message = client_queue.get()
-            if isinstance(message, ClientDisconnectedMessage):
-                break
+    def _close_output(self, output: _ClientOutput) -> None:
+        if output.window_name is not None:
+            cv2.destroyWindow(output.window_name)
+        if output.saver is not None:
+            output.saver.close()
+        if output.recorder is not None:
+            output.recorder.close()
+        if output.events is not None:
+            output.events.close()
+        if self._detections_store is not None:
+            self._detections_store.close_client(output.name)
+        logger.debug(f"ResultsWriter finished writing client {output.name}")
+
+    def _write(
+        self, output: _ClientOutput, message: ProcessFrameMessage
+    ) -> None:
+        trace = message.trace
+        if trace is not None:
+            trace.mark(TracePoint.WRITER_DEQUEUED)
+
+        frame = message.frame
+        if (
+            self._detections_store is not None
+            and message.detections is not None
+        ):
+            with section("store_detections"):
+                self._detections_store.append(
+                    output.name,
+                    message.timestamp or time.time(),
+                    message.sequence,
+                    message.detections,
+                    (frame.shape[1], frame.shape[0]),
+                )
 
-            if is_visual_mode:
-                cv2.imshow(window_name, message)
+        # Drawing is only paid for when somebody looks at the frames
+        if output.window_name is not None:
+            with section("show"):
+                if message.detections is not None:
+                    draw_detections(
+                        frame, message.detections, self._class_names
+                    )
+                cv2.imshow(output.window_name, frame)
                 cv2.waitKey(1)
 
-            if is_disk_mode:
-                video_out.write(message)
+        if output.saver is not None:
+            with section("save"):
+                # Clients may lower their resolution under load
+                if frame.shape[:2] != (
+                    Config.SAVE_VIDEO_HEIGHT,
+                    Config.SAVE_VIDEO_WIDTH,
+                ):
+                    frame = cv2.resize(
+                        frame,
+                        (Config.SAVE_VIDEO_WIDTH, Config.SAVE_VIDEO_HEIGHT),
+                    )
+                quality = Config.SAVE_VIDEO_JPEG_QUALITY
+                _, jpeg = cv2.imencode(
+                    ".jpg", frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+                )
+                output.saver.write_jpeg(
+                    message, jpeg.tobytes(), frame.shape[1], frame.shape[0]
+                )
+
+        if output.recorder is not None:
+            with section("record"):
+                if not output.recorder.write(message):
+                    logger.warning(
+                        f"Frame of {output.name} has no JPEG to record"
+                    )
 
-        if is_visual_mode:
-            cv2.destroyWindow(window_name)
-        if is_disk_mode:
-            video_out.release()
+        if output.events is not None:
+            with section("record"):
+                self._write_event_frame(output, output.events, message)
 
-    def _draw_detections(self, batch: FramesBatchMessage) -> None:
-        # TODO: Draw bounding boxes etc
-        pass
+        output.frames_written.inc()
+        if trace is not None and self._tracer is not None:
+            trace.mark(TracePoint.WRITTEN)
+            self._tracer.record(output.name, trace)
+
+    def _write_event_frame(
+        self,
+        output: _ClientOutput,
+        events: EventRecorder,
+        message: ProcessFrameMessage,
+    ) -> None:
+        encoded = message.encoded
+        if encoded is not None:
+            jpeg = encoded.payload
+            width, height = encoded.width, encoded.height
+        else:
+            # Decoded frames only, e.g. from a decoder not keeping the JPEGs
+            quality = Config.SAVE_VIDEO_JPEG_QUALITY
+            _, buffer = cv2.imencode(
+                ".jpg", message.frame, [int(cv2.IMWRITE_JPEG_QUALITY), quality]
+            )
+            jpeg = buffer.tobytes()
+            height, width = message.frame.shape[:2]
+        if events.write(message, jpeg, width, height):
+            RECORDED_EVENTS.labels(output.name).inc()
 
     def stop(self) -> None:
         if not self._stop_event.is_set():
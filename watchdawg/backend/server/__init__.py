@@ -1,2 +1,3 @@
-from .interface import BaseServer
+from .interface import BaseServer, FeedbackProvider
 from .tcp_server import TCPServer
+from .async_tcp_server import AsyncTCPServer
@@ -0,0 +1,268 @@
+import asyncio
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional, Set
+import threading
+from queue import Queue, Full
+
+from watchdawg.backend.server.interface import BaseServer, FeedbackProvider
+from watchdawg.backend.messages import (
+    BusMessage,
+    EncodedFrameMessage,
+    ClientDisconnectedMessage,
+    NewClientConnectedMessage,
+)
+from watchdawg.backend.connected_client import ConnectedClient
+from watchdawg.backend.metrics import (
+    BYTES_RECEIVED,
+    FRAMES_DROPPED,
+    FRAMES_RECEIVED,
+)
+from watchdawg.util.logger import get_logger
+from watchdawg.util.communication import create_socket
+from watchdawg.util.frame_protocol import (
+    FRAME_META_SIZE,
+    PREAMBLE_SIZE,
+    MessageType,
+    ProtocolError,
+    pack_feedback,
+    unpack_frame_meta,
+    unpack_hello,
+    unpack_preamble,
+)
+from watchdawg.config import Config
+
+
+logger = get_logger("async_tcp_server")
+
+
+class AsyncTCPServer(BaseServer):
+    """Serves all clients from a single asyncio event loop running in its own
+    thread, so the number of threads doesn't grow with the number of cameras.
+    Sockets are only read on the loop. Messages are published with
+    put_nowait(), frames that don't fit are dropped. Connect and disconnect
+    messages fall back to a (blocking) put on a small executor.
+    """
+
+    def __init__(
+        self,
+        events_queue: Queue,
+        port: int,
+        executor_workers: int = Config.ASYNC_SERVER_EXECUTOR_WORKERS,
+        use_uvloop: bool = Config.ASYNC_SERVER_USE_UVLOOP,
+        feedback_provider: Optional[FeedbackProvider] = None,
+        feedback_interval: float = Config.CLIENT_FEEDBACK_INTERVAL,
+    ) -> None:
+        self._socket = create_socket()
+        self._socket.bind(("", port))
+
+        self._events_queue = events_queue
+        self._feedback_provider = feedback_provider
+        self._feedback_interval = feedback_interval
+        self._use_uvloop = use_uvloop
+        self._executor = ThreadPoolExecutor(
+            max_workers=executor_workers,
+            thread_name_prefix="AsyncTCPServerPublisher",
+        )
+        self._connected_clients: Set[uuid.UUID] = set()
+        self._writers: Set[asyncio.StreamWriter] = set()
+        self._handlers: Set[asyncio.Task] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._stop_event: Optional[asyncio.Event] = None
+        self._started = threading.Event()
+        logger.debug("Async TCP server initialised")
+
+    @property
+    def total_connected_clients(self) -> int:
+        return len(self._connected_clients)
+
+    def start_server(self) -> None:
+        self._loop_thread = threading.Thread(
+            name="AsyncTCPServer", target=self._run_loop, daemon=True
+        )
+        self._loop_thread.start()
+        self._started.wait()
+
+    def _create_loop(self) -> asyncio.AbstractEventLoop:
+        if self._use_uvloop:
+            try:
+                import uvloop
+
+                return uvloop.new_event_loop()
+            except ImportError:
+                logger.warning("uvloop is not installed, using asyncio loop")
+        return asyncio.new_event_loop()
+
+    def _run_loop(self) -> None:
+        loop = self._create_loop()
+        asyncio.set_event_loop(loop)
+        self._loop = loop
+        try:
+            loop.run_until_complete(self._serve())
+        except Exception as e:
+            logger.error(f"Async TCP server event loop failed. Error: {e}")
+        finally:
+            loop.close()
+            self._started.set()
+
+    async def _serve(self) -> None:
+        self._stop_event = asyncio.Event()
+        server = await asyncio.start_server(
+            self._safe_handle_client,
+            sock=self._socket,
+            limit=Config.RECEIVE_BUFFER_SIZE,
+        )
+        logger.info("Async TCP server started")
+        logger.info("Listening for incoming connections...")
+        self._started.set()
+        async with server:
+            await self._stop_event.wait()
+            # Unblocks handlers waiting on reads so they can report the
+            # disconnect and exit
+            for writer in list(self._writers):
+                writer.close()
+            if self._handlers:
+                await asyncio.wait(list(self._handlers), timeout=2.0)
+        logger.debug("Async TCP server stopped accepting connections")
+
+    async def _safe_handle_client(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        """Makes sure a disconnect message is always sent and the connection
+        is closed, even if serving the client fails
+        """
+        address = writer.get_extra_info("peername")
+        logger.info(f"Received connection from {address}")
+        client = ConnectedClient(
+            client_id=uuid.uuid4(),
+            connection=writer.get_extra_info("socket"),
+            connected_at=datetime.now(),
+            address=address,
+        )
+        client_id = client.client_id
+        self._writers.add(writer)
+        handler = asyncio.current_task()
+        if handler is not None:
+            self._handlers.add(handler)
+        try:
+            client.client_name = await self._handshake(reader)
+        except Exception as e:
+            logger.error(
+                f"Failed the handshake with client {client.address}. "
+                f"Error: {e}"
+            )
+            self._writers.discard(writer)
+            self._handlers.discard(handler)  # type: ignore[arg-type]
+            writer.close()
+            return
+
+        await self._publish(
+            NewClientConnectedMessage(
+                client_id, client.address, client.client_name
+            )
+        )
+        self._connected_clients.add(client_id)
+
+        try:
+            await self._serve_client(client, reader, writer)
+        except asyncio.IncompleteReadError:
+            logger.debug(f"Client {client.address} disconnected")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(
+                f"Failed while processing client {client.address}. "
+                f"Error: {e}"
+            )
+
+        await self._publish(
+            ClientDisconnectedMessage(client_id, client.address)
+        )
+        self._connected_clients.discard(client_id)
+        self._writers.discard(writer)
+        self._handlers.discard(handler)  # type: ignore[arg-type]
+        writer.close()
+        logger.debug(f"Finished with client {client.address}")
+
+    @staticmethod
+    async def _handshake(reader: asyncio.StreamReader) -> str:
+        """Reads the client's HELLO and returns its name"""
+        preamble = unpack_preamble(await reader.readexactly(PREAMBLE_SIZE))
+        if preamble.message_type != MessageType.HELLO:
+            raise ProtocolError(
+                f"Expected HELLO, got {preamble.message_type.name}"
+            )
+        return unpack_hello(await reader.readexactly(preamble.body_size))
+
+    async def _serve_client(
+        self,
+        client: ConnectedClient,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+    ) -> None:
+        name = client.client_name or str(client.client_id)
+        frames_received = FRAMES_RECEIVED.labels(name)
+        bytes_received = BYTES_RECEIVED.labels(name)
+        frames_dropped = FRAMES_DROPPED.labels(name, "server_queue_full")
+        next_feedback_at = time.monotonic() + self._feedback_interval
+        stop_event = self._stop_event
+        assert stop_event is not None  # Set before accepting connections
+        while not stop_event.is_set():
+            header = await reader.readexactly(PREAMBLE_SIZE)
+            preamble = unpack_preamble(header)
+            if preamble.message_type != MessageType.FRAME:
+                await reader.readexactly(preamble.body_size)
+                continue
+
+            meta = unpack_frame_meta(await reader.readexactly(FRAME_META_SIZE))
+            payload = await reader.readexactly(
+                preamble.body_size - FRAME_META_SIZE
+            )
+            frames_received.inc()
+            bytes_received.inc(PREAMBLE_SIZE + preamble.body_size)
+            # Never waits on the decoder. An EncodedFramesQueue makes room
+            # itself, dropping the client's older frames
+            try:
+                self._events_queue.put_nowait(
+                    EncodedFrameMessage(
+                        client_id=client.client_id,
+                        payload=payload,
+                        width=meta.width,
+                        height=meta.height,
+                        sequence=meta.sequence,
+                        timestamp=meta.timestamp,
+                        received_at=time.monotonic(),
+                    )
+                )
+            except Full:
+                frames_dropped.inc()
+
+            if (
+                self._feedback_provider
+                and time.monotonic() >= next_feedback_at
+            ):
+                next_feedback_at = time.monotonic() + self._feedback_interval
+                feedback = self._feedback_provider(client.client_id)
+                if feedback is not None:
+                    # Tiny and infrequent, not worth awaiting drain() and
+                    # stalling reads on a client that doesn't read
+                    writer.write(pack_feedback(feedback))
+
+    async def _publish(self, message: BusMessage) -> None:
+        """For connect and disconnect messages, which can't be dropped"""
+        try:
+            self._events_queue.put_nowait(message)
+        except Full:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(
+                self._executor, self._events_queue.put, message
+            )
+
+    def stop_server(self) -> None:
+        if self._loop is not None and self._stop_event is not None:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+            self._loop_thread.join(timeout=2.0)
+        self._executor.shutdown(wait=False)
+        logger.info("AsyncTCPServer stopped")
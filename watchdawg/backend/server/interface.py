@@ -1,4 +1,12 @@
 import abc
+import uuid
+from typing import Callable, Optional
+
+from watchdawg.util.frame_protocol import Feedback
+
+
+# Returns the feedback to send to a client, None if there is nothing to send
+FeedbackProvider = Callable[[uuid.UUID], Optional[Feedback]]
 
 
 class BaseServer(abc.ABC):
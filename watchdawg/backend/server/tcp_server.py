@@ -1,22 +1,36 @@
+import time
 import uuid
-from typing import Set
-import struct
-import pickle
+from typing import Optional, Set
 from datetime import datetime
 import threading
-from queue import Queue
+from queue import Full, Queue
 
-import cv2
-
-from watchdawg.backend.server.interface import BaseServer
+from watchdawg.backend.server.interface import BaseServer, FeedbackProvider
 from watchdawg.backend.messages import (
-    ProcessFrameMessage,
+    EncodedFrameMessage,
     ClientDisconnectedMessage,
     NewClientConnectedMessage,
 )
 from watchdawg.backend.connected_client import ConnectedClient
+from watchdawg.backend.metrics import (
+    BYTES_RECEIVED,
+    FRAMES_DROPPED,
+    FRAMES_RECEIVED,
+)
 from watchdawg.util.logger import get_logger
+from watchdawg.util.profiler import section
 from watchdawg.util.communication import create_socket
+from watchdawg.util.socket_reader import SocketReader
+from watchdawg.util.frame_protocol import (
+    FRAME_META_SIZE,
+    PREAMBLE_SIZE,
+    MessageType,
+    ProtocolError,
+    pack_feedback,
+    unpack_frame_meta,
+    unpack_hello,
+    unpack_preamble,
+)
 from watchdawg.config import Config
 
 
@@ -24,11 +38,19 @@ logger = get_logger("tcp_server")
 
 
 class TCPServer(BaseServer):
-    def __init__(self, events_queue: Queue, port: int) -> None:
+    def __init__(
+        self,
+        events_queue: Queue,
+        port: int,
+        feedback_provider: Optional[FeedbackProvider] = None,
+        feedback_interval: float = Config.CLIENT_FEEDBACK_INTERVAL,
+    ) -> None:
         self._socket = create_socket()
         self._socket.bind(("", port))
 
         self._events_queue = events_queue
+        self._feedback_provider = feedback_provider
+        self._feedback_interval = feedback_interval
         self._connected_clients: Set[uuid.UUID] = set()
         self._lock = threading.Lock()
         self._stop_event = threading.Event()
@@ -81,14 +103,27 @@ class TCPServer(BaseServer):
         logger.debug(
             f"{thread_name} started to handle client {client.address}"
         )
+        reader = SocketReader(client.connection)
+        try:
+            client.client_name = self._handshake(reader)
+        except Exception as e:
+            logger.error(
+                f"{thread_name} failed the handshake with client "
+                f"{client.address}. Error: {e}"
+            )
+            client.connection.close()
+            return
+
         self._events_queue.put(
-            NewClientConnectedMessage(client_id, client.address)
+            NewClientConnectedMessage(
+                client_id, client.address, client.client_name
+            )
         )
         with self._lock:
             self._connected_clients.add(client_id)
 
         try:
-            self._serve_client(client)
+            self._serve_client(client, reader)
         except Exception as e:
             logger.error(
                 f"{thread_name} failed while processing client "
@@ -103,36 +138,77 @@ class TCPServer(BaseServer):
 
         logger.debug(f"{thread_name} finished with client {client.address}")
 
-    def _serve_client(self, client: ConnectedClient) -> None:
-        conn = client.connection
+    @staticmethod
+    def _handshake(reader: SocketReader) -> str:
+        """Reads the client's HELLO and returns its name"""
+        header = reader.read(PREAMBLE_SIZE)
+        if header is None:
+            raise ProtocolError("Connection closed before HELLO")
+        preamble = unpack_preamble(header)
+        if preamble.message_type != MessageType.HELLO:
+            raise ProtocolError(
+                f"Expected HELLO, got {preamble.message_type.name}"
+            )
+        body = reader.read(preamble.body_size)
+        if body is None:
+            raise ProtocolError("Connection closed before HELLO")
+        return unpack_hello(body)
+
+    def _serve_client(
+        self, client: ConnectedClient, reader: SocketReader
+    ) -> None:
         client_id = client.client_id
-        data = b""
-        payload_size = struct.calcsize(Config.STRUCT_SIZE_FORMAT)
+        name = client.client_name or str(client.client_id)
+        frames_received = FRAMES_RECEIVED.labels(name)
+        bytes_received = BYTES_RECEIVED.labels(name)
+        frames_dropped = FRAMES_DROPPED.labels(name, "server_queue_full")
+        next_feedback_at = time.monotonic() + self._feedback_interval
         while not self._stop_event.is_set():
-            while len(data) < payload_size:
-                data += conn.recv(4096)
-                if not data:
-                    logger.debug(f"Client {client.address} disconnected")
-                    return
-
-            packed_message_size = data[:payload_size]
-            data = data[payload_size:]
-            message_size = struct.unpack(
-                Config.STRUCT_SIZE_FORMAT, packed_message_size
-            )[0]
-
-            while len(data) < message_size:
-                data += conn.recv(4096)
-
-            frame_data = data[:message_size]
-            data = data[message_size:]
-            frame = pickle.loads(
-                frame_data, fix_imports=True, encoding="bytes"
-            )
-            frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
-            self._events_queue.put(
-                ProcessFrameMessage(client_id=client_id, frame=frame)
-            )
+            header = reader.read(PREAMBLE_SIZE)
+            if header is None:
+                logger.debug(f"Client {client.address} disconnected")
+                return
+            preamble = unpack_preamble(header)
+
+            # Once the header is in, the rest of the frame is on its way
+            with section("receive"):
+                body = reader.read(preamble.body_size)
+            if body is None:
+                logger.debug(f"Client {client.address} disconnected")
+                return
+
+            if preamble.message_type == MessageType.FRAME:
+                frames_received.inc()
+                bytes_received.inc(PREAMBLE_SIZE + preamble.body_size)
+                meta = unpack_frame_meta(body)
+                # The reader reuses its buffer, the payload must be copied
+                # before it's handed over to the decoder
+                message = EncodedFrameMessage(
+                    client_id=client_id,
+                    payload=bytes(body[FRAME_META_SIZE:]),
+                    width=meta.width,
+                    height=meta.height,
+                    sequence=meta.sequence,
+                    timestamp=meta.timestamp,
+                    received_at=time.monotonic(),
+                )
+                # Never waits on the decoder, reading the socket must go on.
+                # An EncodedFramesQueue makes room itself, dropping the
+                # client's older frames
+                with section("publish"):
+                    try:
+                        self._events_queue.put_nowait(message)
+                    except Full:
+                        frames_dropped.inc()
+
+            if (
+                self._feedback_provider
+                and time.monotonic() >= next_feedback_at
+            ):
+                next_feedback_at = time.monotonic() + self._feedback_interval
+                feedback = self._feedback_provider(client_id)
+                if feedback is not None:
+                    client.connection.sendall(pack_feedback(feedback))
 
     def stop_server(self) -> None:
         self._stop_event.set()
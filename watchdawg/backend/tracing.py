@@ -0,0 +1,189 @@
+import enum
+import math
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+
+class TracePoint(enum.IntEnum):
+    """Moments in a frame's life, in pipeline order"""
+
+    CAPTURED = 0  # On the client, mapped onto the server's clock
+    RECEIVED = 1
+    DECODED = 2
+    ENQUEUED = 3  # Handed to the scheduler
+    BATCHED = 4  # Collected into a batch and preprocessed
+    INFERENCE_STARTED = 5
+    INFERENCE_DONE = 6
+    WRITER_DEQUEUED = 7
+    WRITTEN = 8
+
+
+# Stage: (from, to). Stages follow each other, plus two totals
+TRACE_STAGES: Dict[str, Tuple[TracePoint, TracePoint]] = {
+    "network": (TracePoint.CAPTURED, TracePoint.RECEIVED),
+    "decode": (TracePoint.RECEIVED, TracePoint.DECODED),
+    "publish": (TracePoint.DECODED, TracePoint.ENQUEUED),
+    "queue": (TracePoint.ENQUEUED, TracePoint.BATCHED),
+    "inference_wait": (TracePoint.BATCHED, TracePoint.INFERENCE_STARTED),
+    "inference": (TracePoint.INFERENCE_STARTED, TracePoint.INFERENCE_DONE),
+    "dispatch": (TracePoint.INFERENCE_DONE, TracePoint.WRITER_DEQUEUED),
+    "write": (TracePoint.WRITER_DEQUEUED, TracePoint.WRITTEN),
+    "server": (TracePoint.RECEIVED, TracePoint.WRITTEN),
+    "total": (TracePoint.CAPTURED, TracePoint.WRITTEN),
+}
+
+
+class FrameTrace:
+    """time.monotonic() of every TracePoint a frame has passed, 0 for the
+    ones it hasn't
+    """
+
+    __slots__ = ("times",)
+
+    def __init__(self, captured_at: float, received_at: float) -> None:
+        """captured_at is the client's wall clock time, so capture to
+        receive is only meaningful with synchronised clocks
+        """
+        self.times: List[float] = [0.0] * len(TracePoint)
+        self.times[TracePoint.CAPTURED] = time.monotonic() - (
+            time.time() - captured_at
+        )
+        self.times[TracePoint.RECEIVED] = received_at
+
+    def mark(self, point: TracePoint) -> None:
+        self.times[point] = time.monotonic()
+
+
+def mark_all(traces: List[Optional[FrameTrace]], point: TracePoint) -> None:
+    """Marks a batch of frames with the same time"""
+    now = time.monotonic()
+    for trace in traces:
+        if trace is not None:
+            trace.times[point] = now
+
+
+class LatencyHistogram:
+    """Durations in logarithmic buckets, HDR histogram style: bucket i
+    counts durations up to min_value * growth ** i, so percentiles are
+    exact to within growth - 1 relative error. Recording is one log and one
+    increment in a preallocated list
+    """
+
+    def __init__(
+        self,
+        min_value: float = 1e-5,
+        max_value: float = 100.0,
+        growth: float = 1.05,
+    ) -> None:
+        self._min_value = min_value
+        self._growth = growth
+        self._log_growth = math.log(growth)
+        self._last = math.ceil(
+            math.log(max_value / min_value) / self._log_growth
+        )
+        self._counts = [0] * (self._last + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, value: float) -> None:
+        if value > self._min_value:
+            index = min(
+                int(math.log(value / self._min_value) / self._log_growth) + 1,
+                self._last,
+            )
+        else:
+            index = 0
+        self._counts[index] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: "LatencyHistogram") -> None:
+        """Adds other's counts, it must have the same buckets"""
+        for index, count in enumerate(other._counts):
+            self._counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+    def percentiles(self, qs: Tuple[float, ...]) -> List[float]:
+        """Upper bounds of the buckets holding the q-th percentiles"""
+        targets = [q / 100 * self.count for q in qs]
+        results = [0.0] * len(qs)
+        seen = 0
+        pending = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            while pending < len(targets) and seen >= targets[pending]:
+                bound = self._min_value * self._growth**index
+                results[pending] = min(bound, self.max)
+                pending += 1
+            if pending == len(targets):
+                break
+        return results
+
+    def summary(self) -> Dict[str, float]:
+        if not self.count:
+            return {"count": 0}
+        p50, p95, p99 = self.percentiles((50, 95, 99))
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count * 1e3, 2),
+            "p50_ms": round(p50 * 1e3, 2),
+            "p95_ms": round(p95 * 1e3, 2),
+            "p99_ms": round(p99 * 1e3, 2),
+            "max_ms": round(self.max * 1e3, 2),
+        }
+
+
+class FrameTracer:
+    """Aggregates finished frame traces into a histogram per client and
+    stage (see TRACE_STAGES). Stages a frame skipped, e.g. inference of a
+    frame whose batch failed, aren't recorded
+    """
+
+    def __init__(self) -> None:
+        self._histograms: Dict[str, Dict[str, LatencyHistogram]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, client: str, trace: FrameTrace) -> None:
+        times = trace.times
+        with self._lock:
+            histograms = self._histograms.get(client)
+            if histograms is None:
+                histograms = self._histograms[client] = {
+                    stage: LatencyHistogram() for stage in TRACE_STAGES
+                }
+            for stage, (start, end) in TRACE_STAGES.items():
+                if times[start] and times[end]:
+                    histograms[stage].record(times[end] - times[start])
+
+    def report(self, per_client: bool = True) -> dict:
+        """Summaries per stage over all clients, and per client and stage"""
+        with self._lock:
+            totals = {stage: LatencyHistogram() for stage in TRACE_STAGES}
+            for histograms in self._histograms.values():
+                for stage, histogram in histograms.items():
+                    totals[stage].merge(histogram)
+            report: Dict[str, Any] = {
+                "stages": {
+                    stage: histogram.summary()
+                    for stage, histogram in totals.items()
+                }
+            }
+            if per_client:
+                report["clients"] = {
+                    client: {
+                        stage: histogram.summary()
+                        for stage, histogram in histograms.items()
+                    }
+                    for client, histograms in self._histograms.items()
+                }
+        return report
+
+    def reset(self) -> None:
+        with self._lock:
+            self._histograms.clear()
@@ -0,0 +1,50 @@
+"""Runs a benchmark by name, passing the remaining arguments to it.
+
+    python -m watchdawg.bench list
+    python -m watchdawg.bench e2e --clients 8 --output e2e.json
+"""
+import importlib
+import pkgutil
+import runpy
+import sys
+
+import watchdawg.bench
+
+
+# Helpers, not benchmarks
+_NOT_SUITES = {"common"}
+
+
+def suites() -> list:
+    return sorted(
+        module.name
+        for module in pkgutil.iter_modules(watchdawg.bench.__path__)
+        if module.name not in _NOT_SUITES and not module.name.startswith("_")
+    )
+
+
+def main() -> None:
+    if len(sys.argv) < 2 or sys.argv[1] in ("list", "-h", "--help"):
+        print("python -m watchdawg.bench <suite> [suite arguments]\n")
+        for name in suites():
+            module = importlib.import_module(f"watchdawg.bench.{name}")
+            # First paragraph of the docstring
+            paragraph = (module.__doc__ or "").split("\n\n")[0]
+            summary = " ".join(paragraph.split())
+            if len(summary) > 56:
+                summary = summary[:53] + "..."
+            print(f"  {name:<18} {summary}")
+        return
+
+    name = sys.argv[1]
+    if name not in suites():
+        sys.exit(
+            f"Unknown benchmark {name}, see python -m watchdawg.bench list"
+        )
+    # The suite parses its own arguments
+    sys.argv = [f"python -m watchdawg.bench {name}"] + sys.argv[2:]
+    runpy.run_module(f"watchdawg.bench.{name}", run_name="__main__")
+
+
+if __name__ == "__main__":
+    main()
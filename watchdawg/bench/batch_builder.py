@@ -0,0 +1,126 @@
+"""Time and allocations per batch of model input preprocessing: every frame
+letterboxed, converted and normalised on its own then stacked, against
+BatchBuilder writing into preallocated buffers.
+
+    python -m watchdawg.bench.batch_builder --batch-size 64
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+import numpy as np
+import cv2
+
+from watchdawg.bench.common import percentile, print_table
+from watchdawg.source.synthetic import synthetic_frame
+from watchdawg.backend.batch_builder import BatchBuilder
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument(
+        "--input-size",
+        type=int,
+        nargs=2,
+        default=[384, 640],
+        metavar=("HEIGHT", "WIDTH"),
+    )
+    return parser.parse_args()
+
+
+def per_frame_preprocess(
+    frames: List[np.ndarray], input_size: Tuple[int, int]
+) -> np.ndarray:
+    """What model libraries do for a list of frames: each one is
+    letterboxed, converted and normalised into new arrays, then stacked
+    """
+    height, width = input_size
+    tensors = []
+    for frame in frames:
+        scale = min(height / frame.shape[0], width / frame.shape[1])
+        new_width = round(frame.shape[1] * scale)
+        new_height = round(frame.shape[0] * scale)
+        resized = cv2.resize(frame, (new_width, new_height))
+        top = (height - new_height) // 2
+        left = (width - new_width) // 2
+        padded = cv2.copyMakeBorder(
+            resized,
+            top,
+            height - new_height - top,
+            left,
+            width - new_width - left,
+            cv2.BORDER_CONSTANT,
+            value=(114, 114, 114),
+        )
+        rgb = cv2.cvtColor(padded, cv2.COLOR_BGR2RGB)
+        tensors.append(rgb.transpose(2, 0, 1).astype(np.float32) / 255.0)
+    return np.stack(tensors)
+
+
+def measure(
+    preprocess: Callable[[], object], rounds: int
+) -> Tuple[List[float], float]:
+    """Returns per batch times and the most MB held at once by one batch's
+    temporary allocations
+    """
+    preprocess()  # Warm up, builder buffers are allocated up front
+    times = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        preprocess()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    allocated = []
+    for _ in range(rounds):
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        preprocess()
+        _, peak = tracemalloc.get_traced_memory()
+        allocated.append(peak - current)
+    tracemalloc.stop()
+    return times, max(allocated) / 2**20
+
+
+def main() -> None:
+    args = parse_args()
+    input_size: Tuple[int, int] = (args.input_size[0], args.input_size[1])
+    frames = [
+        synthetic_frame(args.width, args.height, i)
+        for i in range(args.batch_size)
+    ]
+    builder = BatchBuilder(args.batch_size, input_size)
+
+    rows = []
+    for name, preprocess in (
+        ("per-frame", lambda: per_frame_preprocess(frames, input_size)),
+        ("BatchBuilder", lambda: builder.build(frames)),
+    ):
+        times, allocated = measure(preprocess, args.rounds)
+        rows.append(
+            (
+                name,
+                f"{percentile(times, 50) * 1e3:.1f}",
+                f"{percentile(times, 95) * 1e3:.1f}",
+                f"{allocated:.1f}",
+            )
+        )
+
+    print(
+        f"Batch of {args.batch_size} {args.width}x{args.height} frames into "
+        f"{input_size[1]}x{input_size[0]}, builder buffers "
+        f"{builder.nbytes / 2**20:.0f} MB"
+    )
+    print_table(
+        ("method", "p50 ms", "p95 ms", "peak MB allocated/batch"),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+"""Frames per second and glass to server latency of a TCPClient sending
+over a slow link, capturing, encoding and sending on one thread against
+the threaded stages.
+
+The camera is simulated like a V4L2 device: frames are captured at a fixed
+rate into a small ring of driver buffers, new frames are lost while all of
+them are full, and the client reads the oldest one. A client that doesn't
+keep up therefore gets frames that waited in the driver. The receiving end
+reads at a limited bandwidth.
+
+    python -m watchdawg.bench.client_stages --fps 30 --link-mbps 5
+"""
+import argparse
+import collections
+import socket
+import threading
+import time
+from typing import Deque, Dict, Iterator, List, Tuple
+
+import numpy as np
+
+from watchdawg.bench.common import percentile, print_table
+from watchdawg.source.synthetic import synthetic_frame
+from watchdawg.client.preprocessor import Resizer
+from watchdawg.client.tcp_client import TCPClient
+from watchdawg.source import BaseSource
+from watchdawg.util.frame_protocol import (
+    FRAME_META_SIZE,
+    PREAMBLE_SIZE,
+    MessageType,
+    unpack_frame_meta,
+    unpack_preamble,
+)
+from watchdawg.util.socket_reader import SocketReader
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument(
+        "--link-mbps", type=float, default=20.0, help="Link bandwidth"
+    )
+    parser.add_argument(
+        "--camera-buffers", type=int, default=4, help="Driver ring size"
+    )
+    return parser.parse_args()
+
+
+class SimulatedCamera(BaseSource):
+    """Captures into a driver ring on its own thread. The capture time of
+    every frame handed out is kept in order, so the receiver can look it up
+    by sequence number
+    """
+
+    def __init__(self, args: argparse.Namespace) -> None:
+        self._frames = [
+            synthetic_frame(args.width, args.height, i) for i in range(16)
+        ]
+        self._fps = args.fps
+        self._duration = args.duration
+        self._ring: Deque[Tuple[np.ndarray, float]] = collections.deque()
+        self._buffers = args.camera_buffers
+        self._ready = threading.Condition()
+        self._done = False
+        self.glass_times: List[float] = []
+
+    @property
+    def name(self) -> str:
+        return "simulated camera"
+
+    def _capture(self) -> None:
+        interval = 1.0 / self._fps
+        next_frame_at = time.perf_counter()
+        deadline = next_frame_at + self._duration
+        index = 0
+        while next_frame_at < deadline:
+            time.sleep(max(0.0, next_frame_at - time.perf_counter()))
+            with self._ready:
+                if len(self._ring) < self._buffers:
+                    self._ring.append(
+                        (self._frames[index % len(self._frames)], time.time())
+                    )
+                    self._ready.notify()
+            index += 1
+            next_frame_at += interval
+        with self._ready:
+            self._done = True
+            self._ready.notify()
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        threading.Thread(target=self._capture, daemon=True).start()
+        while True:
+            with self._ready:
+                while not self._ring and not self._done:
+                    self._ready.wait()
+                if not self._ring:
+                    return
+                frame, glass_time = self._ring.popleft()
+            self.glass_times.append(glass_time)
+            yield frame
+
+
+def receive(
+    server: socket.socket, link_mbps: float, arrivals: Dict[int, float]
+) -> None:
+    """Reads frames no faster than the link allows and keeps the arrival
+    time of every sequence number
+    """
+    connection, _ = server.accept()
+    reader = SocketReader(connection)
+    bytes_per_second = link_mbps * 1e6 / 8
+    try:
+        while True:
+            header = reader.read(PREAMBLE_SIZE)
+            if header is None:
+                return
+            preamble = unpack_preamble(header)
+            body = reader.read(preamble.body_size)
+            if body is None:
+                return
+            time.sleep(preamble.body_size / bytes_per_second)
+            if preamble.message_type == MessageType.FRAME:
+                meta = unpack_frame_meta(body[:FRAME_META_SIZE])
+                arrivals[meta.sequence] = time.time()
+    finally:
+        connection.close()
+
+
+def run_trial(threaded: bool, args: argparse.Namespace) -> tuple:
+    server = socket.socket()
+    # Small buffers, or the kernel queues seconds of frames on loopback
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 64 * 1024)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    arrivals: Dict[int, float] = {}
+    receiver = threading.Thread(
+        target=receive, args=(server, args.link_mbps, arrivals), daemon=True
+    )
+    receiver.start()
+
+    camera = SimulatedCamera(args)
+    client = TCPClient(
+        "bench",
+        video_source=camera,
+        frame_preprocessor=Resizer(640, 384),
+        server_host="127.0.0.1",
+        server_port=server.getsockname()[1],
+        adaptive_quality=False,
+        threaded=threaded,
+        socket_send_buffer=64 * 1024,
+    )
+    client.start_client()
+    time.sleep(1.0)
+    client.stop()
+    receiver.join(timeout=5.0)
+    server.close()
+
+    latencies = [
+        arrived - camera.glass_times[sequence]
+        for sequence, arrived in arrivals.items()
+    ]
+    stages = client.stage_report()
+    return (
+        "threaded" if threaded else "sequential",
+        f"{len(arrivals) / args.duration:.1f}",
+        f"{percentile(latencies, 50) * 1e3:.0f}",
+        f"{percentile(latencies, 95) * 1e3:.0f}",
+        ", ".join(
+            f"{name} {stats['fps']} fps/{stats['drop_rate']:.0%} dropped"
+            for name, stats in stages.items()
+        ),
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    rows = [run_trial(threaded, args) for threaded in (False, True)]
+    print(
+        f"{args.width}x{args.height} camera at {args.fps} fps, resized to "
+        f"640x384, {args.link_mbps} Mbit/s link"
+    )
+    print_table(("client", "received fps", "p50 ms", "p95 ms", "stages"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+import socket
+import time
+from typing import List, Sequence, Union
+
+import numpy as np
+import cv2
+
+from watchdawg.backend.messages import Detections
+from watchdawg.backend.model import MLModel
+
+
+class SleepingModel(MLModel):
+    """A model with a fixed throughput that doesn't use the CPU, like one
+    running on an accelerator
+    """
+
+    def __init__(self, frames_per_second: float) -> None:
+        self._frame_time = 1.0 / frames_per_second
+
+    def __call__(self, batch: List[np.ndarray]) -> List[Detections]:
+        time.sleep(self._frame_time * len(batch))
+        return [Detections.empty() for _ in batch]
+
+
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def encode_jpeg(frame: np.ndarray, quality: int) -> np.ndarray:
+    _, encoded = cv2.imencode(
+        ".jpg", frame, params=[int(cv2.IMWRITE_JPEG_QUALITY), quality]
+    )
+    return encoded
+
+
+def percentile(values: Union[Sequence[float], np.ndarray], q: float) -> float:
+    if not len(values):
+        return float("nan")
+    return float(np.percentile(np.asarray(values), q))
+
+
+def print_table(header: Sequence[str], rows: Sequence[Sequence]) -> None:
+    rows = [[str(cell) for cell in row] for row in rows]
+    widths = [
+        max([len(str(column))] + [len(row[i]) for row in rows])
+        for i, column in enumerate(header)
+    ]
+    print("  ".join(str(c).ljust(w) for c, w in zip(header, widths)))
+    for row in rows:
+        print("  ".join(c.ljust(w) for c, w in zip(row, widths)))
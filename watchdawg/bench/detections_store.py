@@ -0,0 +1,200 @@
+"""DetectionsStore ingest rate and query latency. Synthetic detections of
+several cameras over weeks are appended, per frame like the ResultsWriter
+does and in bulk, then hour long windows are queried with and without a
+class filter, against filtering every record of the client.
+
+    python -m watchdawg.bench detections_store --rows 20000000 --clients 4
+"""
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from watchdawg.bench.common import percentile, print_table
+from watchdawg.backend.detections_store import (
+    RECORD_DTYPE,
+    DetectionsStore,
+)
+from watchdawg.backend.messages import Detections
+from watchdawg.config import Config
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=20_000_000)
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--days", type=float, default=28.0)
+    parser.add_argument(
+        "--frame-rows",
+        type=int,
+        default=200_000,
+        help="Rows appended frame by frame, the rest in bulk",
+    )
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument(
+        "--buffer-rows",
+        type=int,
+        default=Config.DETECTIONS_STORE_BUFFER_ROWS,
+        help="Records buffered per client between writes",
+    )
+    return parser.parse_args()
+
+
+def synthetic_records(
+    rng: np.random.Generator, rows: int, start: float, duration: float
+) -> np.ndarray:
+    """Roughly three detections per frame, timestamps increasing"""
+    records = np.zeros(rows, dtype=RECORD_DTYPE)
+    records["timestamp"] = start + np.sort(rng.random(rows)) * duration
+    records["sequence"] = np.arange(rows) // 3
+    records["class_id"] = rng.integers(0, 80, rows)
+    records["score"] = rng.random(rows)
+    corners = rng.random((rows, 2), dtype=np.float32) * 0.8
+    records["box"][:, :2] = corners
+    records["box"][:, 2:] = corners + 0.2
+    return records
+
+
+def bench_frame_appends(store: DetectionsStore, rows: int) -> float:
+    """Rows per second through append(), three detections a frame"""
+    boxes = np.array(
+        [[10, 20, 110, 220], [300, 40, 380, 200], [500, 300, 600, 350]],
+        dtype=np.float32,
+    )
+    detections = Detections(
+        boxes=boxes,
+        class_ids=np.array([0, 2, 0], dtype=np.int32),
+        scores=np.array([0.9, 0.6, 0.4], dtype=np.float32),
+    )
+    frames = rows // len(detections)
+    start = time.perf_counter()
+    for sequence in range(frames):
+        store.append(
+            "frames", 1e9 + sequence * 0.1, sequence, detections, (640, 360)
+        )
+    store.flush()
+    return frames * len(detections) / (time.perf_counter() - start)
+
+
+def full_scan(
+    store_root: str, client: str, start: float, end: float, class_id: int
+) -> np.ndarray:
+    """What a query costs without the zone maps"""
+    parts = []
+    folder = os.path.join(store_root, client)
+    for name in sorted(os.listdir(folder)):
+        if name.endswith(".det"):
+            records = np.memmap(
+                os.path.join(folder, name), dtype=RECORD_DTYPE, mode="r"
+            )
+            mask = (
+                (records["timestamp"] >= start)
+                & (records["timestamp"] < end)
+                & (records["class_id"] == class_id)
+            )
+            parts.append(np.array(records[mask]))
+    return np.concatenate(parts)
+
+
+def timed(function, repeats: int) -> tuple:
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        times.append((time.perf_counter() - start) * 1e3)
+    return percentile(times, 50), len(result)
+
+
+def main() -> None:
+    args = parse_args()
+    rng = np.random.default_rng(0)
+    duration = args.days * 86400
+    epoch = 1.7e9
+    with tempfile.TemporaryDirectory() as root:
+        store = DetectionsStore(root, buffer_rows=args.buffer_rows)
+        frame_rate = bench_frame_appends(store, args.frame_rows)
+
+        per_client = args.rows // args.clients
+        generated = 0.0
+        start = time.perf_counter()
+        for client in range(args.clients):
+            # Generated in chunks, to not time a 20M rows allocation
+            for chunk in range(0, per_client, 1_000_000):
+                rows = min(1_000_000, per_client - chunk)
+                generate_start = time.perf_counter()
+                records = synthetic_records(
+                    rng,
+                    rows,
+                    epoch + duration * chunk / per_client,
+                    duration * rows / per_client,
+                )
+                generated += time.perf_counter() - generate_start
+                store.append_records(f"camera_{client}", records)
+        store.close()
+        bulk_rate = (
+            per_client
+            * args.clients
+            / (time.perf_counter() - start - generated)
+        )
+        size = sum(
+            os.path.getsize(os.path.join(folder, name))
+            for folder, _, names in os.walk(root)
+            for name in names
+        )
+        print(
+            f"Ingest: {frame_rate:,.0f} rows/s frame by frame, "
+            f"{bulk_rate:,.0f} rows/s in bulk, "
+            f"{size / (per_client * args.clients + args.frame_rows):.1f} "
+            f"bytes/row on disk"
+        )
+
+        store = DetectionsStore(root)
+        rows = []
+        for query_index in range(args.queries):
+            hour_start = epoch + rng.random() * (duration - 3600)
+            hour_end = hour_start + 3600
+            name = f"camera_{query_index % args.clients}"
+            latency, returned = timed(
+                lambda: store.query(name, hour_start, hour_end), 3
+            )
+            filtered_latency, filtered = timed(
+                lambda: store.query(name, hour_start, hour_end, class_ids=[0]),
+                3,
+            )
+            scan_latency, scanned = timed(
+                lambda: full_scan(root, name, hour_start, hour_end, 0), 1
+            )
+            assert scanned == filtered
+            rows.append((latency, returned, filtered_latency, scan_latency))
+
+        latencies = np.array(rows)
+        print(
+            f"{args.queries} one hour queries over {per_client:,} rows per "
+            f"client, p50 of the queries' medians:"
+        )
+        print_table(
+            ("query", "ms", "rows returned"),
+            [
+                (
+                    "hour",
+                    f"{np.median(latencies[:, 0]):.2f}",
+                    f"{np.median(latencies[:, 1]):.0f}",
+                ),
+                (
+                    "hour, class 0",
+                    f"{np.median(latencies[:, 2]):.2f}",
+                    "",
+                ),
+                (
+                    "hour, class 0, full scan",
+                    f"{np.median(latencies[:, 3]):.2f}",
+                    "",
+                ),
+            ],
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""End to end benchmark: the whole server (App) in this process, N
+TCPClients in another one sending synthetic or recorded frames at a target
+rate. Reports sustained throughput, latency percentiles, per stage
+timings, queue depths, drops, CPU and RSS, as JSON to track regressions.
+
+Needs no camera or GPU: the default model returns no detections, "sleep"
+emulates a model with a fixed throughput on an accelerator, and "config"
+loads the model Config describes.
+
+    python -m watchdawg.bench e2e --clients 4 --fps 15 --duration 30 \
+        --output e2e.json
+"""
+import argparse
+import datetime
+import json
+import multiprocessing as mp
+import os
+import platform
+import threading
+import time
+from typing import List, Optional
+
+import psutil
+
+from watchdawg.bench.common import SleepingModel, find_free_port
+from watchdawg.backend.app import App
+from watchdawg.backend.model import MLModel, PlaceHolderModel
+from watchdawg.backend.results_writer import ResultWriterMode
+from watchdawg.client.preprocessor import Resizer
+from watchdawg.client.tcp_client import TCPClient
+from watchdawg.config import Config
+from watchdawg.source import BaseSource, SyntheticSource, VideoFileSource
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(prog="python -m watchdawg.bench e2e")
+    parser.add_argument("--clients", type=int, default=4)
+    parser.add_argument("--fps", type=float, default=15.0)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument(
+        "--warmup", type=float, default=3.0, help="Seconds not measured"
+    )
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument(
+        "--source",
+        default="synthetic",
+        help='"synthetic" or a recorded video file, looped',
+    )
+    parser.add_argument(
+        "--model",
+        choices=["placeholder", "sleep", "config"],
+        default="placeholder",
+    )
+    parser.add_argument(
+        "--model-fps",
+        type=float,
+        default=50.0,
+        help='Throughput of the "sleep" model',
+    )
+    parser.add_argument(
+        "--server",
+        choices=["threaded", "asyncio"],
+        default=Config.SERVER_IMPLEMENTATION,
+    )
+    parser.add_argument(
+        "--output", default=None, help="JSON file, printed if not given"
+    )
+    return parser.parse_args(argv)
+
+
+def create_source(args: dict) -> BaseSource:
+    # Both run until the clients are stopped
+    if args["source"] == "synthetic":
+        return SyntheticSource(args["width"], args["height"], args["fps"])
+    return VideoFileSource(args["source"], realtime=True, loop=True)
+
+
+def connect_client(
+    name: str, port: int, args: dict, timeout: float = 10.0
+) -> TCPClient:
+    """Retries until the server listens, it starts in another process"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            return TCPClient(
+                name,
+                video_source=create_source(args),
+                frame_preprocessor=Resizer(
+                    Config.MODEL_INPUT_WIDTH, Config.MODEL_INPUT_HEIGHT
+                ),
+                server_host="127.0.0.1",
+                server_port=port,
+            )
+        except ConnectionRefusedError:
+            if time.monotonic() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def run_clients(
+    port: int,
+    args: dict,
+    stop: "mp.synchronize.Event",
+    results: "mp.Queue[dict]",
+) -> None:
+    """Runs the clients, one thread each, until stop is set and reports
+    their stages
+    """
+    clients = [
+        connect_client(f"bench_{i}", port, args)
+        for i in range(args["clients"])
+    ]
+    threads = [
+        threading.Thread(target=client.start_client, daemon=True)
+        for client in clients
+    ]
+    for thread in threads:
+        thread.start()
+    stop.wait()
+    reports = {client.name: client.stage_report() for client in clients}
+    for client in clients:
+        client.stop()
+    for thread in threads:
+        thread.join(timeout=5.0)
+    results.put(reports)
+
+
+def create_model(args: argparse.Namespace) -> Optional[MLModel]:
+    if args.model == "placeholder":
+        return PlaceHolderModel()
+    elif args.model == "sleep":
+        return SleepingModel(args.model_fps)
+    return None  # App loads it from Config
+
+
+def run(args: argparse.Namespace) -> dict:
+    port = find_free_port()
+    app = App(
+        mode=ResultWriterMode.DISCARD_FRAMES,
+        model=create_model(args),
+        port=port,
+        server_implementation=args.server,
+        metrics_port=0,  # Reads the stages directly
+    )
+    process = psutil.Process()
+    app.start()
+
+    stop_clients = mp.Event()
+    client_results: "mp.Queue[dict]" = mp.Queue()
+    generator = mp.Process(
+        target=run_clients,
+        args=(port, vars(args), stop_clients, client_results),
+    )
+    started = time.monotonic()
+    generator.start()
+
+    # Sampled over the measured window only
+    time.sleep(args.warmup)
+    app.reset_traces()
+    process.cpu_percent()
+    cpu_times = process.cpu_times()
+    frames_at_start = app.report()["writer"]["frames_in"]
+    window_start = time.monotonic()
+    samples = []
+    while time.monotonic() - started < args.duration:
+        time.sleep(0.5)
+        report = app.report()
+        samples.append(
+            {
+                "rss_mb": report["rss_mb"],
+                "cpu_percent": process.cpu_percent(),
+                **report["queues"],
+            }
+        )
+    window = time.monotonic() - window_start
+    # Before the clients disconnect, the scheduler forgets them after that
+    loaded = app.report()
+    frames_in_window = loaded["writer"]["frames_in"] - frames_at_start
+    cpu_used = sum(process.cpu_times()[:2]) - sum(cpu_times[:2])
+
+    stop_clients.set()
+    clients = client_results.get(timeout=30.0)
+    generator.join()
+    time.sleep(1.0)  # Frames still in flight
+    final = app.report()
+    app.stop()
+
+    def _peak(key: str) -> float:
+        return max((sample[key] for sample in samples), default=0.0)
+
+    return {
+        "suite": "e2e",
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "host": {
+            "platform": platform.platform(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+        },
+        "config": {**vars(args), "batch_size": Config.MODEL_BATCH_SIZE},
+        "throughput": {
+            "offered_fps": args.clients * args.fps,
+            "processed_fps": round(frames_in_window / window, 1),
+            "frames_processed": final["writer"]["frames_in"],
+        },
+        # Per stage from capture to written, over all clients and per client
+        "latency_ms": loaded["traces"],
+        "stages": {
+            "decode": {
+                key: round(value, 2)
+                for key, value in loaded["decoder"].items()
+                if key.startswith("decode_ms")
+            },
+            **loaded["processor_stages"],
+        },
+        "batching": loaded["batching"],
+        "queues_peak": {name: _peak(name) for name in loaded["queues"]},
+        "drops": {
+            "decode_failed": final["decoder"]["frames_failed"],
+            "scheduler": {
+                name: {
+                    "received": stats["received"],
+                    "dropped_overflow": stats["dropped_overflow"],
+                    "dropped_fps_cap": stats["dropped_fps_cap"],
+                }
+                for name, stats in loaded["clients"].items()
+            },
+        },
+        "clients": clients,
+        "resources": {
+            "cpu_percent_mean": round(cpu_used / window * 100, 1),
+            "cpu_percent_peak": _peak("cpu_percent"),
+            "rss_mb_peak": round(_peak("rss_mb"), 1),
+        },
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = parse_args(argv)
+    result = run(args)
+    text = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
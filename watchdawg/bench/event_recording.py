@@ -0,0 +1,151 @@
+"""Disk writes of event recording against recording every frame, on a
+mostly quiet camera. An hour of a client at 10 fps is replayed as fast as
+possible on simulated capture times, with detections matching the rule in
+a few short bursts. Reports frames and bytes written, the events, the CPU
+time per frame and how much the resident memory grew, with the pre-roll
+buffer.
+
+    python -m watchdawg.bench event_recording --hours 1 --events 6
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+import numpy as np
+import psutil
+
+from watchdawg.bench.common import encode_jpeg, print_table
+from watchdawg.backend.event_recording import EventRecorder, TriggerRule
+from watchdawg.backend.messages import Detections, ProcessFrameMessage
+from watchdawg.backend.recording import JpegRecorder
+from watchdawg.source.synthetic import synthetic_frame
+from watchdawg.util.disk_writer import DiskWriter, FsyncPolicy
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=1.0)
+    parser.add_argument("--fps", type=float, default=10.0)
+    parser.add_argument("--events", type=int, default=6)
+    parser.add_argument(
+        "--event-seconds", type=float, default=5.0, help="Of matching frames"
+    )
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--preroll", type=float, default=5.0)
+    parser.add_argument("--postroll", type=float, default=10.0)
+    return parser.parse_args()
+
+
+def folder_size(folder: str) -> int:
+    return sum(
+        os.path.getsize(os.path.join(folder, name))
+        for name in os.listdir(folder)
+    )
+
+
+def run_trial(events: bool, args: argparse.Namespace) -> tuple:
+    frames = [
+        synthetic_frame(args.width, args.height, index) for index in range(8)
+    ]
+    jpegs = [encode_jpeg(frame, 80).tobytes() for frame in frames]
+    person = Detections(
+        boxes=np.array([[100, 50, 180, 300]], dtype=np.float32),
+        class_ids=np.array([0], dtype=np.int32),
+        scores=np.array([0.8], dtype=np.float32),
+    )
+    empty = Detections.empty()
+    total_frames = int(args.hours * 3600 * args.fps)
+    rng = np.random.default_rng(0)
+    event_frames = int(args.event_seconds * args.fps)
+    event_starts = set(
+        rng.choice(total_frames - event_frames, args.events, replace=False)
+    )
+    client_id = uuid.uuid4()
+
+    with tempfile.TemporaryDirectory() as folder:
+        disk_writer = DiskWriter(fsync_policy=FsyncPolicy.NEVER)
+        disk_writer.start()
+        recorder = JpegRecorder(
+            os.path.join(folder, "client"),
+            max_duration=600,
+            disk_writer=disk_writer,
+        )
+        event_recorder = (
+            EventRecorder(
+                recorder,
+                TriggerRule(class_ids=[0], min_score=0.5),
+                preroll_seconds=args.preroll,
+                postroll_seconds=args.postroll,
+            )
+            if events
+            else None
+        )
+        process = psutil.Process()
+        rss_before = process.memory_info().rss
+        matching_until = -1
+        epoch = 1.7e9
+        cpu_start = time.process_time()
+        for index in range(total_frames):
+            if index in event_starts:
+                matching_until = index + event_frames
+            message = ProcessFrameMessage(
+                client_id=client_id,
+                frame=frames[index % len(frames)],
+                detections=person if index < matching_until else empty,
+                sequence=index,
+                timestamp=epoch + index / args.fps,
+            )
+            jpeg = jpegs[index % len(jpegs)]
+            if event_recorder is not None:
+                event_recorder.write(message, jpeg, args.width, args.height)
+            else:
+                recorder.write_jpeg(message, jpeg, args.width, args.height)
+        rss_growth = (process.memory_info().rss - rss_before) / 2**20
+        if event_recorder is not None:
+            event_recorder.close()
+        else:
+            recorder.close()
+        cpu = time.process_time() - cpu_start
+        disk_writer.stop()
+        disk_writer.join()
+        written = folder_size(folder)
+
+    return (
+        "events" if events else "every frame",
+        total_frames,
+        event_recorder.frames_recorded if event_recorder else total_frames,
+        event_recorder.events if event_recorder else "",
+        f"{written / 2**20:.1f}",
+        f"{cpu / total_frames * 1e6:.0f}",
+        f"{rss_growth:.0f}",
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    rows = [run_trial(False, args), run_trial(True, args)]
+    print(
+        f"{args.hours} h at {args.fps} fps, {args.width}x{args.height}, "
+        f"{args.events} bursts of {args.event_seconds}s matching, pre-roll "
+        f"{args.preroll}s, post-roll {args.postroll}s"
+    )
+    print_table(
+        (
+            "recording",
+            "frames",
+            "recorded",
+            "events",
+            "written MB",
+            "CPU us/frame",
+            "RSS growth MB",
+        ),
+        rows,
+    )
+    print(f"Disk writes cut {float(rows[0][4]) / float(rows[1][4]):.0f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Simulated overload: local clients send more frames than a slow model can
+take. Compares clients ignoring the server ("none"), following only its
+target rate ("rate") and also adapting quality and resolution
+("adaptive"). Reports how stale frames are by the time their results are
+ready.
+
+    python -m watchdawg.bench.feedback_loop --clients 2 --fps 30 \
+        --model-fps 20 --duration 30
+"""
+import argparse
+import collections
+import threading
+import time
+from queue import Empty, Queue
+from typing import Dict, List, Tuple
+
+from watchdawg.bench.common import (
+    SleepingModel,
+    find_free_port,
+    percentile,
+    print_table,
+)
+from watchdawg.source.synthetic import SyntheticSource
+from watchdawg.backend.app import create_server
+from watchdawg.backend.feed_processor import FeedProcessor
+from watchdawg.backend.frame_decoder import FrameDecoder
+from watchdawg.backend.frame_scheduler import FairFrameScheduler
+from watchdawg.backend.messages import (
+    FramesBatchMessage,
+    NewClientConnectedMessage,
+)
+from watchdawg.client.tcp_client import TCPClient
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=2)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument(
+        "--model-fps", type=float, default=20.0, help="Model throughput"
+    )
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--feedback-interval", type=float, default=1.0)
+    parser.add_argument(
+        "--server", choices=["threaded", "asyncio"], default="asyncio"
+    )
+    return parser.parse_args()
+
+
+# Mode: (server sends feedback, client adapts quality)
+_MODES: Dict[str, Tuple[bool, bool]] = {
+    "none": (False, False),
+    "rate": (True, False),
+    "adaptive": (True, True),
+}
+
+
+def run_trial(mode: str, args: argparse.Namespace) -> List[tuple]:
+    feedback, adaptive = _MODES[mode]
+    port = find_free_port()
+    encoded_frames: Queue = Queue()
+    scheduler = FairFrameScheduler(client_queue_size=30)
+    results: Queue = Queue()
+    server = create_server(
+        args.server,
+        events_queue=encoded_frames,
+        port=port,
+        feedback_provider=scheduler.feedback if feedback else None,
+        feedback_interval=args.feedback_interval,
+    )
+    decoder = FrameDecoder(encoded_frames, scheduler, workers=2)
+    processor = FeedProcessor(
+        events_queue_in=scheduler,
+        batch_size=8,
+        build_batch_time_window=0.05,
+        events_queue_out=results,
+        model=SleepingModel(args.model_fps),
+        pipeline_depth=1,
+    )
+    decoder.start()
+    processor.start()
+    server.start_server()
+
+    # Capture to result latency per client, measured when the processor
+    # hands the batch over
+    latencies: Dict[str, List[float]] = collections.defaultdict(list)
+    names: Dict[object, str] = {}
+    done = threading.Event()
+
+    def _consume() -> None:
+        while not done.is_set():
+            try:
+                message = results.get(timeout=0.1)
+            except Empty:
+                continue
+            if isinstance(message, NewClientConnectedMessage):
+                names[message.client_id] = message.client_name or ""
+            elif isinstance(message, FramesBatchMessage):
+                now = time.time()
+                for frame_message in message.batch:
+                    latencies[names[frame_message.client_id]].append(
+                        now - frame_message.timestamp
+                    )
+
+    consumer = threading.Thread(target=_consume, daemon=True)
+    consumer.start()
+
+    clients = [
+        TCPClient(
+            f"client_{i}",
+            video_source=SyntheticSource(
+                args.width, args.height, args.fps, args.duration
+            ),
+            server_host="127.0.0.1",
+            server_port=port,
+            adaptive_quality=adaptive,
+        )
+        for i in range(args.clients)
+    ]
+    threads = [
+        threading.Thread(target=client.start_client, daemon=True)
+        for client in clients
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Before disconnecting, the scheduler forgets clients once they leave
+    report = scheduler.report()
+    for client in clients:
+        client.stop()
+
+    time.sleep(1.0)
+    done.set()
+    consumer.join()
+    server.stop_server()
+    decoder.stop()
+    processor.stop()
+    decoder.join()
+    processor.join()
+
+    rows: List[tuple] = []
+    for client in clients:
+        client_latencies = latencies[client.name]
+        # The second half shows where the control loop settled
+        settled = client_latencies[len(client_latencies) // 2 :]
+        stats = report.get(client.name, {})
+        rows.append(
+            (
+                mode,
+                client.name,
+                len(client_latencies),
+                f"{percentile(settled, 50):.2f}",
+                f"{percentile(settled, 95):.2f}",
+                f"{max(client_latencies, default=float('nan')):.2f}",
+                stats.get("dropped_overflow", "-"),
+                f"{client.settings.jpeg_quality}/{client.settings.scale}",
+                f"{client.settings.max_fps:.1f}",
+            )
+        )
+    return rows
+
+
+def main() -> None:
+    args = parse_args()
+    rows = []
+    for mode in _MODES:
+        rows.extend(run_trial(mode, args))
+    print(
+        f"{args.clients} clients at {args.fps} fps, model takes "
+        f"{args.model_fps} frames/s"
+    )
+    print_table(
+        (
+            "mode",
+            "client",
+            "processed",
+            "settled p50 s",
+            "settled p95 s",
+            "max s",
+            "dropped",
+            "final quality/scale",
+            "final max fps",
+        ),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""Inference throughput with the model in-thread against MultiProcessModel
+with 1..N worker processes.
+
+    python -m watchdawg.bench.inference_workers --backend ultralytics \
+        --weights yolov8n.pt --workers 4
+"""
+import argparse
+import functools
+import time
+from typing import Callable, List
+
+import numpy as np
+import cv2
+
+from watchdawg.bench.common import print_table
+from watchdawg.source.synthetic import synthetic_frame
+from watchdawg.backend.messages import Detections
+from watchdawg.backend.model import MLModel, load_model
+from watchdawg.backend.inference_pool import MultiProcessModel
+
+
+class SyntheticCPUModel(MLModel):
+    """Stands in for a real model without torch: a fixed amount of CPU work
+    per frame, partly under the GIL
+    """
+
+    def __init__(self, work: int = 4) -> None:
+        self._work = work
+
+    def __call__(self, batch: List[np.ndarray]) -> List[Detections]:
+        for frame in batch:
+            for _ in range(self._work):
+                blurred = cv2.GaussianBlur(frame, (9, 9), 0)
+                np.sort(blurred[::4, ::4].ravel())
+        return [Detections.empty() for _ in batch]
+
+
+def _create_model(backend: str, weights: str) -> MLModel:
+    if backend == "synthetic":
+        return SyntheticCPUModel()
+    return load_model(backend, weights)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--backend",
+        choices=[
+            "synthetic",
+            "placeholder",
+            "ultralytics",
+            "onnxruntime",
+            "openvino",
+        ],
+        default="synthetic",
+    )
+    parser.add_argument("--weights", default="yolov8n.pt")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    return parser.parse_args()
+
+
+def measure(model: Callable, batch: List[np.ndarray], rounds: int) -> float:
+    """Returns images/s"""
+    model(batch)  # Warm up
+    start = time.perf_counter()
+    for _ in range(rounds):
+        model(batch)
+    return rounds * len(batch) / (time.perf_counter() - start)
+
+
+def main() -> None:
+    args = parse_args()
+    batch = [
+        synthetic_frame(args.width, args.height, i)
+        for i in range(args.batch_size)
+    ]
+    model_factory = functools.partial(
+        _create_model, args.backend, args.weights
+    )
+
+    rows = []
+    baseline = measure(model_factory(), batch, args.rounds)
+    rows.append(("in-thread", f"{baseline:.1f}", "1.00"))
+    for workers in range(1, args.workers + 1):
+        model = MultiProcessModel(
+            model_factory,
+            workers=workers,
+            frame_size=(args.width, args.height),
+            slots_per_worker=args.batch_size,
+        )
+        try:
+            throughput = measure(model, batch, args.rounds)
+        finally:
+            model.close()
+        rows.append(
+            (
+                f"{workers} worker(s)",
+                f"{throughput:.1f}",
+                f"{throughput / baseline:.2f}",
+            )
+        )
+
+    print(f"Backend {args.backend}, batch {args.batch_size}")
+    print_table(("mode", "images/s", "speedup"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Images/s and batch latency of model backends on the same batches.
+
+    python -m watchdawg.bench.model_backends --pt yolov8n.pt \
+        --onnx yolov8n.onnx --batch-sizes 1 8 32 64
+"""
+import argparse
+import time
+from typing import List, Tuple
+
+from watchdawg.bench.common import percentile, print_table
+from watchdawg.source.synthetic import synthetic_frame
+from watchdawg.backend.model import MLModel, load_model
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pt", help="Ultralytics weights, e.g. yolov8n.pt")
+    parser.add_argument("--onnx", help="ONNX export of the same model")
+    parser.add_argument(
+        "--openvino",
+        action="store_true",
+        help="Also run the ONNX model through OpenVINO",
+    )
+    parser.add_argument(
+        "--batch-sizes", type=int, nargs="+", default=[1, 8, 32, 64]
+    )
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    return parser.parse_args()
+
+
+def measure(
+    model: MLModel, batch_size: int, rounds: int, size: Tuple[int, int]
+) -> Tuple[float, List[float]]:
+    """Returns images/s and per batch latencies"""
+    batch = [synthetic_frame(size[0], size[1], i) for i in range(batch_size)]
+    model(batch)  # Warm up
+    latencies = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        model(batch)
+        latencies.append(time.perf_counter() - start)
+    return batch_size * rounds / sum(latencies), latencies
+
+
+def main() -> None:
+    args = parse_args()
+    backends = []
+    if args.pt:
+        backends.append(("ultralytics", args.pt))
+    if args.onnx:
+        backends.append(("onnxruntime", args.onnx))
+        if args.openvino:
+            backends.append(("openvino", args.onnx))
+    if not backends:
+        raise SystemExit("Pass --pt and/or --onnx")
+
+    rows = []
+    for backend, weights in backends:
+        try:
+            model = load_model(backend, weights)
+        except Exception as e:
+            print(f"Skipping {backend}: {e}")
+            continue
+        for batch_size in args.batch_sizes:
+            throughput, latencies = measure(
+                model, batch_size, args.rounds, (args.width, args.height)
+            )
+            rows.append(
+                (
+                    backend,
+                    batch_size,
+                    f"{throughput:.1f}",
+                    f"{percentile(latencies, 50) * 1e3:.1f}",
+                    f"{percentile(latencies, 95) * 1e3:.1f}",
+                )
+            )
+        model.close()
+
+    print_table(
+        ("backend", "batch", "images/s", "p50 ms/batch", "p95 ms/batch"),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Cost per frame and share of frames MotionGate suppresses on a synthetic
+static scene with sensor noise, where an object crosses the frame for a
+given fraction of the time.
+
+    python -m watchdawg.bench.motion_gate --frames 3000 --fps 30
+"""
+import argparse
+import time
+from unittest import mock
+
+import numpy as np
+import cv2
+
+from watchdawg.bench.common import print_table
+from watchdawg.source.synthetic import synthetic_frame
+from watchdawg.client.preprocessor import MotionGate
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=3000)
+    parser.add_argument("--fps", type=float, default=30.0)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument(
+        "--activity",
+        type=float,
+        nargs="+",
+        default=[0.0, 0.1, 0.3, 1.0],
+        help="Fractions of time with an object moving",
+    )
+    return parser.parse_args()
+
+
+def scene(
+    background: np.ndarray,
+    noise: np.ndarray,
+    index: int,
+    fps: float,
+    activity: float,
+) -> np.ndarray:
+    """The background with sensor noise, plus a dark object crossing it in
+    bursts of 2 seconds that add up to `activity` of the time
+    """
+    frame = cv2.add(background, noise[index % len(noise)])
+    period = int(2 * fps / activity) if activity else 0
+    if period and index % period < 2 * fps:
+        height, width = frame.shape[:2]
+        x = int((index % period) / (2 * fps) * (width - 100))
+        cv2.rectangle(
+            frame,
+            (x, height // 3),
+            (x + 100, height // 3 + 150),
+            (20, 20, 20),
+            -1,
+        )
+    return frame
+
+
+def main() -> None:
+    args = parse_args()
+    background = synthetic_frame(args.width, args.height)
+    rng = np.random.default_rng(0)
+    noise = rng.integers(0, 6, size=(16, *background.shape), dtype=np.uint8)
+    rows = []
+    for activity in args.activity:
+        gate = MotionGate()
+        clock = [0.0]
+        spent = 0.0
+        # Frames are fed as fast as possible, the gate sees camera time
+        with mock.patch(
+            "watchdawg.client.preprocessor.motion_gate.time.monotonic",
+            lambda: clock[0],
+        ):
+            for i in range(args.frames):
+                clock[0] = i / args.fps
+                frame = scene(background, noise, i, args.fps, activity)
+                start = time.perf_counter()
+                gate(frame)
+                spent += time.perf_counter() - start
+        rows.append(
+            (
+                f"{activity:.0%}",
+                f"{spent / args.frames * 1e6:.0f}",
+                f"{gate.suppressed_fraction:.1%}",
+            )
+        )
+
+    print(f"{args.width}x{args.height} at {args.fps} fps")
+    print_table(("activity", "us/frame", "suppressed"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""Time and allocations per frame of the client preprocessing: the chain
+run_client.py uses (resize to the model input, mirror) written the plain
+way, allocating new frames at every step, against PreprocessorPipeline
+with fused stages writing into reused buffers.
+
+    python -m watchdawg.bench.preprocessing --width 1280 --height 720 \
+        --cv-threads 1
+"""
+import argparse
+import time
+import tracemalloc
+from typing import Callable, List, Tuple
+
+import numpy as np
+import cv2
+
+from watchdawg.bench.common import percentile, print_table
+from watchdawg.source.synthetic import synthetic_frame
+from watchdawg.client.preprocessor import (
+    ColorConvert,
+    Crop,
+    Flip,
+    PreprocessorPipeline,
+    Resizer,
+)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument(
+        "--output-size",
+        type=int,
+        nargs=2,
+        default=[384, 640],
+        metavar=("HEIGHT", "WIDTH"),
+    )
+    parser.add_argument("--frames", type=int, default=300)
+    parser.add_argument(
+        "--cv-threads",
+        type=int,
+        default=1,
+        help="OpenCV threads, 1 is closest to a small single board client",
+    )
+    return parser.parse_args()
+
+
+def measure(
+    preprocess: Callable[[np.ndarray], object],
+    frames: List[np.ndarray],
+) -> Tuple[List[float], float]:
+    """Returns per frame times and the most KB allocated for one frame"""
+    for frame in frames[:10]:
+        preprocess(frame)  # Warm up, buffers are allocated on first use
+    times = []
+    for frame in frames:
+        start = time.perf_counter()
+        preprocess(frame)
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    allocated = []
+    for frame in frames[:50]:
+        tracemalloc.reset_peak()
+        current, _ = tracemalloc.get_traced_memory()
+        preprocess(frame)
+        _, peak = tracemalloc.get_traced_memory()
+        allocated.append(peak - current)
+    tracemalloc.stop()
+    return times, max(allocated) / 2**10
+
+
+def main() -> None:
+    args = parse_args()
+    cv2.setNumThreads(args.cv_threads)
+    height, width = args.output_size
+    frames = [
+        synthetic_frame(args.width, args.height, i) for i in range(16)
+    ] * (args.frames // 16 + 1)
+    frames = frames[: args.frames]
+
+    def plain(frame: np.ndarray) -> np.ndarray:
+        frame = cv2.resize(
+            frame, (width, height), interpolation=cv2.INTER_AREA
+        )
+        return cv2.flip(frame, 1)
+
+    def plain_gray(frame: np.ndarray) -> np.ndarray:
+        frame = frame[: frame.shape[0] // 2]
+        frame = cv2.resize(
+            frame, (width, height // 2), interpolation=cv2.INTER_AREA
+        )
+        frame = cv2.flip(frame, 1)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+
+    pipelines = {
+        "pipeline, area": PreprocessorPipeline(
+            [Resizer(width, height, interpolation=cv2.INTER_AREA), Flip(1)]
+        ),
+        "pipeline": PreprocessorPipeline([Resizer(width, height), Flip(1)]),
+        "pipeline, crop+gray": PreprocessorPipeline(
+            [
+                Crop((0.0, 0.0, 1.0, 0.5)),
+                Resizer(width, height // 2),
+                Flip(1),
+                ColorConvert(cv2.COLOR_BGR2GRAY),
+            ]
+        ),
+    }
+
+    preprocessors: List[Tuple[str, Callable[[np.ndarray], object]]] = [
+        ("plain", plain),
+        ("plain, crop+gray", plain_gray),
+        *pipelines.items(),
+    ]
+    rows = []
+    for name, preprocess in preprocessors:
+        times, allocated = measure(preprocess, frames)
+        rows.append(
+            (
+                name,
+                f"{percentile(times, 50) * 1e3:.2f}",
+                f"{percentile(times, 95) * 1e3:.2f}",
+                f"{allocated:.1f}",
+            )
+        )
+
+    print(
+        f"{args.width}x{args.height} frames into {width}x{height}, "
+        f"{args.cv_threads} OpenCV thread(s)"
+    )
+    print_table(("chain", "p50 ms", "p95 ms", "peak KB allocated"), rows)
+    for name, pipeline in pipelines.items():
+        print(f"\n{name} stages:")
+        print_table(
+            ("stage", "frames", "mean ms", "dropped"),
+            [
+                (stage, *stats.values())
+                for stage, stats in pipeline.report().items()
+            ],
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+"""Cost of recording on the thread handling frames: segmented recorders
+writing through a DiskWriter, with each fsync policy, against the same
+recorders writing on the calling thread and against a cv2.VideoWriter per
+client (what the writer did before segments). Frames of N clients are
+recorded at a paced rate, the JPEGs are encoded up front so only the
+writes are timed. Reports per frame latency on the calling thread, the
+frames it kept up with and how long it waited on the disk.
+
+    python -m watchdawg.bench recording_io --clients 8 --fps 10
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+from typing import List, Optional
+
+import cv2
+import numpy as np
+
+from watchdawg.bench.common import encode_jpeg, percentile, print_table
+from watchdawg.backend.messages import ProcessFrameMessage
+from watchdawg.backend.recording import JpegRecorder, RecordingIndex
+from watchdawg.source.synthetic import synthetic_frame
+from watchdawg.util.disk_writer import DiskWriter, FsyncPolicy
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--fps", type=float, default=10.0, help="Per client")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--width", type=int, default=1280)
+    parser.add_argument("--height", type=int, default=720)
+    parser.add_argument("--quality", type=int, default=80)
+    parser.add_argument(
+        "--segment-seconds",
+        type=float,
+        default=1.0,
+        help="Short to include many segment rotations",
+    )
+    return parser.parse_args()
+
+
+def run_trial(
+    name: str,
+    args: argparse.Namespace,
+    frames: List[np.ndarray],
+    jpegs: List[bytes],
+    fsync_policy: Optional[FsyncPolicy],
+    video_writer: bool = False,
+) -> tuple:
+    with tempfile.TemporaryDirectory() as folder:
+        disk_writer = (
+            DiskWriter(fsync_policy=fsync_policy)
+            if fsync_policy is not None
+            else None
+        )
+        if disk_writer is not None:
+            disk_writer.start()
+        index = RecordingIndex(folder)
+        outputs = []
+        for client in range(args.clients):
+            prefix = os.path.join(folder, f"client_{client}")
+            if video_writer:
+                outputs.append(
+                    cv2.VideoWriter(
+                        f"{prefix}_feed.avi",
+                        cv2.VideoWriter_fourcc(*"MJPG"),
+                        10,
+                        (args.width, args.height),
+                    )
+                )
+            else:
+                outputs.append(
+                    JpegRecorder(
+                        prefix,
+                        max_duration=args.segment_seconds,
+                        disk_writer=disk_writer,
+                        index=index,
+                        client=str(client),
+                    )
+                )
+        client_id = uuid.uuid4()
+
+        latencies = []
+        written = 0
+        interval = 1.0 / (args.fps * args.clients)
+        start = time.perf_counter()
+        while time.perf_counter() - start < args.duration:
+            client = written % args.clients
+            message = ProcessFrameMessage(
+                client_id=client_id,
+                frame=frames[written % len(frames)],
+                sequence=written,
+                timestamp=time.time(),
+            )
+            jpeg = jpegs[written % len(jpegs)]
+            frame_start = time.perf_counter()
+            output = outputs[client]
+            if video_writer:
+                # Encodes too, the other trials get their JPEG for free
+                output.write(message.frame)
+            else:
+                output.write_jpeg(message, jpeg, args.width, args.height)
+            latencies.append(time.perf_counter() - frame_start)
+            written += 1
+            delay = start + written * interval - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        for output in outputs:
+            if video_writer:
+                output.release()
+            else:
+                output.close()
+        stall = 0.0
+        if disk_writer is not None:
+            stall = disk_writer.report()["stall_seconds"]
+            disk_writer.stop()
+            disk_writer.join()
+        elapsed = time.perf_counter() - start
+        latencies_ms = np.array(latencies) * 1e3
+    return (
+        name,
+        written,
+        f"{written / elapsed:.0f}",
+        f"{percentile(latencies_ms, 50):.3f}",
+        f"{percentile(latencies_ms, 99):.3f}",
+        f"{latencies_ms.max():.1f}",
+        f"{stall:.2f}",
+        len(index.segments()),
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    frames = [
+        synthetic_frame(args.width, args.height, index) for index in range(8)
+    ]
+    jpegs = [encode_jpeg(frame, args.quality).tobytes() for frame in frames]
+    trials = [
+        ("cv2.VideoWriter", None, True),
+        ("segments, calling thread", None, False),
+        ("segments, DiskWriter, fsync never", FsyncPolicy.NEVER, False),
+        ("segments, DiskWriter, fsync close", FsyncPolicy.ON_CLOSE, False),
+        (
+            "segments, DiskWriter, fsync interval",
+            FsyncPolicy.INTERVAL,
+            False,
+        ),
+    ]
+    rows = [
+        run_trial(name, args, frames, jpegs, policy, video_writer)
+        for name, policy, video_writer in trials
+    ]
+    print(
+        f"{args.clients} clients at {args.fps} fps, {args.width}x"
+        f"{args.height} JPEGs of "
+        f"~{np.mean([len(jpeg) for jpeg in jpegs]) / 1024:.0f} KB, "
+        f"{args.segment_seconds}s segments"
+    )
+    print_table(
+        (
+            "writer",
+            "frames",
+            "fps",
+            "p50 ms",
+            "p99 ms",
+            "max ms",
+            "stalled s",
+            "segments",
+        ),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Loopback throughput of a single connection: the old `data += recv(4096)`
+receive loop against SocketReader (recv_into a preallocated buffer).
+
+    python -m watchdawg.bench.recv_buffer --frames 2000
+"""
+import argparse
+import socket
+import threading
+import time
+from typing import Callable, List, Tuple
+
+from watchdawg.bench.common import encode_jpeg, print_table
+from watchdawg.source.synthetic import synthetic_frame
+from watchdawg.util.communication import send_buffers
+from watchdawg.util.frame_protocol import (
+    PREAMBLE_SIZE,
+    Codec,
+    FrameMeta,
+    pack_frame_header,
+    unpack_preamble,
+)
+from watchdawg.util.socket_reader import SocketReader
+
+
+_RESOLUTIONS = {"640x360": (640, 360), "1080p": (1920, 1080)}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=1000)
+    parser.add_argument("--quality", type=int, default=95)
+    return parser.parse_args()
+
+
+def legacy_receive(conn: socket.socket) -> int:
+    """The receive loop TCPServer used before SocketReader"""
+    frames = 0
+    data = b""
+    while True:
+        while len(data) < PREAMBLE_SIZE:
+            chunk = conn.recv(4096)
+            if not chunk:
+                return frames
+            data += chunk
+        preamble = unpack_preamble(data[:PREAMBLE_SIZE])
+        data = data[PREAMBLE_SIZE:]
+        while len(data) < preamble.body_size:
+            data += conn.recv(4096)
+        _ = data[: preamble.body_size]
+        data = data[preamble.body_size :]
+        frames += 1
+
+
+def buffered_receive(conn: socket.socket) -> int:
+    frames = 0
+    reader = SocketReader(conn)
+    while True:
+        header = reader.read(PREAMBLE_SIZE)
+        if header is None:
+            return frames
+        preamble = unpack_preamble(header)
+        if reader.read(preamble.body_size) is None:
+            return frames
+        frames += 1
+
+
+def run_loopback(
+    messages: List[Tuple[bytes, memoryview]],
+    total_frames: int,
+    receive: Callable[[socket.socket], int],
+) -> Tuple[int, int, float]:
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+
+    def _send() -> None:
+        client = socket.create_connection(server.getsockname())
+        for i in range(total_frames):
+            send_buffers(client, messages[i % len(messages)])
+        client.shutdown(socket.SHUT_WR)
+        client.close()
+
+    sender = threading.Thread(target=_send, daemon=True)
+    sender.start()
+    conn, _ = server.accept()
+    start = time.perf_counter()
+    frames = receive(conn)
+    elapsed = time.perf_counter() - start
+    sender.join()
+    conn.close()
+    server.close()
+
+    total_bytes = sum(
+        len(messages[i % len(messages)][0])
+        + len(messages[i % len(messages)][1])
+        for i in range(frames)
+    )
+    return frames, total_bytes, elapsed
+
+
+def main() -> None:
+    args = parse_args()
+    rows = []
+    for resolution, (width, height) in _RESOLUTIONS.items():
+        messages = []
+        for i in range(16):
+            encoded = encode_jpeg(
+                synthetic_frame(width, height, i), args.quality
+            )
+            payload = encoded.data.cast("B")
+            meta = FrameMeta(Codec.JPEG, width, height, i, time.time())
+            messages.append((pack_frame_header(meta, len(payload)), payload))
+
+        for name, receive in (
+            ("recv(4096) + bytes concat", legacy_receive),
+            ("SocketReader recv_into", buffered_receive),
+        ):
+            frames, total_bytes, elapsed = run_loopback(
+                messages, args.frames, receive
+            )
+            rows.append(
+                (
+                    resolution,
+                    name,
+                    frames,
+                    f"{frames / elapsed:.1f}",
+                    f"{total_bytes / elapsed / 1e6:.1f}",
+                )
+            )
+
+    print_table(("resolution", "receiver", "frames", "frames/s", "MB/s"), rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Replays N synthetic clients against the threaded and the asyncio server
+and reports accept latency, sustained frames/s, RSS and thread count.
+
+Each server runs in its own process so RSS numbers don't leak between
+trials, and the clients run in yet another process on a single event loop
+so they don't inflate the server's thread count or memory.
+
+    python -m watchdawg.bench.server_stress --clients 200 --fps 10
+"""
+import argparse
+import asyncio
+import multiprocessing as mp
+import threading
+import time
+import uuid
+from queue import Empty, Queue
+from typing import Dict, List, Tuple
+
+import psutil
+
+from watchdawg.bench.common import (
+    encode_jpeg,
+    find_free_port,
+    percentile,
+    print_table,
+)
+from watchdawg.source.synthetic import synthetic_frame
+from watchdawg.backend.messages import (
+    EncodedFrameMessage,
+    NewClientConnectedMessage,
+)
+from watchdawg.backend.server import AsyncTCPServer, BaseServer, TCPServer
+from watchdawg.util.frame_protocol import (
+    Codec,
+    FrameMeta,
+    pack_frame_header,
+    pack_hello,
+)
+
+
+_SERVERS = {"threaded": TCPServer, "asyncio": AsyncTCPServer}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--server", choices=[*_SERVERS, "both"], default="both"
+    )
+    parser.add_argument("--clients", type=int, default=100)
+    parser.add_argument("--fps", type=float, default=10.0)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--quality", type=int, default=80)
+    return parser.parse_args()
+
+
+async def _replay_client(
+    port: int,
+    payloads: List[bytes],
+    width: int,
+    height: int,
+    fps: float,
+    duration: float,
+) -> None:
+    connect_started = time.time()
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(pack_hello(f"replay_{id(writer)}"))
+    interval = 1.0 / fps
+    deadline = time.perf_counter() + duration
+    next_send = time.perf_counter()
+    sequence = 0
+    try:
+        while time.perf_counter() < deadline:
+            payload = payloads[sequence % len(payloads)]
+            # The first frame carries the time connect() was called, which
+            # lets the server side measure accept latency
+            timestamp = connect_started if sequence == 0 else time.time()
+            meta = FrameMeta(Codec.JPEG, width, height, sequence, timestamp)
+            writer.write(pack_frame_header(meta, len(payload)))
+            writer.write(payload)
+            await writer.drain()
+            sequence += 1
+            next_send += interval
+            await asyncio.sleep(max(0.0, next_send - time.perf_counter()))
+    except ConnectionError:
+        pass
+    writer.close()
+
+
+def run_load_generator(
+    port: int, clients: int, fps: float, duration: float, args: dict
+) -> None:
+    payloads = [
+        encode_jpeg(
+            synthetic_frame(args["width"], args["height"], i),
+            args["quality"],
+        ).tobytes()
+        for i in range(16)
+    ]
+
+    async def _run() -> None:
+        await asyncio.gather(
+            *(
+                _replay_client(
+                    port,
+                    payloads,
+                    args["width"],
+                    args["height"],
+                    fps,
+                    duration,
+                )
+                for _ in range(clients)
+            )
+        )
+
+    asyncio.run(_run())
+
+
+def run_trial(server_name: str, args: argparse.Namespace) -> dict:
+    process = psutil.Process()
+    baseline_rss = process.memory_info().rss
+    events_queue: Queue = Queue()
+    port = find_free_port()
+    server: BaseServer = _SERVERS[server_name](events_queue, port)
+    server.start_server()
+
+    connected_at: Dict[uuid.UUID, float] = {}
+    accept_latencies: List[float] = []
+    frame_times: List[float] = []
+    samples: List[Tuple[int, int]] = []
+    done = threading.Event()
+
+    def _consume() -> None:
+        while not done.is_set():
+            try:
+                message = events_queue.get(timeout=0.1)
+            except Empty:
+                continue
+            now = time.time()
+            if isinstance(message, NewClientConnectedMessage):
+                connected_at[message.client_id] = now
+            elif isinstance(message, EncodedFrameMessage):
+                frame_times.append(now)
+                if message.sequence == 0:
+                    accept_latencies.append(
+                        connected_at[message.client_id] - message.timestamp
+                    )
+
+    def _sample() -> None:
+        while not done.is_set():
+            samples.append((process.memory_info().rss, process.num_threads()))
+            time.sleep(0.5)
+
+    consumer = threading.Thread(target=_consume, daemon=True)
+    sampler = threading.Thread(target=_sample, daemon=True)
+    consumer.start()
+    sampler.start()
+
+    generator = mp.Process(
+        target=run_load_generator,
+        args=(port, args.clients, args.fps, args.duration, vars(args)),
+    )
+    generator.start()
+    generator.join()
+    time.sleep(1.0)
+    done.set()
+    consumer.join()
+    sampler.join()
+    server.stop_server()
+
+    # Skip the connection burst at the start and the tail when the
+    # generator shuts down
+    window_start = frame_times[0] + 0.2 * args.duration if frame_times else 0
+    window_end = frame_times[-1] - 0.1 * args.duration if frame_times else 0
+    in_window = [t for t in frame_times if window_start <= t <= window_end]
+    window = max(window_end - window_start, 1e-9)
+    return {
+        "server": server_name,
+        "clients": args.clients,
+        "accepted": len(accept_latencies),
+        "accept_p50_ms": percentile(accept_latencies, 50) * 1e3,
+        "accept_p99_ms": percentile(accept_latencies, 99) * 1e3,
+        "offered_fps": args.clients * args.fps,
+        "frames_per_s": len(in_window) / window,
+        "peak_rss_mb": (max(s[0] for s in samples) - baseline_rss) / 2**20,
+        "peak_threads": max(s[1] for s in samples),
+    }
+
+
+def _run_trial_in_process(
+    server_name: str, args: argparse.Namespace, results: "mp.Queue[dict]"
+) -> None:
+    results.put(run_trial(server_name, args))
+
+
+def main() -> None:
+    args = parse_args()
+    servers = list(_SERVERS) if args.server == "both" else [args.server]
+    rows = []
+    for server_name in servers:
+        results: "mp.Queue[dict]" = mp.Queue()
+        trial = mp.Process(
+            target=_run_trial_in_process, args=(server_name, args, results)
+        )
+        trial.start()
+        result = results.get()
+        trial.join()
+        rows.append(
+            (
+                result["server"],
+                f"{result['accepted']}/{result['clients']}",
+                f"{result['accept_p50_ms']:.1f}",
+                f"{result['accept_p99_ms']:.1f}",
+                f"{result['offered_fps']:.0f}",
+                f"{result['frames_per_s']:.1f}",
+                f"{result['peak_rss_mb']:.1f}",
+                result["peak_threads"],
+            )
+        )
+
+    print_table(
+        (
+            "server",
+            "accepted",
+            "accept p50 ms",
+            "accept p99 ms",
+            "offered fps",
+            "frames/s",
+            "peak RSS MB (+)",
+            "peak threads",
+        ),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""Compares the legacy pickle-based wire format with the binary frame
+protocol: bytes on the wire and server CPU time per frame.
+
+    python -m watchdawg.bench.wire_format --width 1920 --height 1080
+"""
+import argparse
+import pickle
+import struct
+import time
+from typing import Callable, List
+
+import numpy as np
+import cv2
+
+from watchdawg.bench.common import encode_jpeg, print_table
+from watchdawg.source.synthetic import synthetic_frame
+from watchdawg.util.frame_protocol import (
+    FRAME_META_SIZE,
+    PREAMBLE_SIZE,
+    Codec,
+    FrameMeta,
+    pack_frame_header,
+    unpack_frame_meta,
+    unpack_preamble,
+)
+
+
+_LEGACY_SIZE_FORMAT = ">L"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=360)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--quality", type=int, default=95)
+    return parser.parse_args()
+
+
+def legacy_encode(encoded: np.ndarray) -> bytes:
+    data = pickle.dumps(encoded, 0)
+    return struct.pack(_LEGACY_SIZE_FORMAT, len(data)) + data
+
+
+def legacy_parse(message: bytes) -> np.ndarray:
+    size_length = struct.calcsize(_LEGACY_SIZE_FORMAT)
+    size = struct.unpack(_LEGACY_SIZE_FORMAT, message[:size_length])[0]
+    return pickle.loads(
+        message[size_length : size_length + size],
+        fix_imports=True,
+        encoding="bytes",
+    )
+
+
+def binary_encode(encoded: np.ndarray, index: int, shape: tuple) -> bytes:
+    payload = encoded.data.cast("B")
+    meta = FrameMeta(Codec.JPEG, shape[1], shape[0], index, time.time())
+    # On the real path header and payload go to sendmsg() separately,
+    # joined here only to get something to parse
+    return pack_frame_header(meta, len(payload)) + payload.tobytes()
+
+
+def binary_parse(message: bytes) -> np.ndarray:
+    view = memoryview(message)
+    preamble = unpack_preamble(view)
+    body = view[PREAMBLE_SIZE : PREAMBLE_SIZE + preamble.body_size]
+    unpack_frame_meta(body)
+    return np.frombuffer(body[FRAME_META_SIZE:], dtype=np.uint8)
+
+
+def measure_cpu(messages: List[bytes], parse: Callable, decode: bool) -> float:
+    """Returns server CPU seconds per frame"""
+    start = time.process_time()
+    for message in messages:
+        payload = parse(message)
+        if decode:
+            cv2.imdecode(payload, cv2.IMREAD_COLOR)
+    return (time.process_time() - start) / len(messages)
+
+
+def main() -> None:
+    args = parse_args()
+    encoded_frames = []
+    for i in range(args.frames):
+        frame = synthetic_frame(args.width, args.height, i)
+        encoded_frames.append(encode_jpeg(frame, args.quality))
+    shape = (args.height, args.width)
+
+    legacy = [legacy_encode(encoded) for encoded in encoded_frames]
+    binary = [
+        binary_encode(encoded, i, shape)
+        for i, encoded in enumerate(encoded_frames)
+    ]
+    jpeg_bytes = np.mean([encoded.size for encoded in encoded_frames])
+
+    rows = []
+    for name, messages, parse in (
+        ("pickle (protocol 0)", legacy, legacy_parse),
+        ("binary v1", binary, binary_parse),
+    ):
+        wire_bytes = np.mean([len(message) for message in messages])
+        parse_cpu = measure_cpu(messages, parse, decode=False)
+        total_cpu = measure_cpu(messages, parse, decode=True)
+        rows.append(
+            (
+                name,
+                f"{wire_bytes:.0f}",
+                f"{wire_bytes / jpeg_bytes:.3f}",
+                f"{parse_cpu * 1e6:.1f}",
+                f"{total_cpu * 1e6:.1f}",
+            )
+        )
+
+    print(
+        f"{args.frames} frames {args.width}x{args.height}, "
+        f"JPEG quality {args.quality}, mean JPEG size {jpeg_bytes:.0f} B"
+    )
+    print_table(
+        (
+            "format",
+            "bytes/frame",
+            "overhead x",
+            "parse CPU us/frame",
+            "parse+decode CPU us/frame",
+        ),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""ResultsWriter scaling with the number of cameras: a fixed worker pool
+against one worker per client (what one thread per client costs). Batches
+of frames from N simulated clients are fed straight into the writer, which
+saves them as video. Reports threads, CPU, RSS, frames written and drops.
+
+    python -m watchdawg.bench writer_pool --clients 10 50 100 200 --fps 2
+"""
+import argparse
+import tempfile
+import threading
+import time
+import uuid
+from queue import Queue
+from typing import List
+
+import psutil
+
+from watchdawg.bench.common import print_table
+from watchdawg.backend.messages import (
+    ClientDisconnectedMessage,
+    FramesBatchMessage,
+    NewClientConnectedMessage,
+    ProcessFrameMessage,
+)
+from watchdawg.backend.metrics import FRAMES_DROPPED, FRAMES_WRITTEN
+from watchdawg.backend.results_writer import ResultsWriter, ResultWriterMode
+from watchdawg.config import Config
+from watchdawg.source.synthetic import synthetic_frame
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--clients", type=int, nargs="+", default=[10, 50, 100, 200]
+    )
+    parser.add_argument("--fps", type=float, default=2.0, help="Per client")
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=8)
+    return parser.parse_args()
+
+
+def run_trial(clients: int, workers: int, args: argparse.Namespace) -> tuple:
+    process = psutil.Process()
+    queue: Queue = Queue(Config.PROCESSED_BATCHES_QUEUE_SIZE)
+    with tempfile.TemporaryDirectory() as folder:
+        writer = ResultsWriter(
+            queue,
+            ResultWriterMode.SAVE_FRAMES,
+            folder,
+            workers=workers,
+        )
+        writer.start()
+        # Unique per trial, the metrics outlive the writer
+        names = [f"w{workers}_c{clients}_{i}" for i in range(clients)]
+        ids = [uuid.uuid4() for _ in range(clients)]
+        for i, (client_id, name) in enumerate(zip(ids, names)):
+            queue.put(
+                NewClientConnectedMessage(client_id, ("10.0.0.1", i), name)
+            )
+        frame = synthetic_frame(
+            Config.SAVE_VIDEO_WIDTH, Config.SAVE_VIDEO_HEIGHT
+        )
+
+        process.cpu_percent()
+        start = time.monotonic()
+        interval = 1.0 / (args.fps * clients)
+        threads_peak = 0
+        sent = 0
+        batch: List[ProcessFrameMessage] = []
+        while time.monotonic() - start < args.duration:
+            client_id = ids[sent % clients]
+            batch.append(
+                ProcessFrameMessage(
+                    client_id=client_id, frame=frame, sequence=sent
+                )
+            )
+            sent += 1
+            if len(batch) == args.batch_size:
+                queue.put(FramesBatchMessage(batch))
+                batch = []
+                threads_peak = max(threads_peak, threading.active_count())
+            # Paced on the average rate over the whole trial
+            delay = start + sent * interval - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        elapsed = time.monotonic() - start
+        cpu = process.cpu_percent()
+        rss = process.memory_info().rss / 2**20
+
+        for client_id in ids:
+            queue.put(ClientDisconnectedMessage(client_id, ("", 0)))
+        # Give the workers the time to catch up before stopping them
+        while not queue.empty() or any(writer.report_worker_queue_sizes()):
+            time.sleep(0.1)
+        writer.stop()
+        writer.join()
+
+    written = sum(FRAMES_WRITTEN.labels(name).value for name in names)
+    dropped = sum(
+        FRAMES_DROPPED.labels(name, "writer_queue_full").value
+        for name in names
+    )
+    return (
+        clients,
+        workers,
+        threads_peak,
+        f"{sent / elapsed:.0f}",
+        int(written),
+        int(dropped),
+        f"{cpu:.0f}",
+        f"{rss:.0f}",
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    rows = []
+    for clients in args.clients:
+        for workers in sorted({args.workers, clients}):
+            rows.append(run_trial(clients, workers, args))
+    print(
+        f"{Config.SAVE_VIDEO_WIDTH}x{Config.SAVE_VIDEO_HEIGHT} frames at "
+        f"{args.fps} fps per client, saved as MJPG"
+    )
+    print_table(
+        (
+            "clients",
+            "workers",
+            "threads",
+            "offered fps",
+            "written",
+            "dropped",
+            "CPU %",
+            "RSS MB",
+        ),
+        rows,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,14 @@
 import abc
-from typing import Optional
+from typing import Optional, Sequence, Union
 
 import numpy as np
 import cv2
 
 from watchdawg.source import BaseSource
-from watchdawg.client.preprocessor import BaseFramePreprocessor
+from watchdawg.client.preprocessor import (
+    BaseFramePreprocessor,
+    PreprocessorPipeline,
+)
 
 
 class BaseClient(abc.ABC):
@@ -13,14 +16,28 @@ class BaseClient(abc.ABC):
         self,
         name: str,
         video_source: BaseSource,
-        preprocessor: Optional[BaseFramePreprocessor] = None,
+        preprocessor: Union[
+            BaseFramePreprocessor, Sequence[BaseFramePreprocessor], None
+        ] = None,
         every_nth_frame: int = 0,
     ) -> None:
         self._name = name
         self._video_source = video_source
-        self._preprocessor = preprocessor
+        if preprocessor is None:
+            preprocessor = []
+        elif isinstance(preprocessor, PreprocessorPipeline):
+            preprocessor = preprocessor.stages
+        elif isinstance(preprocessor, BaseFramePreprocessor):
+            preprocessor = [preprocessor]
+        self._preprocessor = PreprocessorPipeline(preprocessor)
         self._every_nth_frame = every_nth_frame
 
+    def _preprocess(self, frame: np.ndarray) -> Optional[np.ndarray]:
+        """Runs the preprocessors in order, None if one of them dropped the
+        frame
+        """
+        return self._preprocessor(frame)
+
     @staticmethod
     def show_frame(frame: np.ndarray, window_name: str = "") -> None:
         cv2.imshow(window_name, frame)
@@ -1,2 +1,8 @@
 from .interface import BaseFramePreprocessor
+from .buffers import FrameBuffers
 from .resizer import Resizer
+from .flip import Flip
+from .crop import Crop
+from .color_convert import ColorConvert
+from .motion_gate import MotionGate
+from .pipeline import PreprocessorPipeline
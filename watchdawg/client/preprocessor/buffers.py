@@ -0,0 +1,40 @@
+from typing import List, Tuple
+
+import numpy as np
+
+
+class FrameBuffers:
+    """A ring of output frames a preprocessor writes into instead of
+    allocating a new frame per call.
+
+    A frame returned earlier stays intact while up to count - 1 newer ones
+    are handed out, so count has to cover every frame still in use further
+    down the line. Buffers are reallocated only when the requested shape
+    changes
+    """
+
+    def __init__(self, count: int = 1) -> None:
+        if count < 1:
+            raise ValueError(f"Need at least one buffer: {count}")
+        self._buffers: List[np.ndarray] = []
+        self._count = count
+        self._next = 0
+
+    def next(
+        self, shape: Tuple[int, ...], dtype: type = np.uint8
+    ) -> np.ndarray:
+        if (
+            not self._buffers
+            or self._buffers[0].shape != shape
+            or self._buffers[0].dtype != dtype
+        ):
+            self._buffers = [
+                np.empty(shape, dtype=dtype) for _ in range(self._count)
+            ]
+        buffer = self._buffers[self._next]
+        self._next = (self._next + 1) % self._count
+        return buffer
+
+    @property
+    def nbytes(self) -> int:
+        return sum(buffer.nbytes for buffer in self._buffers)
@@ -0,0 +1,32 @@
+from typing import Optional, Tuple
+
+import numpy as np
+import cv2
+
+from watchdawg.client.preprocessor import BaseFramePreprocessor
+from watchdawg.client.preprocessor.buffers import FrameBuffers
+
+
+class ColorConvert(BaseFramePreprocessor):
+    """Converts frames with an OpenCV color conversion code, e.g.
+    cv2.COLOR_BGR2GRAY, into reused buffers
+    """
+
+    def __init__(self, code: int, buffers: int = 1) -> None:
+        self._code = code
+        self._buffers = FrameBuffers(buffers)
+        # Input shape and the output shape it converts to
+        self._shapes: Optional[Tuple[tuple, tuple]] = None
+
+    def __call__(self, frame: np.ndarray, **kwargs) -> np.ndarray:
+        if self._shapes is None or self._shapes[0] != frame.shape:
+            # The output shape depends on the conversion, the first frame of
+            # a size is converted into a new array to find it out
+            converted = cv2.cvtColor(frame, self._code)
+            self._shapes = frame.shape, converted.shape
+            return converted
+        converted = self._buffers.next(self._shapes[1], frame.dtype)
+        return cv2.cvtColor(frame, self._code, dst=converted)
+
+    def __repr__(self) -> str:
+        return f"ColorConvert({self._code})"
@@ -0,0 +1,30 @@
+from typing import Tuple
+
+import numpy as np
+
+from watchdawg.client.preprocessor import BaseFramePreprocessor
+
+
+class Crop(BaseFramePreprocessor):
+    """Keeps a region of interest of the frame. roi is (x, y, width,
+    height) as fractions of the frame. The result is a view into the frame,
+    nothing is copied
+    """
+
+    def __init__(self, roi: Tuple[float, float, float, float]) -> None:
+        x, y, width, height = roi
+        if not (0 <= x < 1 and 0 <= y < 1 and width > 0 and height > 0):
+            raise ValueError(f"Invalid region of interest: {roi}")
+        self._roi = roi
+
+    def __call__(self, frame: np.ndarray, **kwargs) -> np.ndarray:
+        height, width = frame.shape[:2]
+        x, y, roi_width, roi_height = self._roi
+        left, top = int(x * width), int(y * height)
+        return frame[
+            top : top + max(1, int(roi_height * height)),
+            left : left + max(1, int(roi_width * width)),
+        ]
+
+    def __repr__(self) -> str:
+        return f"Crop({self._roi})"
@@ -0,0 +1,36 @@
+from typing import Optional
+
+import numpy as np
+import cv2
+
+from watchdawg.client.preprocessor import BaseFramePreprocessor
+from watchdawg.client.preprocessor.buffers import FrameBuffers
+from watchdawg.client.preprocessor.resizer import Resizer
+
+
+class Flip(BaseFramePreprocessor):
+    """Flips frames into reused buffers. flip_code is OpenCV's: 1 mirrors
+    horizontally, 0 vertically and -1 both (a 180 degree rotation)
+    """
+
+    def __init__(self, flip_code: int = 1, buffers: int = 1) -> None:
+        if flip_code not in (-1, 0, 1):
+            raise ValueError(f"Flip code must be -1, 0 or 1: {flip_code}")
+        self.flip_code = flip_code
+        self._buffers = FrameBuffers(buffers)
+
+    def __call__(self, frame: np.ndarray, **kwargs) -> np.ndarray:
+        flipped = self._buffers.next(frame.shape, frame.dtype)
+        return cv2.flip(frame, self.flip_code, dst=flipped)
+
+    def fuse(
+        self, following: BaseFramePreprocessor
+    ) -> Optional[BaseFramePreprocessor]:
+        # Resizing a flipped frame gives the flipped resized frame, so the
+        # flip can be done on the smaller image after resizing instead
+        if isinstance(following, Resizer):
+            return following.fuse(self)
+        return None
+
+    def __repr__(self) -> str:
+        return f"Flip({self.flip_code})"
@@ -1,13 +1,26 @@
 import abc
+from typing import Optional
 
 import numpy as np
 
 
 class BaseFramePreprocessor(abc.ABC):
     @abc.abstractmethod
-    def __call__(self, frame: np.ndarray, **kwargs) -> np.ndarray:
+    def __call__(self, frame: np.ndarray, **kwargs) -> Optional[np.ndarray]:
+        """Returns the processed frame, or None if the frame shouldn't be
+        sent at all
+        """
         ...
 
+    def fuse(
+        self, following: "BaseFramePreprocessor"
+    ) -> Optional["BaseFramePreprocessor"]:
+        """Returns a single preprocessor doing the work of this one and then
+        the following one in fewer passes over the frame, or None if the two
+        can't be fused
+        """
+        return None
+
     @abc.abstractmethod
     def __repr__(self) -> str:
         ...
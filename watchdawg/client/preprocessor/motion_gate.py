@@ -0,0 +1,145 @@
+import time
+from typing import Optional, Tuple
+
+import numpy as np
+import cv2
+
+from watchdawg.client.preprocessor import BaseFramePreprocessor
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("motion_gate")
+
+
+class MotionGate(BaseFramePreprocessor):
+    """Lets a frame through only if the scene changed, returns None
+    otherwise.
+
+    Every frame's ROI is downsampled to a small grayscale image and compared
+    with a slowly updated background (a running average, so gradual light
+    changes don't count as motion). A frame has motion when more than
+    `threshold` of the pixels differ by more than `pixel_threshold`. Frames
+    keep going through for `hold_time` seconds after the motion stopped, and
+    a keyframe is sent every `keyframe_interval` seconds regardless, so the
+    server knows the camera is alive.
+
+    roi is (x, y, width, height) as fractions of the frame, None is the
+    whole frame.
+    """
+
+    def __init__(
+        self,
+        threshold: float = 0.01,
+        pixel_threshold: int = 25,
+        keyframe_interval: float = 10.0,
+        hold_time: float = 1.0,
+        roi: Optional[Tuple[float, float, float, float]] = None,
+        width: int = 160,
+        background_rate: float = 0.05,
+    ) -> None:
+        self._threshold = threshold
+        self._pixel_threshold = pixel_threshold
+        self._keyframe_interval = keyframe_interval
+        self._hold_time = hold_time
+        self._roi = roi
+        self._width = width
+        self._background_rate = background_rate
+
+        # Buffers are allocated on the first frame and reused
+        self._resized: Optional[np.ndarray] = None
+        self._small: Optional[np.ndarray] = None
+        self._background: Optional[np.ndarray] = None
+        self._background_u8: Optional[np.ndarray] = None
+        self._difference: Optional[np.ndarray] = None
+        self._last_sent_at = 0.0
+        self._last_motion_at = 0.0
+        self._frames_seen = 0
+        self._frames_suppressed = 0
+
+    @property
+    def suppressed_fraction(self) -> float:
+        return self._frames_suppressed / max(self._frames_seen, 1)
+
+    def report(self) -> dict:
+        return {
+            "frames_seen": self._frames_seen,
+            "frames_suppressed": self._frames_suppressed,
+            "suppressed_fraction": round(self.suppressed_fraction, 3),
+        }
+
+    def _crop(self, frame: np.ndarray) -> np.ndarray:
+        if self._roi is None:
+            return frame
+        height, width = frame.shape[:2]
+        x, y, roi_width, roi_height = self._roi
+        left, top = int(x * width), int(y * height)
+        return frame[
+            top : top + max(1, int(roi_height * height)),
+            left : left + max(1, int(roi_width * width)),
+        ]
+
+    def _changed_fraction(self, frame: np.ndarray) -> float:
+        region = self._crop(frame)
+        height, width = region.shape[:2]
+        small_size = (
+            min(self._width, width),
+            max(1, round(height * min(self._width, width) / width)),
+        )
+        if self._small is None or self._small.shape[::-1] != small_size:
+            # First frame or the resolution changed: start over
+            self._resized = np.empty(
+                (small_size[1], small_size[0], 3), dtype=np.uint8
+            )
+            self._small = np.empty(small_size[::-1], dtype=np.uint8)
+            self._background_u8 = np.empty_like(self._small)
+            self._difference = np.empty_like(self._small)
+            self._background = None
+
+        # Downsample before converting, so the conversion is cheap too
+        cv2.resize(
+            region, small_size, dst=self._resized, interpolation=cv2.INTER_AREA
+        )
+        cv2.cvtColor(self._resized, cv2.COLOR_BGR2GRAY, dst=self._small)
+        cv2.GaussianBlur(self._small, (5, 5), 0, dst=self._small)
+        if self._background is None:
+            self._background = self._small.astype(np.float32)
+            return 1.0
+
+        assert self._background_u8 is not None and self._difference is not None
+        np.copyto(self._background_u8, self._background, casting="unsafe")
+        cv2.absdiff(self._small, self._background_u8, dst=self._difference)
+        cv2.accumulateWeighted(
+            self._small, self._background, self._background_rate
+        )
+        cv2.threshold(
+            self._difference,
+            self._pixel_threshold,
+            255,
+            cv2.THRESH_BINARY,
+            dst=self._difference,
+        )
+        return cv2.countNonZero(self._difference) / self._difference.size
+
+    def __call__(self, frame: np.ndarray, **kwargs) -> Optional[np.ndarray]:
+        self._frames_seen += 1
+        if not self._frames_seen % 1000:
+            logger.debug(f"MotionGate: {self.report()}")
+        now = time.monotonic()
+        if self._changed_fraction(frame) >= self._threshold:
+            self._last_motion_at = now
+
+        if (
+            now - self._last_motion_at <= self._hold_time
+            or now - self._last_sent_at >= self._keyframe_interval
+        ):
+            self._last_sent_at = now
+            return frame
+
+        self._frames_suppressed += 1
+        return None
+
+    def __repr__(self) -> str:
+        return (
+            f"MotionGate(suppressed {self._frames_suppressed}/"
+            f"{self._frames_seen} frames)"
+        )
@@ -0,0 +1,91 @@
+import time
+from typing import List, Optional, Sequence
+
+import numpy as np
+
+from watchdawg.client.preprocessor import BaseFramePreprocessor
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("preprocessor_pipeline")
+
+
+class PreprocessorPipeline(BaseFramePreprocessor):
+    """Runs preprocessors one after another, stopping at the first one that
+    drops the frame.
+
+    Neighbouring preprocessors that can be fused (see
+    BaseFramePreprocessor.fuse) are replaced by the fused one when the
+    pipeline is built. Every stage is timed, report() gives the mean time
+    per frame it took and how many frames it dropped
+    """
+
+    def __init__(
+        self,
+        preprocessors: Sequence[BaseFramePreprocessor],
+        report_every: int = 1000,
+    ) -> None:
+        self._stages = self._fuse(preprocessors)
+        self._report_every = report_every
+        self._calls = [0] * len(self._stages)
+        self._seconds = [0.0] * len(self._stages)
+        self._dropped = [0] * len(self._stages)
+        self._frames = 0
+
+    @staticmethod
+    def _fuse(
+        preprocessors: Sequence[BaseFramePreprocessor],
+    ) -> List[BaseFramePreprocessor]:
+        stages: List[BaseFramePreprocessor] = []
+        for preprocessor in preprocessors:
+            fused = stages[-1].fuse(preprocessor) if stages else None
+            if fused is None:
+                stages.append(preprocessor)
+            else:
+                logger.debug(
+                    f"Fused {stages[-1]} and {preprocessor} into {fused}"
+                )
+                stages[-1] = fused
+        return stages
+
+    @property
+    def stages(self) -> List[BaseFramePreprocessor]:
+        return list(self._stages)
+
+    def __call__(self, frame: np.ndarray, **kwargs) -> Optional[np.ndarray]:
+        self._frames += 1
+        if not self._frames % self._report_every:
+            logger.debug(f"Preprocessing per stage: {self.report()}")
+        for i, stage in enumerate(self._stages):
+            start = time.perf_counter()
+            result = stage(frame, **kwargs)
+            self._seconds[i] += time.perf_counter() - start
+            self._calls[i] += 1
+            if result is None:
+                self._dropped[i] += 1
+                return None
+            frame = result
+        return frame
+
+    def report(self) -> dict:
+        return {
+            f"{i}: {stage}": {
+                "frames": self._calls[i],
+                "mean_ms": round(
+                    self._seconds[i] / max(self._calls[i], 1) * 1e3, 3
+                ),
+                "dropped": self._dropped[i],
+            }
+            for i, stage in enumerate(self._stages)
+        }
+
+    def __len__(self) -> int:
+        return len(self._stages)
+
+    def __repr__(self) -> str:
+        stages = ", ".join(
+            f"{stage} {self._seconds[i] / max(self._calls[i], 1) * 1e3:.2f} "
+            f"ms"
+            for i, stage in enumerate(self._stages)
+        )
+        return f"PreprocessorPipeline({stages})"
@@ -0,0 +1,113 @@
+from dataclasses import dataclass
+from typing import Sequence
+
+from watchdawg.util.frame_protocol import Feedback
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("quality_controller")
+
+
+@dataclass(frozen=True)
+class QualityLevel:
+    jpeg_quality: int
+    scale: float  # Of the (preprocessed) frame's resolution
+
+
+# Cheapest to the server first: smaller JPEGs decode faster, fewer pixels
+# decode faster still
+DEFAULT_QUALITY_LEVELS = (
+    QualityLevel(95, 1.0),
+    QualityLevel(85, 1.0),
+    QualityLevel(75, 1.0),
+    QualityLevel(75, 0.75),
+    QualityLevel(60, 0.75),
+    QualityLevel(60, 0.5),
+    QualityLevel(50, 0.5),
+)
+
+
+@dataclass(frozen=True)
+class SendSettings:
+    max_fps: float  # 0 is no limit
+    jpeg_quality: int
+    scale: float
+
+
+class AdaptiveQualityController:
+    """Turns the server's feedback into how the client sends frames, to keep
+    the time frames wait on the server under max_lag.
+
+    While the server lags or drops this client's frames, the quality level
+    steps down one level per feedback. When the lag is far over the target,
+    stale frames are piling up faster than quality alone can fix and the
+    send rate is cut by a quarter too. Once the lag stays under half the
+    target for recover_after feedbacks in a row, the rate is restored first
+    and then the quality, one step at a time. The server's own target rate
+    is always respected.
+
+    Settings are replaced as a whole, so the sending thread can read them
+    while the feedback thread updates them.
+    """
+
+    def __init__(
+        self,
+        max_lag: float,
+        levels: Sequence[QualityLevel] = DEFAULT_QUALITY_LEVELS,
+        recover_after: int = 2,
+        min_fps: float = 1.0,
+    ) -> None:
+        self._max_lag = max_lag
+        self._levels = levels
+        self._recover_after = recover_after
+        self._min_fps = min_fps
+        self._level = 0
+        self._fps_cap = 0.0  # Own limit on top of the server's, 0 is none
+        self._server_fps = 0.0
+        self._calm_feedbacks = 0
+        self._dropped_frames = 0
+        self.settings = self._make_settings()
+
+    def update(self, feedback: Feedback, send_fps: float) -> SendSettings:
+        """send_fps is the rate the client actually sent at recently"""
+        new_drops = feedback.dropped_frames > self._dropped_frames
+        self._dropped_frames = feedback.dropped_frames
+        self._server_fps = feedback.target_fps
+
+        if feedback.lag > self._max_lag or new_drops:
+            self._calm_feedbacks = 0
+            self._level = min(self._level + 1, len(self._levels) - 1)
+            if feedback.lag > 2 * self._max_lag:
+                self._fps_cap = max(self._min_fps, send_fps * 0.75)
+        elif feedback.lag < self._max_lag / 2:
+            self._calm_feedbacks += 1
+            if self._calm_feedbacks >= self._recover_after:
+                self._calm_feedbacks = 0
+                if self._fps_cap:
+                    self._fps_cap *= 1.25
+                    if self._fps_cap > send_fps * 2:
+                        # Not what limits the client anymore
+                        self._fps_cap = 0.0
+                elif self._level:
+                    self._level -= 1
+
+        settings = self._make_settings()
+        if settings != self.settings:
+            logger.info(
+                f"Server lag {feedback.lag:.2f}s, queued "
+                f"{feedback.queued_frames}, dropped "
+                f"{feedback.dropped_frames}. Sending at most "
+                f"{settings.max_fps:.1f} fps (0 = no limit), JPEG quality "
+                f"{settings.jpeg_quality}, scale {settings.scale}"
+            )
+        self.settings = settings
+        return settings
+
+    def _make_settings(self) -> SendSettings:
+        limits = [fps for fps in (self._server_fps, self._fps_cap) if fps]
+        level = self._levels[self._level]
+        return SendSettings(
+            max_fps=min(limits) if limits else 0.0,
+            jpeg_quality=level.jpeg_quality,
+            scale=level.scale,
+        )
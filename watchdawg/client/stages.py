@@ -0,0 +1,67 @@
+import collections
+import time
+from queue import Queue
+from typing import Any, Deque, Optional
+
+
+class DropOldestQueue(Queue):
+    """Bounded queue between two client stages whose puts never block: when
+    it is full the oldest item is dropped to make room, so a slow consumer
+    always gets the freshest items. With a capacity of 1 it is a slot that
+    holds only the latest item. Drops are counted against the stage that
+    fed the queue
+    """
+
+    def __init__(
+        self, capacity: int, producer: Optional["StageStats"] = None
+    ) -> None:
+        if capacity < 1:
+            raise ValueError(f"Capacity must be positive: {capacity}")
+        self._capacity = capacity
+        self._producer = producer
+        self.dropped = 0
+        # Unbounded for Queue, the capacity is enforced in _put
+        super().__init__(maxsize=0)
+
+    def _init(self, maxsize: int) -> None:
+        self.queue: Deque[Any] = collections.deque()
+
+    def _put(self, item: Any) -> None:
+        if len(self.queue) >= self._capacity:
+            self.queue.popleft()
+            self.dropped += 1
+            if self._producer is not None:
+                self._producer.dropped += 1
+        self.queue.append(item)
+
+
+class StageStats:
+    """Frames a client stage handled and dropped, and its recent rate"""
+
+    def __init__(self, name: str, window: int = 100) -> None:
+        self.name = name
+        self.frames = 0
+        self.dropped = 0
+        self.skipped = 0  # Left out on purpose, e.g. by a motion gate
+        self._times: Deque[float] = collections.deque(maxlen=window)
+
+    def record(self) -> None:
+        self.frames += 1
+        self._times.append(time.monotonic())
+
+    @property
+    def fps(self) -> float:
+        if len(self._times) < 2:
+            return 0.0
+        return (len(self._times) - 1) / max(
+            self._times[-1] - self._times[0], 1e-6
+        )
+
+    def report(self) -> dict:
+        return {
+            "frames": self.frames,
+            "fps": round(self.fps, 1),
+            "dropped": self.dropped,
+            "drop_rate": round(self.dropped / max(self.frames, 1), 3),
+            "skipped": self.skipped,
+        }
@@ -1,7 +1,11 @@
-from typing import Optional
-import pickle
+from queue import Empty
+from typing import Optional, Sequence, Tuple, Union
+import socket
 import struct
+import threading
+import time
 
+import numpy as np
 import cv2
 
 from watchdawg.client import BaseClient
@@ -11,8 +15,26 @@ from watchdawg.util.communication import (
     create_socket,
     connect_to_server,
     close_socket,
+    send_buffers,
 )
+from watchdawg.util.frame_protocol import (
+    PREAMBLE_SIZE,
+    Codec,
+    FrameMeta,
+    MessageType,
+    ProtocolError,
+    pack_frame_header,
+    pack_hello,
+    unpack_feedback,
+    unpack_preamble,
+)
+from watchdawg.util.socket_reader import SocketReader
 from watchdawg.client.preprocessor import BaseFramePreprocessor
+from watchdawg.client.quality_controller import (
+    AdaptiveQualityController,
+    SendSettings,
+)
+from watchdawg.client.stages import DropOldestQueue, StageStats
 from watchdawg.config import Config
 
 
@@ -24,16 +46,58 @@ class TCPClient(BaseClient):
         self,
         name: str,
         video_source: BaseSource,
-        frame_preprocessor: Optional[BaseFramePreprocessor] = None,
+        frame_preprocessor: Union[
+            BaseFramePreprocessor, Sequence[BaseFramePreprocessor], None
+        ] = None,
         server_host: str = Config.SERVER_HOST,
         server_port: int = Config.SERVER_PORT,
         every_nth_frame: int = 0,
+        adaptive_quality: bool = Config.CLIENT_ADAPTIVE_QUALITY,
+        threaded: bool = Config.CLIENT_THREADED,
+        send_queue_size: int = Config.CLIENT_SEND_QUEUE_SIZE,
+        socket_send_buffer: int = Config.CLIENT_SOCKET_SEND_BUFFER,
     ) -> None:
         super().__init__(
             name, video_source, frame_preprocessor, every_nth_frame
         )
         self._socket = create_socket()
+        if socket_send_buffer:
+            # Frames waiting in the kernel can't be dropped for fresher ones
+            self._socket.setsockopt(
+                socket.SOL_SOCKET, socket.SO_SNDBUF, socket_send_buffer
+            )
         connect_to_server(self._socket, server_host, server_port)
+        self._socket.sendall(pack_hello(name))
+        # Replaced as a whole by the feedback thread, read by the sender
+        self._settings = SendSettings(
+            max_fps=0.0, jpeg_quality=Config.JPEG_QUALITY, scale=1.0
+        )
+        self._quality_controller = (
+            AdaptiveQualityController(max_lag=Config.CLIENT_MAX_LAG)
+            if adaptive_quality
+            else None
+        )
+        self._frames_sent = 0
+        self._frames_throttled = 0
+        self._next_send_at = 0.0
+        self._threaded = threaded
+        self._capture_stats = StageStats("capture")
+        self._encode_stats = StageStats("encode")
+        self._send_stats = StageStats("send")
+        # Only the freshest captured frame waits for the encoder
+        self._captured = DropOldestQueue(1, producer=self._capture_stats)
+        self._encoded = DropOldestQueue(
+            send_queue_size, producer=self._encode_stats
+        )
+        self._captured_all = threading.Event()
+        self._encoded_all = threading.Event()
+        self._stop_event = threading.Event()
+        self._stage_error: Optional[Exception] = None
+        self._feedback_thread = threading.Thread(
+            name=f"TCPClientFeedback_{name}",
+            target=self._receive_feedback,
+            daemon=True,
+        )
         logger.info(
             f"TCPClient {name} for video source {video_source.name} "
             f"initialised. Connected to {self._socket.getpeername()}"
@@ -41,42 +105,245 @@ class TCPClient(BaseClient):
 
     def start_client(self) -> None:
         """Ensures the socket gets closed even if the client fails"""
+        self._feedback_thread.start()
         try:
-            self._send_feed()
+            if self._threaded:
+                self._send_feed_threaded()
+            else:
+                self._send_feed()
         except Exception as e:
             logger.error(f"Failed while sending feed to server. Error: {e}")
             self.stop()
             raise e
-        logger.info("Client finished")
-
-    def _send_feed(self):
-        preprocessor = self._preprocessor
-        jpeg_quality = Config.JPEG_QUALITY
-        frame_counter = 0
-        for frame in self._video_source:
-            if (
-                self._every_nth_frame != 0
-                and frame_counter % self._every_nth_frame
-            ):
-                frame_counter += 1
-                continue
+        logger.info(
+            f"Client finished. Preprocessing: {self._preprocessor}. "
+            f"Stages: {self.stage_report()}"
+        )
+
+    @property
+    def settings(self) -> SendSettings:
+        return self._settings
+
+    def _receive_feedback(self) -> None:
+        """Reads the server's feedback messages until the socket closes"""
+        reader = SocketReader(self._socket, capacity=4096)
+        last_feedback_at = time.monotonic()
+        last_frames_sent = 0
+        try:
+            while True:
+                header = reader.read(PREAMBLE_SIZE)
+                if header is None:
+                    return
+                preamble = unpack_preamble(header)
+                body = reader.read(preamble.body_size)
+                if body is None:
+                    return
+                if preamble.message_type != MessageType.FEEDBACK:
+                    continue
+                feedback = unpack_feedback(body)
+
+                now = time.monotonic()
+                frames_sent = self._frames_sent
+                send_fps = (frames_sent - last_frames_sent) / max(
+                    now - last_feedback_at, 1e-3
+                )
+                last_feedback_at, last_frames_sent = now, frames_sent
 
-            if preprocessor:
-                frame = preprocessor(frame)
+                if self._quality_controller:
+                    self._settings = self._quality_controller.update(
+                        feedback, send_fps
+                    )
+                elif feedback.target_fps != self._settings.max_fps:
+                    logger.info(
+                        f"Server asked for {feedback.target_fps:.1f} fps "
+                        f"(0 = no limit). Frames queued on the server: "
+                        f"{feedback.queued_frames}, dropped: "
+                        f"{feedback.dropped_frames}, throttled here: "
+                        f"{self._frames_throttled}"
+                    )
+                    self._settings = SendSettings(
+                        max_fps=feedback.target_fps,
+                        jpeg_quality=self._settings.jpeg_quality,
+                        scale=self._settings.scale,
+                    )
+        except (struct.error, ProtocolError) as e:
+            # The stream can't be followed anymore, frames are still sent
+            # with the last settings
+            logger.error(f"Bad feedback from the server. Error: {e}")
+        except OSError as e:
+            logger.debug(f"Stopped receiving feedback. Error: {e}")
 
-            _, frame = cv2.imencode(
-                ".jpg",
+    def stage_report(self) -> dict:
+        return {
+            stats.name: stats.report()
+            for stats in (
+                self._capture_stats,
+                self._encode_stats,
+                self._send_stats,
+            )
+        }
+
+    def _admit(self, frame_counter: int) -> bool:
+        """Whether a captured frame should be sent at all. Frames above the
+        rate the server can take are skipped before spending time on them
+        """
+        if (
+            self._every_nth_frame != 0
+            and frame_counter % self._every_nth_frame
+        ):
+            return False
+        max_fps = self._settings.max_fps
+        if max_fps:
+            now = time.monotonic()
+            if now < self._next_send_at:
+                self._frames_throttled += 1
+                return False
+            # Allow a little jitter in the source's frame timing
+            self._next_send_at = now + 0.9 / max_fps
+        return True
+
+    def _encode(
+        self, frame: np.ndarray, sequence: int, captured_at: float
+    ) -> Optional[Tuple[bytes, memoryview]]:
+        """Preprocesses and encodes a frame, returns the buffers to send or
+        None if a preprocessor dropped it
+        """
+        settings = self._settings
+        processed = self._preprocess(frame)
+        if processed is None:
+            return None
+        frame = processed
+        if settings.scale != 1.0:
+            frame = cv2.resize(
                 frame,
-                params=[int(cv2.IMWRITE_JPEG_QUALITY), jpeg_quality],
+                None,
+                fx=settings.scale,
+                fy=settings.scale,
+                interpolation=cv2.INTER_AREA,
             )
-            data = pickle.dumps(frame, 0)
-            size = len(data)
-            bytes_to_send = struct.pack(Config.STRUCT_SIZE_FORMAT, size) + data
-            self._socket.sendall(bytes_to_send)
 
-            frame_counter += 1
-            if not frame_counter % 100:
-                logger.info(f"Sent {frame_counter} frame to the server")
+        height, width = frame.shape[:2]
+        _, encoded = cv2.imencode(
+            ".jpg",
+            frame,
+            params=[int(cv2.IMWRITE_JPEG_QUALITY), settings.jpeg_quality],
+        )
+        meta = FrameMeta(
+            codec=Codec.JPEG,
+            width=width,
+            height=height,
+            sequence=sequence,
+            timestamp=captured_at,
+        )
+        payload = memoryview(encoded).cast("B")
+        return pack_frame_header(meta, len(payload)), payload
+
+    def _send(self, buffers: Tuple[bytes, memoryview]) -> None:
+        send_buffers(self._socket, buffers)
+        self._frames_sent += 1
+        self._send_stats.record()
+        if not self._frames_sent % 100:
+            logger.info(f"Sent {self._frames_sent} frames to the server")
+        if not self._frames_sent % 1000:
+            logger.info(f"Client stages: {self.stage_report()}")
+
+    def _send_feed(self) -> None:
+        """Captures, encodes and sends frames one after another"""
+        for frame_counter, frame in enumerate(self._video_source):
+            if self._stop_event.is_set():
+                break
+            if not self._admit(frame_counter):
+                self._capture_stats.skipped += 1
+                continue
+            self._capture_stats.record()
+            buffers = self._encode(frame, frame_counter, time.time())
+            if buffers is None:
+                self._encode_stats.skipped += 1
+                continue
+            self._encode_stats.record()
+            self._send(buffers)
+
+    def _send_feed_threaded(self) -> None:
+        """Captures on this thread while other threads encode and send.
+
+        Stages are connected with queues that drop their oldest frame when
+        full, so a slow encoder or network never holds capture up: the
+        encoder always takes the freshest captured frame, and the sender the
+        freshest encoded ones
+        """
+        encoder = threading.Thread(
+            name=f"TCPClientEncoder_{self._name}",
+            target=self._encode_frames,
+            daemon=True,
+        )
+        sender = threading.Thread(
+            name=f"TCPClientSender_{self._name}",
+            target=self._send_frames,
+            daemon=True,
+        )
+        encoder.start()
+        sender.start()
+        try:
+            for frame_counter, frame in enumerate(self._video_source):
+                if self._stop_event.is_set():
+                    break
+                if not self._admit(frame_counter):
+                    self._capture_stats.skipped += 1
+                    continue
+                self._capture_stats.record()
+                self._captured.put((frame, frame_counter, time.time()))
+        finally:
+            self._captured_all.set()
+            encoder.join()
+            sender.join()
+        if self._stage_error is not None:
+            raise self._stage_error
+
+    def _encode_frames(self) -> None:
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    frame, sequence, captured_at = self._captured.get(
+                        timeout=0.1
+                    )
+                except Empty:
+                    if self._captured_all.is_set():
+                        break
+                    continue
+                buffers = self._encode(frame, sequence, captured_at)
+                if buffers is None:
+                    self._encode_stats.skipped += 1
+                    continue
+                self._encode_stats.record()
+                self._encoded.put(buffers)
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._encoded_all.set()
+
+    def _send_frames(self) -> None:
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    buffers = self._encoded.get(timeout=0.1)
+                except Empty:
+                    if self._encoded_all.is_set():
+                        break
+                    continue
+                self._send(buffers)
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error: Exception) -> None:
+        """Stops every stage when one of them fails"""
+        if self._stop_event.is_set():
+            return  # Stopped on purpose, e.g. the socket was closed
+        logger.error(
+            f"{threading.current_thread().name} failed. Error: {error}"
+        )
+        self._stage_error = error
+        self._stop_event.set()
 
     def stop(self) -> None:
+        self._stop_event.set()
         close_socket(self._socket)
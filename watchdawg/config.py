@@ -1,3 +1,6 @@
+from typing import Any, Dict
+
+
 class Config:
 
     # Logger
@@ -9,24 +12,152 @@ class Config:
     # TCPServer / TCPClient
     SERVER_PORT = 9000
     SERVER_HOST = "192.168.1.104"
-    STRUCT_SIZE_FORMAT = ">L"
+    RECEIVE_BUFFER_SIZE = 1024 * 1024  # Grows if a message doesn't fit
+    # Largest message body accepted from a peer, larger is a ProtocolError
+    MAX_MESSAGE_SIZE = 32 * 1024 * 1024
     JPEG_QUALITY = 95
     MODEL_INPUT_WIDTH = 640
     MODEL_INPUT_HEIGHT = 360
-    REPORT_STATE_FREQUENCY = 5
+    REPORT_STATE_FREQUENCY = 5  # Seconds between resource samples
+    # Also log the state, latency percentiles included, every sample
+    REPORT_STATE_LOG = True
+    # Prometheus text format on http://METRICS_HOST:METRICS_PORT/metrics,
+    # 0 disables the endpoint
+    METRICS_PORT = 9101
+    METRICS_HOST = "127.0.0.1"
+    # Sampling profiler: starts with the app if PROFILE_ON_START, SIGUSR1
+    # toggles it, so does creating or removing PROFILE_TRIGGER_FILE. The
+    # profile is written to PROFILE_OUTPUT_FOLDER when it stops
+    PROFILE_ON_START = False
+    PROFILE_INTERVAL = 0.01  # Seconds between stack samples
+    PROFILE_OUTPUT_FOLDER = "profiles"
+    PROFILE_TRIGGER_FILE = ""  # Checked every REPORT_STATE_FREQUENCY
+    # Time every frame spends in each server stage, see backend/tracing.py
+    TRACE_FRAMES = True
+
+    # Client motion gate: frames without motion are not sent
+    MOTION_GATE_THRESHOLD = 0.01  # Fraction of changed pixels
+    MOTION_GATE_PIXEL_THRESHOLD = 25  # Gray level difference to count
+    MOTION_GATE_KEYFRAME_INTERVAL = 10.0  # Seconds, sent even if static
+    MOTION_GATE_HOLD_TIME = 1.0  # Seconds sent after the motion stops
+    MOTION_GATE_ROI = None  # (x, y, width, height) as fractions of a frame
+
+    # Video file and stream sources
+    VIDEO_DECODE_THREADS = 0  # 0 lets FFmpeg decide
+    VIDEO_HW_ACCELERATION = True  # Falls back to software decoding
+    VIDEO_OPEN_TIMEOUT = 10.0  # Seconds
+    # FFmpeg options for streams, "key;value|key;value"
+    VIDEO_FFMPEG_CAPTURE_OPTIONS = "rtsp_transport;tcp"
+
+    # Server implementation: "threaded" (TCPServer) or "asyncio"
+    SERVER_IMPLEMENTATION = "threaded"
+    ASYNC_SERVER_EXECUTOR_WORKERS = 4  # Blocking puts when queue is full
+    ASYNC_SERVER_USE_UVLOOP = True  # Used if installed
+
+    # FrameDecoder
+    # Frames waiting to be decoded, in total and per client. Past these the
+    # oldest frames are dropped, the server never waits on the decoder
+    ENCODED_FRAMES_QUEUE_SIZE = 500
+    CLIENT_ENCODED_QUEUE_SIZE = 30
+    DECODE_WORKERS = 4
+    DECODE_EXECUTOR = "thread"  # "thread" or "process"
+    DECODE_MAX_IN_FLIGHT = 32
+    # Decode at the smallest reduced JPEG scale the model input allows
+    DECODE_TO_MODEL_INPUT_SIZE = False
+
+    # Fair scheduling of decoded frames between clients
+    CLIENT_QUEUE_SIZE = 30  # Per client, the oldest frame is dropped if full
+    CLIENT_DEFAULT_WEIGHT = 1.0
+    CLIENT_DEFAULT_MAX_FPS = 0.0  # 0 is no cap
+    # Overrides by client name, e.g. {"door": {"weight": 2, "max_fps": 10}}
+    CLIENT_POLICIES: Dict[str, Dict[str, float]] = {}
+    CLIENT_FEEDBACK_INTERVAL = 2.0  # Seconds between send rate updates
+    # Clients lower JPEG quality, resolution and frame rate to keep the time
+    # their frames wait on the server under CLIENT_MAX_LAG seconds
+    CLIENT_ADAPTIVE_QUALITY = True
+    CLIENT_MAX_LAG = 1.0
+    # Capture, encoding and sending run on their own threads, so a slow
+    # network doesn't hold capture up. Encoded frames waiting to be sent,
+    # the oldest is dropped if full
+    CLIENT_THREADED = True
+    CLIENT_SEND_QUEUE_SIZE = 2
+    # Bytes, 0 keeps the OS default. On slow links a smaller buffer holds
+    # fewer stale frames, on fast ones it can limit throughput
+    CLIENT_SOCKET_SEND_BUFFER = 0
 
     # FeedHandler
-    DECODED_FRAMES_QUEUE_SIZE = 500
     BUILD_BATCH_TIME_WINDOW = 0.1
+    # Batches in flight between collect, inference and dispatch stages,
+    # 0 runs the stages sequentially on one thread
+    PIPELINE_DEPTH = 1
 
     # ML
     MODEL_BATCH_SIZE = 64
+    # "ultralytics", "onnxruntime", "openvino" or "placeholder"
+    MODEL_BACKEND = "ultralytics"
+    MODEL_WEIGHTS = "yolov8n.pt"  # .onnx export for onnxruntime / openvino
+    MODEL_CONF_THRESHOLD = 0.25
+    MODEL_IOU_THRESHOLD = 0.45
+    ONNX_INTRA_OP_THREADS = 0  # 0 lets ONNX Runtime decide
+    ONNX_INTER_OP_THREADS = 0
+    ONNX_FAST_NMS = False  # Vectorised but over-suppresses crowds
+    # Inference worker processes with shared memory frame transport,
+    # 0 runs the model in the FeedProcessor thread
+    INFERENCE_WORKERS = 0
+    INFERENCE_WORKER_TORCH_THREADS = None  # None splits available CPUs
+    INFERENCE_WORKER_PIN_CPUS = True
+    # A worker slower than this on a batch is restarted, the batch dropped
+    INFERENCE_WORKER_TASK_TIMEOUT = 60.0
+
+    # Adaptive batching: MODEL_BATCH_SIZE and BUILD_BATCH_TIME_WINDOW become
+    # upper bounds, the actual values are picked from measured model latency
+    ADAPTIVE_BATCHING = False
+    ADAPTIVE_BATCHING_LATENCY_TARGET = 1.0  # p99 seconds in the processor
+    ADAPTIVE_BATCHING_INTERVAL = 5.0  # Seconds between decisions
 
     # ResultsWriter
     PROCESSED_BATCHES_QUEUE_SIZE = 50  # TOTAL CAPACITY: X * MODEL_BATCH_SIZE
     PROCESSED_FEED_LOCAL_FOLDER = ""
-    CLIENT_RESULT_WRITER_HANDLER_QUEUE = 100
+    # Clients are sharded over a fixed number of worker threads, frames are
+    # dropped when a worker has more than RESULT_WRITER_WORKER_QUEUE queued
+    RESULT_WRITER_WORKERS = 4
+    RESULT_WRITER_WORKER_QUEUE = 200
 
     SAVE_VIDEO_WIDTH = MODEL_INPUT_WIDTH
     SAVE_VIDEO_HEIGHT = MODEL_INPUT_HEIGHT
     SAVE_VIDEO_FPS = 10
+    SAVE_VIDEO_JPEG_QUALITY = 95
+    # Saved and recorded videos are split into segments, a new one starts
+    # after RECORD_SEGMENT_SECONDS or at RECORD_MAX_FILE_SIZE. Closed
+    # segments are listed with their time range in <folder>/index.jsonl
+    RECORD_SEGMENT_SECONDS = 600
+    RECORD_MAX_FILE_SIZE = 2**30
+    # Files are written by a thread of their own, workers only block when
+    # RECORD_MAX_PENDING_BYTES wait for the disk. RECORD_FSYNC is "never",
+    # "close" (every segment once complete) or "interval" (open segments
+    # too, every RECORD_FSYNC_INTERVAL seconds)
+    RECORD_WRITE_BUFFER = 2**20
+    RECORD_MAX_PENDING_BYTES = 2**26
+    RECORD_FSYNC = "close"
+    RECORD_FSYNC_INTERVAL = 5.0
+    # Segments that ended longer than RECORD_RETENTION_SECONDS ago are
+    # deleted, then the oldest beyond RECORD_RETENTION_BYTES. 0 disables
+    RECORD_RETENTION_SECONDS = 0
+    RECORD_RETENTION_BYTES = 0
+    RECORD_RETENTION_CHECK_INTERVAL = 60.0
+    # ResultWriterMode.RECORD_EVENTS: the last EVENT_PREROLL_SECONDS of
+    # every client are kept in EVENT_PREROLL_MAX_BYTES of memory, and
+    # recorded with what follows once detections match the client's rule,
+    # until EVENT_POSTROLL_SECONDS pass without a match. Rules are
+    # TriggerRule arguments, overridden by client name, e.g.
+    # {"door": {"class_ids": [0], "min_score": 0.6, "roi": [0, 0.5, 1, 1]}}
+    EVENT_PREROLL_SECONDS = 5.0
+    EVENT_POSTROLL_SECONDS = 10.0
+    EVENT_PREROLL_MAX_BYTES = 2**23
+    EVENT_DEFAULT_TRIGGER: Dict[str, Any] = {"min_score": 0.5}
+    EVENT_TRIGGERS: Dict[str, Dict[str, Any]] = {}
+    # Every detection is also appended to a DetectionsStore in this folder,
+    # in any mode. Empty disables it. Records are buffered per client, up
+    # to DETECTIONS_STORE_BUFFER_ROWS are lost if the process dies
+    DETECTIONS_STORE_FOLDER = ""
+    DETECTIONS_STORE_BUFFER_ROWS = 4096
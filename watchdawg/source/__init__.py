@@ -1,2 +1,4 @@
 from .base import BaseSource
 from .web_camera import WebCamera
+from .video_file import VideoFileSource
+from .synthetic import SyntheticSource, synthetic_frame
@@ -1,4 +1,5 @@
 import abc
+from typing import Iterator
 
 import numpy as np
 
@@ -10,5 +11,5 @@ class BaseSource(abc.ABC):
         ...
 
     @abc.abstractmethod
-    def __iter__(self) -> np.ndarray:
+    def __iter__(self) -> Iterator[np.ndarray]:
         ...
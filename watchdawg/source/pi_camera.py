@@ -1,4 +1,4 @@
-from source.base import BaseSource
+from watchdawg.source.base import BaseSource
 
 
 class PiCamera(BaseSource):
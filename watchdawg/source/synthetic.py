@@ -0,0 +1,87 @@
+import time
+from typing import Iterator, Optional
+
+import numpy as np
+import cv2
+
+from watchdawg.source.base import BaseSource
+
+
+def synthetic_frame(width: int, height: int, index: int = 0) -> np.ndarray:
+    """Deterministic BGR frame with gradients, a moving box and some noise,
+    so JPEG sizes are closer to a real camera than a flat or random image
+    """
+    xs = np.linspace(0, 255, width, dtype=np.float32)
+    ys = np.linspace(0, 255, height, dtype=np.float32)
+    frame = np.empty((height, width, 3), dtype=np.uint8)
+    frame[..., 0] = (xs[None, :] + index) % 256
+    frame[..., 1] = (ys[:, None] + 2 * index) % 256
+    frame[..., 2] = 128
+    rng = np.random.default_rng(index)
+    noise = rng.integers(0, 16, size=frame.shape, dtype=np.uint8)
+    np.add(frame, noise, out=frame, casting="unsafe")
+
+    box = max(8, min(width, height) // 6)
+    x = (index * 7) % max(1, width - box)
+    y = (index * 3) % max(1, height - box)
+    cv2.rectangle(frame, (x, y), (x + box, y + box), (0, 0, 255), -1)
+    return frame
+
+
+class SyntheticSource(BaseSource):
+    """Yields deterministic synthetic frames at a fixed rate and resolution,
+    like a camera would, for duration seconds or max_frames frames (forever
+    without either).
+
+    A cycle of `cycle` different frames is rendered up front, so producing a
+    frame costs nothing and runs are repeatable. Like a camera, a realtime
+    source doesn't wait for a slow consumer, it just yields fewer frames.
+    Without realtime, frames are yielded as fast as they are consumed
+    """
+
+    def __init__(
+        self,
+        width: int,
+        height: int,
+        fps: float,
+        duration: Optional[float] = None,
+        max_frames: Optional[int] = None,
+        realtime: bool = True,
+        cycle: int = 16,
+    ) -> None:
+        self._frames = [
+            synthetic_frame(width, height, i) for i in range(cycle)
+        ]
+        self._fps = fps
+        self._duration = duration
+        self._max_frames = max_frames
+        self._realtime = realtime
+
+    @property
+    def name(self) -> str:
+        return "synthetic"
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        interval = 1.0 / self._fps
+        max_frames = self._max_frames
+        deadline = float("inf")
+        if self._duration is not None:
+            if self._realtime:
+                deadline = time.perf_counter() + self._duration
+            else:
+                # Without a clock the duration is counted in frames
+                frames = round(self._duration * self._fps)
+                max_frames = min(max_frames or frames, frames)
+
+        next_frame_at = time.perf_counter()
+        index = 0
+        while (
+            max_frames is None or index < max_frames
+        ) and time.perf_counter() < deadline:
+            yield self._frames[index % len(self._frames)]
+            index += 1
+            if self._realtime:
+                now = time.perf_counter()
+                # Frames a slow consumer missed are gone, not caught up on
+                next_frame_at = max(next_frame_at + interval, now - interval)
+                time.sleep(max(0.0, next_frame_at - now))
@@ -0,0 +1,167 @@
+import os
+import time
+from typing import Iterator, List
+from urllib.parse import urlsplit, urlunsplit
+
+import numpy as np
+import cv2
+
+from watchdawg.source.base import BaseSource
+from watchdawg.config import Config
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("video_file_source")
+
+
+class VideoFileSource(BaseSource):
+    """Frames of a video file or a network stream (RTSP, HTTP, ...), decoded
+    by OpenCV's FFmpeg backend.
+
+    decode_threads is passed to the decoder, 0 lets FFmpeg decide. With
+    hw_acceleration any available hardware decoder is used, falling back to
+    software. skip_frames frames are grabbed without being retrieved after
+    every frame yielded: they are still demuxed and decoded, as later frames
+    depend on them, but never converted to BGR or copied out.
+
+    Files are played at their own frame rate when realtime is set, like a
+    camera would deliver them, otherwise as fast as they decode. Streams
+    are paced by the sender and can't seek.
+    """
+
+    def __init__(
+        self,
+        uri: str,
+        realtime: bool = True,
+        skip_frames: int = 0,
+        start: float = 0.0,
+        loop: bool = False,
+        decode_threads: int = Config.VIDEO_DECODE_THREADS,
+        hw_acceleration: bool = Config.VIDEO_HW_ACCELERATION,
+        open_timeout: float = Config.VIDEO_OPEN_TIMEOUT,
+    ) -> None:
+        if skip_frames < 0:
+            raise ValueError(f"Can't skip {skip_frames} frames")
+        self._uri = uri
+        self._is_stream = "://" in uri and not uri.startswith("file://")
+        self._realtime = realtime and not self._is_stream
+        self._skip_frames = skip_frames
+        self._loop = loop and not self._is_stream
+        if self._is_stream and Config.VIDEO_FFMPEG_CAPTURE_OPTIONS:
+            # Read by OpenCV when a capture is opened, the environment wins
+            os.environ.setdefault(
+                "OPENCV_FFMPEG_CAPTURE_OPTIONS",
+                Config.VIDEO_FFMPEG_CAPTURE_OPTIONS,
+            )
+        self._cap = cv2.VideoCapture(
+            uri,
+            cv2.CAP_FFMPEG,
+            self._open_params(decode_threads, hw_acceleration, open_timeout),
+        )
+        if not self._cap.isOpened():
+            raise IOError(f"Failed to open video {self.name}")
+        self.fps = self._cap.get(cv2.CAP_PROP_FPS) or 0.0
+        if self._realtime and not self.fps > 0:
+            logger.warning(
+                f"Unknown frame rate of {self.name}, playing it as fast as "
+                f"it decodes"
+            )
+            self._realtime = False
+        if start:
+            self.seek(start)
+        self.frames_read = 0
+        self.frames_skipped = 0  # Including the late ones
+        self.frames_late = 0
+        logger.info(
+            f"Opened {self.name}: "
+            f"{int(self._cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x"
+            f"{int(self._cap.get(cv2.CAP_PROP_FRAME_HEIGHT))} at "
+            f"{self.fps:.1f} fps, backend {self._cap.getBackendName()}"
+        )
+
+    @staticmethod
+    def _open_params(
+        decode_threads: int, hw_acceleration: bool, open_timeout: float
+    ) -> List[int]:
+        params = [
+            cv2.CAP_PROP_OPEN_TIMEOUT_MSEC,
+            int(open_timeout * 1000),
+            cv2.CAP_PROP_HW_ACCELERATION,
+            (
+                cv2.VIDEO_ACCELERATION_ANY
+                if hw_acceleration
+                else cv2.VIDEO_ACCELERATION_NONE
+            ),
+        ]
+        if decode_threads:
+            params += [cv2.CAP_PROP_N_THREADS, decode_threads]
+        return params
+
+    @property
+    def name(self) -> str:
+        if not self._is_stream:
+            return os.path.basename(self._uri)
+        # Credentials in stream URLs shouldn't end up in logs
+        parts = urlsplit(self._uri)
+        host = parts.hostname or ""
+        if parts.port:
+            host = f"{host}:{parts.port}"
+        return urlunsplit(parts._replace(netloc=host, query=""))
+
+    def seek(self, seconds: float) -> None:
+        if self._is_stream:
+            raise ValueError(f"Can't seek in stream {self.name}")
+        if not self._cap.set(cv2.CAP_PROP_POS_MSEC, seconds * 1000):
+            raise ValueError(f"Failed to seek {self.name} to {seconds}s")
+
+    def _grab(self, frames: int) -> int:
+        """Decodes frames without retrieving them, returns how many"""
+        for grabbed in range(frames):
+            if not self._cap.grab():
+                return grabbed
+            self.frames_skipped += 1
+        return frames
+
+    def __iter__(self) -> Iterator[np.ndarray]:
+        interval = (self._skip_frames + 1) / self.fps if self._realtime else 0
+        next_frame_at = time.perf_counter()
+        while True:
+            has_frame, frame = self._cap.read()
+            if not has_frame:
+                if self._loop and self.frames_read:
+                    self._cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    continue
+                break
+            self.frames_read += 1
+            yield frame
+
+            self._grab(self._skip_frames)
+            if self._realtime:
+                now = time.perf_counter()
+                next_frame_at += interval
+                # Like a camera, the video doesn't wait for a slow consumer:
+                # the frames it missed are skipped
+                missed = int((now - next_frame_at) / interval)
+                if missed > 0:
+                    self.frames_late += self._grab(
+                        missed * (self._skip_frames + 1)
+                    )
+                    next_frame_at += missed * interval
+                time.sleep(max(0.0, next_frame_at - now))
+        logger.info(
+            f"{self.name} ended after {self.frames_read} frames, "
+            f"{self.frames_skipped} skipped, {self.frames_late} of them late"
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        if self._cap.isOpened():
+            self._cap.release()
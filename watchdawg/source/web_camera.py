@@ -1,3 +1,5 @@
+from typing import Iterator
+
 import cv2
 import numpy as np
 
@@ -12,7 +14,7 @@ class WebCamera(BaseSource):
     def name(self) -> str:
         return "WebCamera"
 
-    def __iter__(self) -> np.ndarray:
+    def __iter__(self) -> Iterator[np.ndarray]:
         while True:
             has_frame, frame = self._cap.read()
             if not has_frame:
@@ -1,4 +1,5 @@
 import socket
+from typing import Sequence, Union
 
 from watchdawg.util.logger import get_logger
 
@@ -36,3 +37,23 @@ def close_socket(client_socket: socket.socket) -> None:
         logger.error(f"Failed while closing the socket. Error: {e}")
     else:
         logger.debug("Socket closed gracefully")
+
+
+def send_buffers(
+    sock: socket.socket, buffers: Sequence[Union[bytes, memoryview]]
+) -> int:
+    """Sends all buffers with as few syscalls as possible, without joining
+    them into a single bytes object first. sendmsg() may send only part of
+    the data, in which case the remainder is resent
+    """
+    views = [memoryview(buffer).cast("B") for buffer in buffers]
+    total_sent = 0
+    while views:
+        sent = sock.sendmsg(views)
+        total_sent += sent
+        while views and sent >= len(views[0]):
+            sent -= len(views[0])
+            views.pop(0)
+        if views and sent:
+            views[0] = views[0][sent:]
+    return total_sent
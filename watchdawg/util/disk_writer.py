@@ -0,0 +1,292 @@
+"""File writes moved off the threads producing the data.
+
+A DiskWriter owns a thread that does all the I/O of the files it opened.
+Writers of an AsyncFile only copy bytes into the file's buffer, which is
+handed to the thread buffer_size bytes at a time, so a slow disk costs the
+producer nothing until max_pending_bytes are waiting to be written. Then it
+blocks, to bound memory. Operations on a file are executed in the order
+they were submitted.
+"""
+import collections
+import enum
+import os
+import threading
+import time
+from typing import BinaryIO, Callable, Deque, Optional, Set, Tuple, cast
+
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("disk_writer")
+
+
+class FsyncPolicy(enum.Enum):
+    NEVER = "never"  # The OS writes back when it likes
+    ON_CLOSE = "close"  # A file is on disk once closed
+    INTERVAL = "interval"  # Open files too, every fsync_interval
+
+
+class AsyncFile:
+    """A file written by a DiskWriter's thread. tell() is the size the file
+    will have once everything submitted is written
+    """
+
+    def __init__(
+        self, disk_writer: "DiskWriter", path: str, buffer_size: int
+    ) -> None:
+        self.path = path
+        self._disk_writer = disk_writer
+        self._buffer_size = buffer_size
+        self._buffer = bytearray()
+        self._position = 0
+        self.closed = False
+        # Used on the writer's thread only
+        self.file: Optional[BinaryIO] = None
+        self.failed = False
+        disk_writer._submit(("open", self, None), 0)
+
+    def write(self, data: bytes) -> None:
+        self._buffer += data
+        self._position += len(data)
+        if len(self._buffer) >= self._buffer_size:
+            self.flush()
+
+    def tell(self) -> int:
+        return self._position
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        """Overwrites what was written at offset, e.g. to patch a header"""
+        self.flush()
+        self._disk_writer._submit(
+            ("write_at", self, (offset, bytes(data))), len(data)
+        )
+
+    def flush(self) -> None:
+        """Hands the buffered bytes to the writer's thread"""
+        if self._buffer:
+            # Handed over as is, the writer's thread is its only user now
+            data, self._buffer = self._buffer, bytearray()
+            self._disk_writer._submit(("write", self, data), len(data))
+
+    def close(self, on_closed: Optional[Callable[[], None]] = None) -> None:
+        """on_closed is called on the writer's thread once the file is
+        written and closed (and synced, depending on the policy)
+        """
+        if self.closed:
+            return
+        self.flush()
+        self.closed = True
+        self._disk_writer._submit(("close", self, on_closed), 0)
+
+
+class LocalFile:
+    """AsyncFile's interface over a file written by the calling thread"""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._file = open(path, "wb")
+
+    @property
+    def closed(self) -> bool:
+        return self._file.closed
+
+    def write(self, data: bytes) -> None:
+        self._file.write(data)
+
+    def tell(self) -> int:
+        return self._file.tell()
+
+    def write_at(self, offset: int, data: bytes) -> None:
+        position = self._file.tell()
+        self._file.seek(offset)
+        self._file.write(data)
+        self._file.seek(position)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self, on_closed: Optional[Callable[[], None]] = None) -> None:
+        if self._file.closed:
+            return
+        self._file.close()
+        if on_closed is not None:
+            on_closed()
+
+
+# (kind, file, argument)
+_Operation = Tuple[str, Optional[AsyncFile], object]
+
+
+class DiskWriter(threading.Thread):
+    def __init__(
+        self,
+        fsync_policy: FsyncPolicy = FsyncPolicy.ON_CLOSE,
+        fsync_interval: float = 1.0,
+        buffer_size: int = 2**20,
+        max_pending_bytes: int = 2**26,
+        *args,
+        **kwargs,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self._fsync_policy = fsync_policy
+        self._fsync_interval = fsync_interval
+        self._buffer_size = buffer_size
+        self._max_pending_bytes = max_pending_bytes
+        self._operations: Deque[Tuple[_Operation, int]] = collections.deque()
+        self._condition = threading.Condition()
+        self._pending_bytes = 0
+        self._bytes_written = 0
+        self._stall_seconds = 0.0
+        self._files_open = 0
+        # Written to since the last fsync, for FsyncPolicy.INTERVAL
+        self._dirty: Set[AsyncFile] = set()
+        self._stop_event = threading.Event()
+
+    def open(self, path: str) -> AsyncFile:
+        """A new file at path, truncated if it exists"""
+        return AsyncFile(self, path, self._buffer_size)
+
+    def call(self, function: Callable[[], None]) -> None:
+        """Runs function on the writer's thread after what was submitted
+        before, e.g. to delete files without racing their writes
+        """
+        self._submit(("call", None, function), 0)
+
+    def report(self) -> dict:
+        with self._condition:
+            return {
+                "pending_bytes": self._pending_bytes,
+                "bytes_written": self._bytes_written,
+                "stall_seconds": round(self._stall_seconds, 3),
+                "files_open": self._files_open,
+            }
+
+    def _submit(self, operation: _Operation, size: int) -> None:
+        with self._condition:
+            if self._pending_bytes + size > self._max_pending_bytes:
+                started = time.monotonic()
+                # A single write larger than the limit goes through alone
+                while (
+                    self._pending_bytes
+                    and self._pending_bytes + size > self._max_pending_bytes
+                    and self.is_alive()
+                ):
+                    self._condition.wait(0.5)
+                self._stall_seconds += time.monotonic() - started
+            self._operations.append((operation, size))
+            self._pending_bytes += size
+            self._condition.notify_all()
+
+    def run(self) -> None:
+        logger.debug(f"DiskWriter started, fsync {self._fsync_policy.value}")
+        next_fsync_at = time.monotonic() + self._fsync_interval
+        while True:
+            with self._condition:
+                while not self._operations and not self._stop_event.is_set():
+                    self._condition.wait(
+                        max(next_fsync_at - time.monotonic(), 0.01)
+                        if self._fsync_policy is FsyncPolicy.INTERVAL
+                        else 0.5
+                    )
+                    if (
+                        self._fsync_policy is FsyncPolicy.INTERVAL
+                        and time.monotonic() >= next_fsync_at
+                    ):
+                        break
+                # Whatever was submitted before stop() is still written
+                if not self._operations and self._stop_event.is_set():
+                    break
+                operation, size = (
+                    self._operations.popleft()
+                    if self._operations
+                    else (("noop", None, None), 0)
+                )
+
+            self._execute(operation)
+            with self._condition:
+                self._pending_bytes -= size
+                self._bytes_written += size
+                self._condition.notify_all()
+
+            if (
+                self._fsync_policy is FsyncPolicy.INTERVAL
+                and time.monotonic() >= next_fsync_at
+            ):
+                self._fsync_dirty()
+                next_fsync_at = time.monotonic() + self._fsync_interval
+
+        if self._fsync_policy is FsyncPolicy.INTERVAL:
+            self._fsync_dirty()
+        if self._files_open:
+            logger.warning(f"DiskWriter stopped with {self._files_open} open")
+        logger.debug("DiskWriter finished")
+
+    def _execute(self, operation: _Operation) -> None:
+        kind, async_file, argument = operation
+        if kind == "call":
+            self._call(argument)  # type: ignore
+            return
+        if async_file is None or async_file.failed:
+            return
+        try:
+            if kind == "open":
+                async_file.file = open(async_file.path, "wb")
+                self._files_open += 1
+                return
+            file = async_file.file
+            assert file is not None
+            if kind == "write":
+                file.write(argument)  # type: ignore
+                self._dirty.add(async_file)
+            elif kind == "write_at":
+                offset, data = cast(Tuple[int, bytes], argument)
+                position = file.tell()
+                file.seek(offset)
+                file.write(data)
+                file.seek(position)
+                self._dirty.add(async_file)
+            elif kind == "close":
+                if self._fsync_policy is not FsyncPolicy.NEVER:
+                    file.flush()
+                    os.fsync(file.fileno())
+                file.close()
+                async_file.file = None
+                self._dirty.discard(async_file)
+                self._files_open -= 1
+                if argument is not None:
+                    self._call(argument)  # type: ignore
+        except Exception as e:
+            # The file's later operations are skipped, the others go on
+            async_file.failed = True
+            logger.error(f"Failed to write {async_file.path}. Error: {e}")
+            if async_file.file is not None:
+                async_file.file.close()
+                async_file.file = None
+                self._files_open -= 1
+            self._dirty.discard(async_file)
+
+    @staticmethod
+    def _call(function: Callable[[], None]) -> None:
+        try:
+            function()
+        except Exception as e:
+            logger.error(f"DiskWriter call failed. Error: {e}")
+
+    def _fsync_dirty(self) -> None:
+        for async_file in self._dirty:
+            if async_file.file is None:
+                continue
+            try:
+                async_file.file.flush()
+                os.fsync(async_file.file.fileno())
+            except OSError as e:
+                logger.error(f"Failed to sync {async_file.path}: {e}")
+        self._dirty.clear()
+
+    def stop(self) -> None:
+        if not self._stop_event.is_set():
+            self._stop_event.set()
+            with self._condition:
+                self._condition.notify_all()
+        else:
+            logger.warning("Called stop on already stopping DiskWriter")
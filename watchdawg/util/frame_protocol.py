@@ -0,0 +1,197 @@
+"""Binary wire format spoken between TCPClient and the server.
+
+Every message starts with a fixed preamble:
+
+    magic (2s) | version (B) | message type (B) | body size (I)
+
+For FRAME messages the body is a fixed frame meta block followed by the raw
+encoded image bytes:
+
+    codec (B) | pad (x) | width (H) | height (H) | sequence (Q) |
+    timestamp (d) | <encoded image bytes>
+
+A connection starts with a HELLO from the client, whose body is its name
+in UTF-8, at most MAX_HELLO_SIZE bytes. The server periodically answers
+with FEEDBACK messages telling the client how fast it may send:
+
+    target fps (f) | queued frames (I) | dropped frames (Q) | lag (f)
+
+A target fps of 0 means no limit. Lag is how long, in seconds, the client's
+frames have recently waited on the server before reaching the model.
+
+Bodies larger than Config.MAX_MESSAGE_SIZE, or than their message type
+allows, are rejected from the preamble alone, before any is read.
+
+All integers are big-endian. The encoded image is never pickled, and the
+client never copies it: it hands the image to `sendmsg` as a memoryview.
+The server copies it once, out of its receive buffer (which the next
+message reuses) into the message queued for the decoder.
+"""
+import enum
+import struct
+from dataclasses import dataclass
+from typing import Union
+
+from watchdawg.config import Config
+
+__all__ = [
+    "PROTOCOL_VERSION",
+    "PREAMBLE_SIZE",
+    "FRAME_META_SIZE",
+    "MAX_HELLO_SIZE",
+    "MessageType",
+    "Codec",
+    "ProtocolError",
+    "Preamble",
+    "FrameMeta",
+    "Feedback",
+    "pack_frame_header",
+    "pack_hello",
+    "pack_feedback",
+    "unpack_preamble",
+    "unpack_frame_meta",
+    "unpack_hello",
+    "unpack_feedback",
+]
+
+
+MAGIC = b"WD"
+PROTOCOL_VERSION = 1
+
+_PREAMBLE = struct.Struct(">2sBBI")
+_FRAME_META = struct.Struct(">BxHHQd")
+_FEEDBACK = struct.Struct(">fIQf")
+
+PREAMBLE_SIZE = _PREAMBLE.size
+FRAME_META_SIZE = _FRAME_META.size
+MAX_HELLO_SIZE = 1024
+
+Buffer = Union[bytes, bytearray, memoryview]
+
+
+class MessageType(enum.IntEnum):
+    FRAME = 1
+    HELLO = 2
+    FEEDBACK = 3
+
+
+class Codec(enum.IntEnum):
+    JPEG = 1
+
+
+class ProtocolError(Exception):
+    pass
+
+
+@dataclass
+class Preamble:
+    message_type: MessageType
+    body_size: int
+
+
+@dataclass
+class FrameMeta:
+    codec: Codec
+    width: int
+    height: int
+    sequence: int
+    timestamp: float
+
+
+@dataclass
+class Feedback:
+    target_fps: float  # 0 is no limit
+    queued_frames: int
+    dropped_frames: int  # Total for the connection
+    lag: float = 0.0  # Seconds
+
+
+def _pack_preamble(message_type: MessageType, body_size: int) -> bytes:
+    return _PREAMBLE.pack(MAGIC, PROTOCOL_VERSION, message_type, body_size)
+
+
+def pack_frame_header(meta: FrameMeta, payload_size: int) -> bytes:
+    """Returns preamble + frame meta to be sent right before the payload"""
+    return _pack_preamble(
+        MessageType.FRAME, FRAME_META_SIZE + payload_size
+    ) + _FRAME_META.pack(
+        meta.codec,
+        meta.width,
+        meta.height,
+        meta.sequence,
+        meta.timestamp,
+    )
+
+
+def pack_hello(client_name: str) -> bytes:
+    body = client_name.encode("utf-8")
+    if len(body) > MAX_HELLO_SIZE:
+        raise ValueError(f"Client name longer than {MAX_HELLO_SIZE} bytes")
+    return _pack_preamble(MessageType.HELLO, len(body)) + body
+
+
+def pack_feedback(feedback: Feedback) -> bytes:
+    return _pack_preamble(
+        MessageType.FEEDBACK, _FEEDBACK.size
+    ) + _FEEDBACK.pack(
+        feedback.target_fps,
+        feedback.queued_frames,
+        feedback.dropped_frames,
+        feedback.lag,
+    )
+
+
+def unpack_preamble(
+    buffer: Buffer, max_body_size: int = Config.MAX_MESSAGE_SIZE
+) -> Preamble:
+    """Raises ProtocolError before anything is allocated for a body larger
+    than its message type allows
+    """
+    magic, version, message_type, body_size = _PREAMBLE.unpack_from(buffer)
+    if magic != MAGIC:
+        raise ProtocolError(f"Bad magic {magic!r}, not a watchdawg stream")
+    if version != PROTOCOL_VERSION:
+        raise ProtocolError(
+            f"Unsupported protocol version {version}, "
+            f"expected {PROTOCOL_VERSION}"
+        )
+    try:
+        message_type = MessageType(message_type)
+    except ValueError:
+        raise ProtocolError(f"Unknown message type {message_type}")
+    if message_type == MessageType.HELLO:
+        max_body_size = min(max_body_size, MAX_HELLO_SIZE)
+    elif message_type == MessageType.FEEDBACK:
+        max_body_size = min(max_body_size, _FEEDBACK.size)
+    elif message_type == MessageType.FRAME and body_size < FRAME_META_SIZE:
+        raise ProtocolError(f"FRAME body of {body_size} bytes has no meta")
+    if body_size > max_body_size:
+        raise ProtocolError(
+            f"{message_type.name} body of {body_size} bytes exceeds "
+            f"{max_body_size}"
+        )
+    return Preamble(message_type, body_size)
+
+
+def unpack_frame_meta(buffer: Buffer) -> FrameMeta:
+    codec, width, height, sequence, timestamp = _FRAME_META.unpack_from(buffer)
+    try:
+        codec = Codec(codec)
+    except ValueError:
+        raise ProtocolError(f"Unknown codec {codec}")
+    return FrameMeta(codec, width, height, sequence, timestamp)
+
+
+def unpack_hello(buffer: Buffer) -> str:
+    try:
+        return bytes(buffer).decode("utf-8")
+    except UnicodeDecodeError:
+        raise ProtocolError("Client name is not valid UTF-8")
+
+
+def unpack_feedback(buffer: Buffer) -> Feedback:
+    if len(buffer) != _FEEDBACK.size:
+        raise ProtocolError(
+            f"FEEDBACK body of {len(buffer)} bytes, expected {_FEEDBACK.size}"
+        )
+    return Feedback(*_FEEDBACK.unpack_from(buffer))
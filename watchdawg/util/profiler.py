@@ -0,0 +1,265 @@
+"""A sampling profiler meant to be switched on in a running server.
+
+While enabled, a background thread snapshots every thread's stack each
+interval with sys._current_frames() and counts identical stacks. Sections
+of the hot path wrapped in section() are timed per thread as well. On
+disable the profile is written to output_folder:
+
+- profile_<time>.collapsed: "thread;module:function;... count" lines, the
+  input of flamegraph.pl, speedscope or inferno
+- profile_<time>.json: CPU time per thread over the profile, section
+  timings and the top stacks
+
+Sampling costs one stack walk per thread per interval on the sampler
+thread, the interval grows if that takes more than max_overhead of the
+time. When disabled nothing runs and section() returns a shared no-op
+context manager.
+"""
+import collections
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+from types import FrameType
+from typing import (
+    ContextManager,
+    Counter,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import psutil
+
+from watchdawg.util.logger import get_logger
+
+
+logger = get_logger("profiler")
+
+
+class _SectionStats:
+    __slots__ = ("count", "total", "max")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+# Set while a profiler is enabled, read by section()
+_active_profiler: Optional["SamplingProfiler"] = None
+_noop_section = contextlib.nullcontext()
+
+
+def section(name: str) -> ContextManager:
+    """Times the with block as name on the current thread while a profiler
+    is enabled
+    """
+    profiler = _active_profiler
+    if profiler is None:
+        return _noop_section
+    return profiler._time_section(name)
+
+
+class SamplingProfiler:
+    def __init__(
+        self,
+        output_folder: str,
+        interval: float = 0.01,
+        max_depth: int = 64,
+        max_overhead: float = 0.05,
+    ) -> None:
+        self._output_folder = output_folder
+        self._interval = interval
+        self._max_depth = max_depth
+        self._max_overhead = max_overhead
+        self._stacks: Counter[str] = collections.Counter()
+        self._sections: Dict[Tuple[str, str], _SectionStats] = {}
+        self._sections_lock = threading.Lock()
+        self._thread_cpu_start: Dict[int, float] = {}
+        self._samples = 0
+        self._sampling_time = 0.0
+        self._started_at = 0.0
+        self._sampler: Optional[threading.Thread] = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self._sampler is not None
+
+    def enable(self) -> None:
+        global _active_profiler
+        with self._lock:
+            if self._sampler is not None:
+                return
+            if _active_profiler is not None:
+                logger.warning("Another profiler is already running")
+                return
+            self._stacks.clear()
+            self._sections.clear()
+            self._samples = 0
+            self._sampling_time = 0.0
+            self._thread_cpu_start = self._thread_cpu_times()
+            self._started_at = time.monotonic()
+            self._stop_event.clear()
+            self._sampler = threading.Thread(
+                name="SamplingProfiler", target=self._sample, daemon=True
+            )
+            self._sampler.start()
+            _active_profiler = self
+        logger.info(
+            f"Profiling every {self._interval * 1e3:.0f} ms, profile goes "
+            f"to {self._output_folder}"
+        )
+
+    def disable(self) -> Optional[str]:
+        """Stops profiling, returns the path of the written profile"""
+        global _active_profiler
+        with self._lock:
+            if self._sampler is None:
+                return None
+            _active_profiler = None
+            self._stop_event.set()
+            self._sampler.join()
+            self._sampler = None
+            return self._dump()
+
+    def toggle(self) -> None:
+        if self.enabled:
+            self.disable()
+        else:
+            self.enable()
+
+    @contextlib.contextmanager
+    def _time_section(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            key = (threading.current_thread().name, name)
+            with self._sections_lock:
+                stats = self._sections.get(key)
+                if stats is None:
+                    stats = self._sections[key] = _SectionStats()
+                stats.count += 1
+                stats.total += duration
+                stats.max = max(stats.max, duration)
+
+    def _sample(self) -> None:
+        own_id = threading.get_ident()
+        wait = self._interval
+        while not self._stop_event.wait(wait):
+            start = time.perf_counter()
+            names = {
+                thread.ident: thread.name for thread in threading.enumerate()
+            }
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                self._stacks[self._collapse(names, thread_id, frame)] += 1
+            self._samples += 1
+            took = time.perf_counter() - start
+            self._sampling_time += took
+            # Deep stacks or many threads sample less often, to keep the
+            # overhead under max_overhead
+            wait = max(self._interval, took / self._max_overhead)
+
+    def _collapse(
+        self,
+        names: Dict[Optional[int], str],
+        thread_id: int,
+        frame: Optional[FrameType],
+    ) -> str:
+        functions: List[str] = []
+        while frame is not None and len(functions) < self._max_depth:
+            code = frame.f_code
+            module = os.path.splitext(os.path.basename(code.co_filename))[0]
+            functions.append(f"{module}:{code.co_name}")
+            frame = frame.f_back
+        functions.append(names.get(thread_id, f"Thread {thread_id}"))
+        # Root first, semicolons separate the frames
+        return ";".join(
+            function.replace(";", ":") for function in reversed(functions)
+        )
+
+    @staticmethod
+    def _thread_cpu_times() -> Dict[int, float]:
+        """CPU seconds of every thread of the process by native thread ID"""
+        return {
+            thread.id: thread.user_time + thread.system_time
+            for thread in psutil.Process().threads()
+        }
+
+    def _thread_cpu_report(self, elapsed: float) -> Dict[str, dict]:
+        names = {
+            thread.native_id: thread.name for thread in threading.enumerate()
+        }
+        report = {}
+        cpu_times = self._thread_cpu_times()
+        for native_id, cpu_time in cpu_times.items():
+            used = cpu_time - self._thread_cpu_start.get(native_id, 0.0)
+            if used <= 0:
+                continue
+            # Threads started by C libraries (OpenCV, torch) have no name
+            name = names.get(native_id, f"native {native_id}")
+            report[name] = {
+                "cpu_seconds": round(used, 3),
+                "cpu_percent": round(used / elapsed * 100, 1),
+            }
+        return dict(
+            sorted(
+                report.items(),
+                key=lambda item: item[1]["cpu_seconds"],
+                reverse=True,
+            )
+        )
+
+    def _dump(self) -> str:
+        elapsed = max(time.monotonic() - self._started_at, 1e-9)
+        os.makedirs(self._output_folder, exist_ok=True)
+        prefix = os.path.join(
+            self._output_folder,
+            f"profile_{datetime.datetime.now():%Y%m%d_%H%M%S}",
+        )
+        with open(f"{prefix}.collapsed", "w") as f:
+            for stack, count in sorted(self._stacks.items()):
+                f.write(f"{stack} {count}\n")
+
+        with self._sections_lock:
+            sections = {
+                f"{thread}/{name}": {
+                    "count": stats.count,
+                    "total_s": round(stats.total, 3),
+                    "mean_ms": round(stats.total / stats.count * 1e3, 3),
+                    "max_ms": round(stats.max * 1e3, 3),
+                }
+                for (thread, name), stats in sorted(self._sections.items())
+            }
+        summary = {
+            "duration_s": round(elapsed, 2),
+            "samples": self._samples,
+            "sampling_overhead_percent": round(
+                self._sampling_time / elapsed * 100, 2
+            ),
+            "threads_cpu": self._thread_cpu_report(elapsed),
+            "sections": sections,
+            "top_stacks": [
+                {"stack": stack, "samples": count}
+                for stack, count in self._stacks.most_common(20)
+            ],
+        }
+        with open(f"{prefix}.json", "w") as f:
+            json.dump(summary, f, indent=2)
+        logger.info(
+            f"Profile of {elapsed:.1f}s ({self._samples} samples, sampling "
+            f"took {summary['sampling_overhead_percent']}%) written to "
+            f"{prefix}.collapsed and .json"
+        )
+        return f"{prefix}.collapsed"
@@ -1,6 +1,8 @@
 import os
+import time
 import psutil
 import functools
+from dataclasses import dataclass
 
 
 @functools.lru_cache(maxsize=1)
@@ -24,3 +26,50 @@ def get_current_process_ram_usage():
     """Returns the amount of memory in MB used by the current process"""
     process = _get_current_psutil_process()
     return process.memory_info().rss / (1024 * 1024)
+
+
+@dataclass(frozen=True)
+class ResourceUsage:
+    cpu_percent: float  # 100 is one core
+    rss_bytes: int
+    network_received_per_second: float  # Bytes, the whole host
+    network_sent_per_second: float
+
+
+class ResourceSampler:
+    """Measures the current process' CPU usage and the host's network
+    throughput between consecutive sample() calls, without blocking.
+    Keeps its own previous readings, so callers sampling at different rates
+    don't skew each other
+    """
+
+    def __init__(self) -> None:
+        self._process = _get_current_psutil_process()
+        self._last_at = time.monotonic()
+        self._last_cpu = self._cpu_seconds()
+        self._last_network = psutil.net_io_counters()
+
+    def _cpu_seconds(self) -> float:
+        times = self._process.cpu_times()
+        return times.user + times.system
+
+    def sample(self) -> ResourceUsage:
+        now = time.monotonic()
+        cpu = self._cpu_seconds()
+        network = psutil.net_io_counters()
+        elapsed = max(now - self._last_at, 1e-3)
+        usage = ResourceUsage(
+            cpu_percent=(cpu - self._last_cpu) / elapsed * 100,
+            rss_bytes=self._process.memory_info().rss,
+            network_received_per_second=(
+                network.bytes_recv - self._last_network.bytes_recv
+            )
+            / elapsed,
+            network_sent_per_second=(
+                network.bytes_sent - self._last_network.bytes_sent
+            )
+            / elapsed,
+        )
+        self._last_at, self._last_cpu = now, cpu
+        self._last_network = network
+        return usage
@@ -0,0 +1,86 @@
+import socket
+from typing import Optional
+
+from watchdawg.config import Config
+from watchdawg.util.frame_protocol import ProtocolError
+
+
+class SocketReader:
+    """Per-connection reader over a single preallocated buffer.
+
+    Data is received with recv_into() in chunks as large as the free space
+    in the buffer, and messages are handed out as memoryviews into that
+    buffer instead of being sliced out of a growing bytes object. A view
+    returned by read() stays valid only until the next call to read(), copy
+    it if it needs to outlive that. The buffer never grows past
+    max_message_size, larger reads raise ProtocolError.
+    """
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        capacity: int = Config.RECEIVE_BUFFER_SIZE,
+        max_message_size: int = Config.MAX_MESSAGE_SIZE,
+    ) -> None:
+        self._socket = sock
+        self._max_message_size = max_message_size
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        self._start = 0  # First unread byte
+        self._end = 0  # End of received data
+        self.bytes_received = 0
+
+    @property
+    def capacity(self) -> int:
+        return len(self._buffer)
+
+    def read(self, size: int) -> Optional[memoryview]:
+        """Returns a view over the next `size` bytes, or None if the peer
+        closed the connection before sending them
+        """
+        if size > self._max_message_size:
+            raise ProtocolError(
+                f"Read of {size} bytes exceeds {self._max_message_size}"
+            )
+        if self._end - self._start < size and not self._fill(size):
+            return None
+        view = self._view[self._start : self._start + size]
+        self._start += size
+        return view
+
+    def _fill(self, size: int) -> bool:
+        available = self._end - self._start
+        if not available:
+            self._start = self._end = 0
+        elif size > len(self._buffer):
+            self._grow(
+                min(
+                    max(size, 2 * len(self._buffer)),
+                    max(self._max_message_size, size),
+                )
+            )
+        elif self._start + size > len(self._buffer):
+            # Not enough room after the unread tail, move it to the front.
+            # memoryview assignment handles the overlap (memmove)
+            self._view[:available] = self._view[self._start : self._end]
+            self._start, self._end = 0, available
+        if size > len(self._buffer):
+            self._grow(size)
+
+        while self._end - self._start < size:
+            received = self._socket.recv_into(self._view[self._end :])
+            if not received:
+                return False
+            self._end += received
+            self.bytes_received += received
+        return True
+
+    def _grow(self, capacity: int) -> None:
+        # Views handed out earlier keep the old buffer alive, so allocate a
+        # new one rather than resizing the exported bytearray
+        available = self._end - self._start
+        buffer = bytearray(capacity)
+        view = memoryview(buffer)
+        view[:available] = self._view[self._start : self._end]
+        self._buffer, self._view = buffer, view
+        self._start, self._end = 0, available